@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from app import mongo_db
+
+logger = logging.getLogger(__name__)
+
+# fields with a unique index on users, in the order conflicts are reported
+UNIQUE_FIELDS = ("email", "username")
+DUPLICATE_MESSAGES = {"email": "Email already registered", "username": "Username already taken"}
+# unique fields whose index is in place, the others are looked up before inserting
+indexed_fields = set()
+
+
+class AccountExists(Exception):
+    def __init__(self, field):
+        super().__init__(DUPLICATE_MESSAGES.get(field, "Account already exists"))
+        self.field = field
+
+
+async def ensure_user_indexes():
+    """Unique email and username, registration relies on them instead of looking users up first."""
+    for field in UNIQUE_FIELDS:
+        try:
+            await mongo_db.user_collection.create_index(field, unique=True)
+            indexed_fields.add(field)
+        except OperationFailure as e:
+            # existing duplicates, until they are cleaned up new accounts are looked up before inserting
+            indexed_fields.discard(field)
+            logger.error(f"Could not create the unique index on users.{field}, checking it by lookup: {e}")
+
+
+async def find_taken(emails, usernames) -> dict:
+    """field -> the given values already used by an account, only for fields without a unique index."""
+    values = {"email": set(emails), "username": set(usernames)}
+    missing = [field for field in UNIQUE_FIELDS if field not in indexed_fields and values[field]]
+    if not missing:
+        return {}
+    taken = {field: set() for field in missing}
+    async for doc in mongo_db.user_collection.find(
+        {"$or": [{field: {"$in": list(values[field])}} for field in missing]}, {field: 1 for field in missing}
+    ):
+        for field in missing:
+            if doc.get(field) in values[field]:
+                taken[field].add(doc[field])
+    return taken
+
+
+def duplicate_field(details: dict, message: str = "") -> str:
+    """Which unique field a duplicate key error is about, from its details or write error."""
+    fields = list((details or {}).get("keyPattern") or (details or {}).get("keyValue") or {})
+    if not fields:
+        # older servers only put the index name in the message
+        fields = [f for f in UNIQUE_FIELDS if f in message]
+    return fields[0] if fields else "email"
+
+
+def new_user_document(user, hashed_password: str, created_at: datetime, user_id=None) -> dict:
+    return {
+        "_id": user_id or ObjectId(),
+        "email": user.email,
+        "username": user.username,
+        "full_name": user.name,
+        "hashed_password": hashed_password,
+        "is_active": True,
+        "is_verified": False,
+        "created_at": created_at,
+        "updated_at": None,
+        "profile": {
+            "date_of_birth": getattr(user, "date_of_birth", None),
+            "gender": getattr(user, "gender", None),
+            "grade_level": getattr(user, "grade_level", None),
+            # set by the profile_image job once the upload is done
+            "profile_image": None,
+        },
+        "conversation_state": {},
+        "mental_age": None,
+        "assessment": {
+            "data": None,
+            "date": None
+        }
+    }
+
+
+def companion_documents(user_id, created_at: datetime) -> dict:
+    """collection name -> the document every new user gets in it."""
+    return {
+        "user_profiles": {
+            "user_id": user_id,
+            "bio": None,
+            "interests": [],
+            "created_at": created_at,
+            "updated_at": None,
+        },
+        "user_courses": {
+            "user_id": user_id,
+            "enrolled_courses": [],
+            "completed_courses": [],
+            "created_at": created_at,
+            "updated_at": None,
+        },
+        "user_progress": {
+            "user_id": user_id,
+            "progress": {},
+            "last_activity": None,
+            "created_at": created_at,
+            "updated_at": None,
+        },
+    }
+
+
+def _collection(name):
+    return getattr(mongo_db, name)
+
+
+async def create_account(user, hashed_password: str) -> dict:
+    """
+    Writes the user and its companion documents concurrently, in one round trip.
+
+    The user id is made here so nothing waits for the users insert. If the unique index
+    turns the user down the companions are deleted again and AccountExists is raised,
+    that only costs a second round trip on the rare conflict. While an index is missing
+    the user is looked up first, as registration did before.
+    """
+    taken = await find_taken([user.email], [user.username])
+    for field in UNIQUE_FIELDS:
+        if taken.get(field):
+            raise AccountExists(field)
+    created_at = datetime.now(timezone.utc)
+    db_user = new_user_document(user, hashed_password, created_at)
+    companions = companion_documents(db_user["_id"], created_at)
+    results = await asyncio.gather(
+        mongo_db.user_collection.insert_one(db_user),
+        *(_collection(name).insert_one(doc) for name, doc in companions.items()),
+        return_exceptions=True,
+    )
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        await asyncio.gather(
+            *(_collection(name).delete_many({"user_id": db_user["_id"]}) for name in companions),
+            # a companion failed but the user went in
+            *([mongo_db.user_collection.delete_one({"_id": db_user["_id"]})]
+              if not isinstance(results[0], BaseException) else []),
+        )
+        if isinstance(results[0], DuplicateKeyError):
+            raise AccountExists(duplicate_field(results[0].details, str(results[0])))
+        raise errors[0]
+    return db_user
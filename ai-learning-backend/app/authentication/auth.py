@@ -1,22 +1,60 @@
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 import os
+import copy
+import uuid
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from jose import jwt, JWTError
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer
 from app import mongo_db
+from app.authentication.passwords import hash_pool, pwd_context
+from app.authentication.tokens import revocations
 load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# "lookup" loads the user behind a token from Mongo (cached), "stateless" trusts the signed claims
+# and keeps access tokens short, refresh tokens bring the claims up to date
+AUTH_MODE = os.getenv("AUTH_MODE", "lookup")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "5" if AUTH_MODE == "stateless" else "30"))
+# "kid:secret,kid:secret", the first key signs and all of them verify, so a new key can be put
+# first and the old one removed once its tokens have expired. Tokens from before key ids were
+# signed with SECRET_KEY and carry no kid, they are accepted while SECRET_KEY is one of the keys.
+JWT_KEYS = os.getenv("JWT_KEYS", "")
+# authenticated users are cached per token (subject and issue time), writes to a user invalidate them
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+# what requests read from the current user, the password hash is never loaded
+USER_FIELDS = {"email": 1, "username": 1, "full_name": 1, "profile": 1, "created_at": 1, "is_active": 1,
+               "token_version": 1}
+
+
+def parse_keys(spec: str):
+    """(kid that signs, {kid: secret}) from JWT_KEYS, SECRET_KEY alone when it isn't set."""
+    keys = {}
+    for item in spec.split(","):
+        kid, _, secret = item.strip().partition(":")
+        if kid and secret:
+            keys[kid] = secret
+    if not keys:
+        keys = {"default": SECRET_KEY}
+    return next(iter(keys)), keys
+
+
+def legacy_key(keys: dict):
+    """Secret that verifies tokens without a kid, None once SECRET_KEY was rotated out of JWT_KEYS."""
+    return SECRET_KEY if SECRET_KEY in keys.values() else None
+
+
+SIGNING_KID, SIGNING_KEYS = parse_keys(JWT_KEYS)
+LEGACY_KEY = legacy_key(SIGNING_KEYS)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 
+# blocking, request handlers use hash_pool from app.authentication.passwords
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -25,20 +63,65 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+def _encode(claims: dict) -> str:
+    return jwt.encode(claims, SIGNING_KEYS[SIGNING_KID], algorithm=ALGORITHM, headers={"kid": SIGNING_KID})
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (
         expires_delta if expires_delta else timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # jti lets a single token be revoked at logout
+    to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc), "jti": uuid.uuid4().hex, "typ": "access"})
+    return _encode(to_encode)
+
+
+def create_refresh_token(email: str, version: int, jti: str, family: str, expires_at: datetime) -> str:
+    return _encode({
+        "sub": email, "ver": version, "jti": jti, "fam": family, "typ": "refresh",
+        "iat": datetime.now(timezone.utc), "exp": expires_at,
+    })
+
+
+def user_claims(user: dict) -> dict:
+    """What an access token says about its user, everything requests need in stateless mode."""
+    claims = {"sub": user["email"], "ver": user.get("token_version", 0)}
+    if AUTH_MODE == "stateless":
+        profile = user.get("profile") or {}
+        created_at = user.get("created_at")
+        if created_at and created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        claims.update({
+            "uid": user["id"],
+            "username": user.get("username"),
+            "name": user.get("full_name"),
+            "grade": profile.get("grade_level"),
+            "img": profile.get("profile_image"),
+            "since": int(created_at.timestamp()) if created_at else None,
+        })
+    return claims
+
+
+def user_from_claims(payload: dict) -> dict:
+    since = payload.get("since")
+    return {
+        "id": payload["uid"],
+        "email": payload["sub"],
+        "username": payload.get("username"),
+        "full_name": payload.get("name"),
+        "profile": {"grade_level": payload.get("grade"), "profile_image": payload.get("img")},
+        "created_at": datetime.fromtimestamp(since, timezone.utc) if since else None,
+        "token_version": payload.get("ver", 0),
+    }
 
 
 async def authenticate_user(email: str, password: str):
     user = await mongo_db.user_collection.find_one({"email": email})
     if not user:
         return False
-    if not verify_password(password, user["hashed_password"]):
+    ok, _ = await hash_pool.verify(password, user["hashed_password"])
+    if not ok:
         return False
     user["id"] = str(user["_id"])
     user.pop("_id", None)
@@ -56,34 +139,106 @@ async def get_token_from_cookie(request: Request) -> str:
     return token
 
 
-async def get_current_user(request: Request):
-    token = request.cookies.get("access_token")
+def decode_token(token: str, token_type: str = "access") -> dict:
+    """Claims of a valid token of this type, 401 if it is missing, expired, malformed or revoked."""
     if not token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authenticated",
         )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str | None = payload.get("sub")
-        if email is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token payload",
-            )
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = SIGNING_KEYS.get(kid) if kid else LEGACY_KEY
+        if key is None:
+            raise JWTError(f"unknown key id {kid}" if kid else "tokens without a key id are retired")
+        payload = jwt.decode(token, key, algorithms=[ALGORITHM])
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired token",
         )
+    if payload.get("sub") is None or payload.get("typ", "access") != token_type:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token payload",
+        )
+    if token_type == "access" and revocations.is_revoked(payload):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked",
+        )
+    return payload
 
-    user = await mongo_db.user_collection.find_one({"email": email})
+
+def decode_access_token(token: str) -> dict:
+    """Claims of a valid access token, 401 if it is missing, expired, malformed or revoked."""
+    return decode_token(token, "access")
+
+
+class UserCache:
+    """LRU + TTL cache of the projected user records behind access tokens."""
+
+    def __init__(self, size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.memory = TTLCache(maxsize=size, ttl=ttl)
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, payload: dict):
+        user = self.memory.get((payload["sub"], payload.get("iat")))
+        self.stats["hits" if user is not None else "misses"] += 1
+        # callers may change the dict they get
+        return copy.deepcopy(user) if user is not None else None
+
+    def put(self, payload: dict, user: dict):
+        self.memory[(payload["sub"], payload.get("iat"))] = copy.deepcopy(user)
+
+    def invalidate(self, email: str):
+        """Drops every cached token of the user, call it after writing to their user document."""
+        for key in [k for k in list(self.memory.keys()) if k[0] == email]:
+            self.memory.pop(key, None)
+            self.stats["invalidations"] += 1
+
+
+user_cache = UserCache()
+
+
+def get_user_cache_stats():
+    lookups = user_cache.stats["hits"] + user_cache.stats["misses"]
+    return {
+        **user_cache.stats,
+        "size": len(user_cache.memory),
+        "hit_ratio": user_cache.stats["hits"] / lookups if lookups else 0.0,
+    }
+
+
+async def load_user(email: str) -> dict:
+    user = await mongo_db.user_collection.find_one({"email": email}, USER_FIELDS)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
         )
-    user["id"] = str(user["_id"])
-    user.pop("_id", None)
-    user.pop("hashed_password", None)
-    return user
\ No newline at end of file
+    user["id"] = str(user.pop("_id"))
+    return user
+
+
+async def resolve_user(payload: dict) -> dict:
+    """
+    User behind a decoded access token. In stateless mode that is the token's claims, no
+    database involved; otherwise it is read from the cache when the same token was seen recently.
+    """
+    if AUTH_MODE == "stateless" and "uid" in payload:
+        return user_from_claims(payload)
+    user = user_cache.get(payload)
+    if user is None:
+        user = await load_user(payload["sub"])
+        user_cache.put(payload, user)
+    return user
+
+
+async def get_current_user(request: Request):
+    # resolved once per request, also for code that calls this outside of Depends
+    user = getattr(request.state, "user", None)
+    if user is None:
+        payload = decode_access_token(request.cookies.get("access_token"))
+        user = request.state.user = await resolve_user(payload)
+    return user
@@ -0,0 +1,147 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import dotenv
+from passlib.context import CryptContext
+
+from app.services.telemetry import password_hash_duration
+
+dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+# "bcrypt" or "argon2" (argon2id), hashes of the other scheme are upgraded when their user logs in
+PASSWORD_SCHEME = os.getenv("PASSWORD_SCHEME", "bcrypt")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_KIB = int(os.getenv("ARGON2_MEMORY_KIB", "65536"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+# bcrypt and argon2 release the GIL while hashing, so threads use every core; "process" is there
+# for builds where they don't
+HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# hashes queued or running before new ones are turned away
+HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+# roster imports hash on their own process pool so a class upload doesn't queue ahead of logins
+BULK_HASH_WORKERS = int(os.getenv("BULK_HASH_WORKERS", str(os.cpu_count() or 1)))
+BULK_HASH_MAX_PENDING = 10000
+
+
+def build_context(scheme=PASSWORD_SCHEME, bcrypt_rounds=BCRYPT_ROUNDS):
+    """
+    Hashes with `scheme` and still verifies the other one. needs_update() is true for hashes of
+    the other scheme and for hashes made with a lower cost than the configured one.
+    """
+    schemes = ["argon2", "bcrypt"] if scheme == "argon2" else ["bcrypt", "argon2"]
+    return CryptContext(
+        schemes=schemes,
+        deprecated="auto",
+        bcrypt__rounds=bcrypt_rounds,
+        argon2__type="ID",
+        argon2__time_cost=ARGON2_TIME_COST,
+        argon2__memory_cost=ARGON2_MEMORY_KIB,
+        argon2__parallelism=ARGON2_PARALLELISM,
+    )
+
+
+pwd_context = build_context()
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+# module level so they can be sent to a process pool, workers build pwd_context from the same settings
+def _hash(password):
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password, hashed_password):
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    return func(*args), time.perf_counter() - start
+
+
+class HashPool:
+    """
+    Runs password hashing off the event loop on a fixed number of workers.
+
+    A bcrypt or argon2 hash takes a few hundred milliseconds of CPU on purpose, run inline it
+    stops every other request for that long. Work past max_pending is refused with HashPoolBusy
+    instead of growing a queue that would time out anyway.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING, executor=HASH_EXECUTOR):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.kind = executor
+        self.executor = None
+        self.pending = 0
+        self.stats = {"hashes": 0, "verifies": 0, "rehashes": 0, "rejected": 0}
+
+    def _executor(self):
+        # created on first use, importing the module doesn't start workers
+        if self.executor is None:
+            if self.kind == "process":
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self.executor
+
+    async def run(self, operation, func, *args):
+        if self.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise HashPoolBusy(f"{self.pending} password hashes already pending")
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            result, work = await asyncio.get_running_loop().run_in_executor(self._executor(), _timed, func, *args)
+        finally:
+            self.pending -= 1
+        password_hash_duration.observe(work, operation=operation, phase="work")
+        password_hash_duration.observe(time.perf_counter() - start - work, operation=operation, phase="wait")
+        return result
+
+    async def hash(self, password: str) -> str:
+        hashed = await self.run("hash", _hash, password)
+        self.stats["hashes"] += 1
+        return hashed
+
+    async def verify(self, password: str, hashed_password: str):
+        """(matches, new hash or None), the new hash is set when the stored one uses outdated settings."""
+        ok, new_hash = await self.run("verify", _verify_and_update, password, hashed_password)
+        self.stats["verifies"] += 1
+        if new_hash:
+            self.stats["rehashes"] += 1
+        return ok, new_hash
+
+    async def hash_many(self, passwords) -> list:
+        """Hashes a batch in parallel on all workers, in order."""
+        hashed = await asyncio.gather(*(self.run("hash_many", _hash, password) for password in passwords))
+        self.stats["hashes"] += len(hashed)
+        return hashed
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+hash_pool = HashPool()
+bulk_hash_pool = HashPool(workers=BULK_HASH_WORKERS, max_pending=BULK_HASH_MAX_PENDING, executor="process")
+
+
+def get_hash_pool_stats():
+    stats = {}
+    for prefix, pool in (("", hash_pool), ("bulk_", bulk_hash_pool)):
+        stats.update({f"{prefix}{k}": v for k, v in pool.stats.items()})
+        stats.update({
+            f"{prefix}pending": pool.pending,
+            f"{prefix}queued": max(0, pool.pending - pool.workers),
+            f"{prefix}workers": pool.workers,
+        })
+    return stats
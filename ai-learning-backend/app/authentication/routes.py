@@ -1,92 +1,113 @@
+import logging
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
 from datetime import timedelta, datetime, timezone
+from bson import ObjectId
 from dotenv import load_dotenv
 from app import mongo_db
 from app.model.user_model import UserCreate, UserResponse, UserLogin, Token, UserOut
+from pymongo import ReturnDocument
 from app.authentication.auth import (
-    get_password_hash,
-    verify_password,
     create_access_token,
+    create_refresh_token,
+    decode_token,
+    load_user,
+    user_cache,
+    user_claims,
     ACCESS_TOKEN_EXPIRE_MINUTES,
+    AUTH_MODE,
+    USER_FIELDS,
     get_current_user
 )
-from app.middleware.cloudinary_middleware import upload_profile_image
+from app.authentication.accounts import AccountExists, create_account
+from app.authentication.passwords import HashPoolBusy, hash_pool
+from app.authentication.tokens import REFRESH_TOKEN_EXPIRE_DAYS, refresh_tokens, revocations
+from app.middleware.cloudinary_middleware import upload_image_data
+from app.services.jobs import PRIORITY_BULK, QueueFull, job_queue, new_job_token, register_job
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+
+async def run_hash(operation, *args):
+    try:
+        return await operation(*args)
+    except HashPoolBusy:
+        raise HTTPException(503, "Too many sign-ins at once, please try again in a moment.",
+                            headers={"Retry-After": "2"})
+
+
+async def start_session(response: Response, user: dict, family: str = None):
+    """Sets the access token cookie, and in stateless mode a refresh token of the same family."""
+    access_token = create_access_token(
+        data=user_claims(user),
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    response.set_cookie(
+        key="access_token",
+        value=access_token,
+        httponly=True,
+        max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        samesite="none",
+        secure=True
+    )
+    if AUTH_MODE == "stateless":
+        jti, family, expires_at = await refresh_tokens.issue(user["email"], family)
+        response.set_cookie(
+            key="refresh_token",
+            value=create_refresh_token(user["email"], user.get("token_version", 0), jti, family, expires_at),
+            httponly=True,
+            max_age=REFRESH_TOKEN_EXPIRE_DAYS * 24 * 3600,
+            samesite="none",
+            secure=True,
+            # only sent to /auth/refresh and /auth/logout
+            path="/auth"
+        )
+
+
+@register_job("profile_image")
+async def profile_image_job(payload: dict) -> dict:
+    """Uploads the image sent at registration and links it to the user."""
+    url = await upload_image_data(payload["image"], payload["username"])
+    await mongo_db.user_collection.update_one(
+        {"_id": ObjectId(payload["user_id"])},
+        {"$set": {"profile.profile_image": url, "updated_at": datetime.now(timezone.utc)}},
+    )
+    user_cache.invalidate(payload["email"])
+    return {"profile_image": url}
+
+
 @router.post("/register", response_model=UserOut, status_code=status.HTTP_201_CREATED)
 async def register_user(user: UserCreate):
-    existing_user = await mongo_db.user_collection.find_one({
-        "$or": [
-            {"email": user.email},
-            {"username": user.username}
-        ]
-    })
-    print(f"Existing user check: {existing_user}")  
-    if existing_user:
-        if existing_user.get("email") == user.email:
-            raise HTTPException(status_code=400, detail="Email already registered")
-        else:
-            raise HTTPException(status_code=400, detail="Username already taken")
-    profile_image_url = None
-    if getattr(user, "profile_image", None):
-        profile_image_url = await upload_profile_image(
-            image_data=user.profile_image,
-            user_id=user.username
-        )
-    hashed_password = get_password_hash(user.password)
-    created_at = datetime.now(timezone.utc)
-    db_user = {
-        "email": user.email,
-        "username": user.username,
-        "full_name": user.name,
-        "hashed_password": hashed_password,
-        "is_active": True,
-        "is_verified": False,
-        "created_at": created_at,
-        "updated_at": None,
-        "profile": {
-            "date_of_birth": getattr(user, "date_of_birth", None),
-            "gender": getattr(user, "gender", None),
-            "grade_level": getattr(user, "grade_level", None),
-            "profile_image": profile_image_url,
-        },
-        "conversation_state": {},
-        "mental_age": None,
-        "assessment": {
-            "data": None,
-            "date": None
+    hashed_password = await run_hash(hash_pool.hash, user.password)
+    try:
+        db_user = await create_account(user, hashed_password)
+    except AccountExists as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    image_url, image_status, image_job, image_token = None, None, None, None
+    if user.profile_image:
+        payload = {
+            "user_id": str(db_user["_id"]), "email": user.email,
+            "username": user.username, "image": user.profile_image,
         }
-    }
-    result= await mongo_db.user_collection.insert_one(db_user)
-    user_id = result.inserted_id
-
-    await mongo_db.user_profiles.insert_one({
-        "user_id": user_id,
-        "bio": None,
-        "interests": [],
-        "created_at": created_at,
-        "updated_at": None,
-    })
-
-    await mongo_db.user_courses.insert_one({
-        "user_id": user_id,
-        "enrolled_courses": [],
-        "completed_courses": [],
-        "created_at": created_at,
-        "updated_at": None,
-    })
-
-    await mongo_db.user_progress.insert_one({
-        "user_id": user_id,
-        "progress": {},
-        "last_activity": None,
-        "created_at": created_at,
-        "updated_at": None,
-    })
-    
+        # the account doesn't wait for Cloudinary, the image shows up once the job has run; the
+        # user isn't logged in yet, so the job is polled with its token instead of a session
+        image_token = new_job_token()
+        try:
+            image_job = await job_queue.submit(
+                "profile_image", payload, PRIORITY_BULK, owner=db_user["_id"], token=image_token
+            )
+            image_status = "pending"
+        except QueueFull:
+            image_token = None
+            # uploaded right away instead, slower but the image isn't lost
+            try:
+                image_url = (await profile_image_job(payload))["profile_image"]
+                image_status = "uploaded"
+            except Exception as e:
+                logger.error(f"Profile image of {user.username} could not be uploaded: {e}")
+                image_status = "failed"
     return UserOut(
         name=user.name,
         username=user.username,
@@ -94,28 +115,49 @@ async def register_user(user: UserCreate):
         date_of_birth=user.date_of_birth,
         gender=user.gender,
         grade_level=user.grade_level,
-        profile_image=profile_image_url or "",
-        created_at=created_at
+        profile_image=image_url or "",
+        profile_image_status=image_status,
+        profile_image_job=image_job,
+        profile_image_job_token=image_token,
+        created_at=db_user["created_at"]
     )
 
 
 @router.post("/login", response_model=Token)
 async def login_user(login_data: UserLogin, response: Response):
-    user = await mongo_db.user_collection.find_one({"email": login_data.email})
-    if not user or not verify_password(login_data.password, user["hashed_password"]):
-        raise HTTPException(status_code=401, detail="Incorrect email or password")
-    access_token = create_access_token(
-        data={"sub": user["email"]},
-        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    )
-    response.set_cookie(
-        key="access_token",
-        value=access_token,
-        httponly=True,
-        max_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
-        samesite="none",
-        secure=True
+    user = await mongo_db.user_collection.find_one(
+        {"email": login_data.email}, {**USER_FIELDS, "hashed_password": 1}
     )
+    if not user:
+        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    ok, new_hash = await run_hash(hash_pool.verify, login_data.password, user["hashed_password"])
+    if not ok:
+        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    if new_hash:
+        # hashed with an older scheme or cost, matched on the old hash so a password change in between wins
+        await mongo_db.user_collection.update_one(
+            {"_id": user["_id"], "hashed_password": user["hashed_password"]},
+            {"$set": {"hashed_password": new_hash}},
+        )
+    user["id"] = str(user.pop("_id"))
+    await start_session(response, user)
+    return Token(email=user["email"])
+
+
+@router.post("/refresh", response_model=Token)
+async def refresh_session(request: Request, response: Response):
+    """
+    Swaps the refresh token cookie for a new access and refresh token. The access token
+    claims are read again from the user document here. Each refresh token works once; a
+    replayed one ends every session that came from the same login.
+    """
+    payload = decode_token(request.cookies.get("refresh_token"), "refresh")
+    if not await refresh_tokens.rotate(payload):
+        raise HTTPException(status_code=401, detail="Refresh token already used, please log in again")
+    user = await load_user(payload["sub"])
+    if user.get("token_version", 0) != payload.get("ver", 0):
+        raise HTTPException(status_code=401, detail="Session has been revoked, please log in again")
+    await start_session(response, user, family=payload["fam"])
     return Token(email=user["email"])
 
 
@@ -135,11 +177,46 @@ async def protected_route(current_user=Depends(get_current_user)):
 
 
 @router.post("/logout")
-async def logout(response: Response):
+async def logout(request: Request, response: Response):
+    # an expired or already revoked token has nothing left to revoke
+    try:
+        payload = decode_token(request.cookies.get("access_token"), "access")
+        if payload.get("jti"):
+            await revocations.revoke_token(payload["jti"], datetime.fromtimestamp(payload["exp"], timezone.utc))
+    except HTTPException:
+        pass
+    try:
+        await refresh_tokens.revoke_family(decode_token(request.cookies.get("refresh_token"), "refresh")["fam"])
+    except HTTPException:
+        pass
     response.delete_cookie(key="access_token")
+    response.delete_cookie(key="refresh_token", path="/auth")
     return {"message": "Logged out successfully"}
 
 
+@router.post("/logout-all")
+async def logout_everywhere(response: Response, current_user=Depends(get_current_user)):
+    """Ends every session of the user, on all devices, by moving to a new token version."""
+    user = await mongo_db.user_collection.find_one_and_update(
+        {"email": current_user["email"]},
+        {"$inc": {"token_version": 1}},
+        projection={"token_version": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    # older access tokens are refused until the last of them would have expired anyway
+    await revocations.revoke_user(
+        current_user["email"], user["token_version"],
+        datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+    await refresh_tokens.revoke_user(current_user["email"])
+    user_cache.invalidate(current_user["email"])
+    response.delete_cookie(key="access_token")
+    response.delete_cookie(key="refresh_token", path="/auth")
+    return {"message": "Logged out on all devices"}
+
+
 @router.get("/debug-token")
 async def debug_token(request: Request):
     headers = dict(request.headers)
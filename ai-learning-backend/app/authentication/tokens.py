@@ -0,0 +1,206 @@
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+import dotenv
+from pymongo import ASCENDING
+
+dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
+# a refresh token presented again this soon after its rotation is a second tab, not a replay
+REFRESH_REUSE_GRACE_SECONDS = int(os.getenv("REFRESH_REUSE_GRACE_SECONDS", "10"))
+# how stale another worker's view of logouts can get
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", "15"))
+
+REFRESH_COLLECTION = "refresh_tokens"
+REVOCATIONS_COLLECTION = "revoked_tokens"
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value):
+    # Mongo hands back naive UTC datetimes
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _collection(name):
+    from app.mongo_db import get_mongo_connection
+
+    return get_mongo_connection()[name]
+
+
+class RevocationList:
+    """
+    Token ids revoked before they expired and the lowest valid token version per user, in memory.
+
+    Checking a token costs a dict lookup. Revocations are written to Mongo and every worker
+    reads the new ones every REVOCATION_SYNC_SECONDS. The worker that revoked a token knows
+    about it straight away. Entries are dropped once the tokens they revoke would have
+    expired anyway, so the list stays as small as the set of live tokens.
+    """
+
+    def __init__(self, interval=REVOCATION_SYNC_SECONDS):
+        self.interval = interval
+        # jti -> expiry timestamp
+        self.tokens = {}
+        # email -> [lowest valid version, expiry timestamp]
+        self.versions = {}
+        self.synced_at = None
+        self.task = None
+        self._indexed = False
+        self.stats = {"checks": 0, "revoked": 0, "syncs": 0, "sync_errors": 0}
+
+    async def _collection(self):
+        collection = _collection(REVOCATIONS_COLLECTION)
+        if not self._indexed:
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+            await collection.create_index([("updated_at", ASCENDING)])
+            self._indexed = True
+        return collection
+
+    def is_revoked(self, payload: dict) -> bool:
+        self.stats["checks"] += 1
+        floor = self.versions.get(payload.get("sub"))
+        revoked = payload.get("jti") in self.tokens or (floor is not None and payload.get("ver", 0) < floor[0])
+        if revoked:
+            self.stats["revoked"] += 1
+        return revoked
+
+    async def revoke_token(self, jti: str, expires_at: datetime):
+        self.tokens[jti] = expires_at.timestamp()
+        await (await self._collection()).update_one(
+            {"_id": jti},
+            {"$set": {"kind": "token", "expires_at": expires_at, "updated_at": _now()}},
+            upsert=True,
+        )
+
+    async def revoke_user(self, email: str, version: int, expires_at: datetime):
+        """Revokes every token of the user issued with a version below `version`."""
+        floor = self.versions.get(email)
+        self.versions[email] = [max(version, floor[0] if floor else 0), expires_at.timestamp()]
+        await (await self._collection()).update_one(
+            {"_id": f"user:{email}"},
+            {"$max": {"version": version}, "$set": {
+                "kind": "user", "email": email, "expires_at": expires_at, "updated_at": _now(),
+            }},
+            upsert=True,
+        )
+
+    def _apply(self, doc):
+        expires = _as_utc(doc["expires_at"]).timestamp()
+        if doc.get("kind") == "user":
+            floor = self.versions.get(doc["email"])
+            if not floor or doc["version"] >= floor[0]:
+                self.versions[doc["email"]] = [doc["version"], expires]
+        else:
+            self.tokens[doc["_id"]] = expires
+
+    def _expire(self):
+        now = _now().timestamp()
+        for jti in [j for j, expires in self.tokens.items() if expires < now]:
+            del self.tokens[jti]
+        for email in [e for e, (_, expires) in self.versions.items() if expires < now]:
+            del self.versions[email]
+
+    async def sync(self):
+        """Reads the revocations written since the last sync, by any worker."""
+        started = _now()
+        query = {}
+        if self.synced_at:
+            # one interval of overlap covers writes from workers whose clocks run a bit behind
+            query = {"updated_at": {"$gte": self.synced_at - timedelta(seconds=self.interval)}}
+        async for doc in (await self._collection()).find(query):
+            self._apply(doc)
+        self.synced_at = started
+        self._expire()
+        self.stats["syncs"] += 1
+
+    async def _sync_forever(self):
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["sync_errors"] += 1
+                logger.warning(f"Revocation sync failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._sync_forever())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+
+class RefreshTokens:
+    """
+    Rotating refresh tokens. Each one can be exchanged once. They belong to a family that
+    starts at login, and a replayed token revokes its whole family.
+    """
+
+    def __init__(self):
+        self._indexed = False
+
+    async def _collection(self):
+        collection = _collection(REFRESH_COLLECTION)
+        if not self._indexed:
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+            await collection.create_index([("family", ASCENDING)])
+            await collection.create_index([("email", ASCENDING)])
+            self._indexed = True
+        return collection
+
+    async def issue(self, email: str, family: str = None):
+        """Stores a new refresh token, returns its (jti, family, expires_at)."""
+        jti, family = uuid.uuid4().hex, family or uuid.uuid4().hex
+        expires_at = _now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+        await (await self._collection()).insert_one({
+            "_id": jti, "family": family, "email": email, "expires_at": expires_at, "used_at": None,
+        })
+        return jti, family, expires_at
+
+    async def rotate(self, payload: dict) -> bool:
+        """Marks the token used, False (and the family revoked) if it was used or revoked before."""
+        collection = await self._collection()
+        now = _now()
+        doc = await collection.find_one_and_update(
+            {"_id": payload.get("jti"), "family": payload.get("fam"), "used_at": None},
+            {"$set": {"used_at": now}},
+        )
+        if doc:
+            return True
+        doc = await collection.find_one({"_id": payload.get("jti")}, {"used_at": 1, "revoked": 1})
+        if doc and doc.get("used_at") and not doc.get("revoked") and \
+                now - _as_utc(doc["used_at"]) < timedelta(seconds=REFRESH_REUSE_GRACE_SECONDS):
+            return True
+        logger.warning(f"Refresh token reuse for {payload.get('sub')}, revoking its family")
+        await self.revoke_family(payload.get("fam"))
+        return False
+
+    async def revoke_family(self, family: str):
+        await (await self._collection()).update_many(
+            {"family": family}, {"$set": {"revoked": True, "used_at": _now()}}
+        )
+
+    async def revoke_user(self, email: str):
+        await (await self._collection()).update_many(
+            {"email": email}, {"$set": {"revoked": True, "used_at": _now()}}
+        )
+
+
+revocations = RevocationList()
+refresh_tokens = RefreshTokens()
+
+
+def get_revocation_stats():
+    return {**revocations.stats, "tokens": len(revocations.tokens), "users": len(revocations.versions)}
@@ -1,5 +1,7 @@
 import os
-from fastapi import FastAPI
+import time
+import asyncio
+from fastapi import FastAPI, Request
 from sqlalchemy.orm import Session
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
@@ -8,12 +10,31 @@ from app.router.chatbot import router as chatbot_router
 from app.router.quiz import router as quiz_router
 from app.router.homework import router as hw_router
 from app.router.dashboard import router as dashboard_router
+from app.router.metrics import router as metrics_router
+from app.router.jobs import router as jobs_router
+from app.router.admin import router as admin_router
 from app.mongo_db import close_mongo_connection, connect_to_mongo
+from app.services.telemetry import current_endpoint, http_duration, span
+from app.services.token_budget import get_encoding, usage_recorder
+from app.services.jobs import job_queue
+from app.authentication.passwords import bulk_hash_pool, hash_pool
+from app.authentication.tokens import revocations
+from app.authentication.accounts import ensure_user_indexes
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await connect_to_mongo()
+    await ensure_user_indexes()
+    # tiktoken may download its BPE file on first use, keep that off the event loop
+    await asyncio.to_thread(get_encoding)
+    job_queue.start()
+    revocations.start()
     yield
+    await revocations.stop()
+    await job_queue.stop()
+    hash_pool.shutdown()
+    bulk_hash_pool.shutdown()
+    await usage_recorder.flush()
     await close_mongo_connection()
 
 app = FastAPI(title="Learning Platform", version="1.0.0", lifespan=lifespan)
@@ -28,6 +49,17 @@ app.add_middleware(
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    current_endpoint.set(request.url.path)
+    with span(f"{request.method} {request.url.path}"):
+        response = await call_next(request)
+    # the route template keeps the label count bounded, raw paths could carry ids
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    http_duration.observe(time.perf_counter() - start, method=request.method, route=route, status=response.status_code)
+    return response
+
 @app.get("/")
 async def root():
     return {"message": "FastAPI Authentication System is running!"}
@@ -44,3 +76,6 @@ app.include_router(chatbot_router)
 app.include_router(quiz_router)
 app.include_router(hw_router)
 app.include_router(dashboard_router)
+app.include_router(jobs_router)
+app.include_router(metrics_router)
+app.include_router(admin_router)
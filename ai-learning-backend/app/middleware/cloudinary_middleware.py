@@ -1,4 +1,5 @@
 import os
+import asyncio
 from dotenv import load_dotenv
 from bson import ObjectId
 import cloudinary
@@ -34,4 +35,15 @@ async def upload_profile_image(
 
     image_url = upload_res["secure_url"]
 
-    return image_url
\ No newline at end of file
+    return image_url
+
+async def upload_image_data(image_data: str, public_id: str) -> str:
+    """Uploads a data URI, base64 string or URL, the blocking Cloudinary call runs in a thread."""
+    upload_res = await asyncio.to_thread(
+        cloudinary.uploader.upload,
+        image_data,
+        folder="user_profiles",
+        public_id=public_id,
+        overwrite=True,
+    )
+    return upload_res["secure_url"]
@@ -22,6 +22,11 @@ class UserDB(MongoModel, UserBase):
 
 class UserOut(MongoModel, UserBase):
     created_at: datetime
+    # "pending" while the upload job runs, "uploaded" or "failed"
+    profile_image_status: Optional[str] = None
+    # poll GET /jobs/{profile_image_job}?token={profile_image_job_token}, no login needed
+    profile_image_job: Optional[str] = None
+    profile_image_job_token: Optional[str] = None
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -0,0 +1,78 @@
+import os
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+
+from app.schemas import RescoreAccepted, RescoreReport, RescoreRequest, RosterReport
+from app.services.roster import ROSTER_CHUNK_SIZE, detect_format, import_roster
+from app.services.chatbot.rescore import FINISHED, create_run, get_run, report, rescore_assessments
+from app.services.jobs import PRIORITY_BULK, register_job
+from app.router.jobs import accept_job
+
+# shared secret for operators, the admin routes are disabled while it is unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def require_admin(authorization: str | None = Header(default=None)):
+    if not ADMIN_TOKEN or authorization != f"Bearer {ADMIN_TOKEN}":
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+
+router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+
+@register_job("rescore_assessments")
+async def rescore_job(payload: dict) -> dict:
+    return await rescore_assessments(payload["run_id"])
+
+
+@router.post(
+    "/rescore-assessments",
+    status_code=202,
+    response_model=RescoreAccepted,
+    summary="Re-score stored assessments",
+    description="Re-evaluates the stored age assessments with the current prompt and model as a background job"
+)
+async def start_rescore(request: RescoreRequest):
+    if request.resume_run_id:
+        run = await get_run(request.resume_run_id)
+        if not run:
+            raise HTTPException(404, "Rescore run not found")
+        if run["status"] == FINISHED:
+            raise HTTPException(409, "Rescore run already finished")
+    else:
+        run = await create_run(
+            dry_run=request.dry_run, batch_size=request.batch_size,
+            concurrency=request.concurrency, limit=request.limit
+        )
+    return await accept_job(
+        "rescore_assessments", {"run_id": run["_id"]}, PRIORITY_BULK,
+        run_id=run["_id"], run_url=f"/admin/rescore-assessments/{run['_id']}"
+    )
+
+
+@router.get(
+    "/rescore-assessments/{run_id}",
+    response_model=RescoreReport,
+    summary="Get a re-scoring run",
+    description="Progress and throughput of a re-scoring run"
+)
+async def get_rescore(run_id: str):
+    run = await get_run(run_id)
+    if not run:
+        raise HTTPException(404, "Rescore run not found")
+    return report(run)
+
+
+@router.post(
+    "/roster",
+    response_model=RosterReport,
+    summary="Import a class roster",
+    description="Creates student accounts from a CSV (header line first) or NDJSON upload, "
+                "streamed in the request body. Rows that fail are listed and the rest are imported."
+)
+async def import_class_roster(
+    request: Request,
+    format: str | None = Query(None, pattern="^(csv|ndjson)$"),
+    chunk_size: int = Query(ROSTER_CHUNK_SIZE, ge=1, le=5000),
+):
+    fmt = format or detect_format(content_type=request.headers.get("content-type", ""))
+    return await import_roster(request.stream(), fmt, chunk_size)
@@ -1,25 +1,62 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from collections import deque
+import os
+import json
+import time
+import asyncio
 import logging
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from pymongo.errors import PyMongoError, DuplicateKeyError
 
 from app.mongo_db import get_mongo_connection as get_db
-from app.authentication.auth import get_current_user
+from app.authentication.auth import decode_access_token, get_current_user, resolve_user
 from app.schemas import (
     ChatMessage,
     ChatResponse,
     InitializeChatbotResponse,
-    ChatbotStatus
+    ChatbotStatus,
+    ChatHistoryPage,
+    HistoryMessage,
+    JobAccepted
 )
 
 from app.services.chatbot.agent_chatbot import (
+    backfill_messages,
+    flush_session,
     getState,
-    run_graph
+    get_graph_state,
+    pin_session,
+    run_graph,
+    run_turn,
+    session_dirty,
+    stream_turn,
+    unpin_session
 )
+from app.services.chatbot.checkpointer import CheckpointConflict
+from app.services.chatbot.messages import HISTORY_MAX_PAGE_SIZE, HISTORY_PAGE_SIZE, message_store
+from app.services.chatbot.turns import turn_coordinator
+from app.services.jobs import PRIORITY_INTERACTIVE, register_job
+from app.router.jobs import accept_job
 
 router = APIRouter(prefix="/chatbot", tags=["Chatbot"])
 logger = logging.getLogger(__name__)
 
+# the server pings a websocket this often, one that sent nothing for WS_IDLE_TIMEOUT is closed
+WS_HEARTBEAT_SECONDS = float(os.getenv("CHAT_WS_HEARTBEAT_SECONDS", "20"))
+WS_IDLE_TIMEOUT = float(os.getenv("CHAT_WS_IDLE_TIMEOUT", "60"))
+# how often a websocket's held-back conversation state is written to Mongo
+WS_FLUSH_SECONDS = float(os.getenv("CHAT_WS_FLUSH_SECONDS", "5"))
+# messages a client can send ahead of the reply it is waiting for
+WS_MAX_PENDING = int(os.getenv("CHAT_WS_MAX_PENDING", "4"))
+# how long a turn holds its session, a worker that dies mid-turn blocks the user's chat this long at most
+TURN_LEASE_SECONDS = float(os.getenv("CHAT_TURN_LEASE_SECONDS", "120"))
+
+COMPLETED_REPLY = "Assessment already completed. Thank you 🙏"
+CONFLICT_DETAIL = "Your chat is being updated by another request, please send your message again."
+
 class ChatStage:
     INIT = "INIT"
     ASSESSMENT_IN_PROGRESS = "ASSESSMENT_IN_PROGRESS"
@@ -27,7 +64,7 @@ class ChatStage:
 
 def determine_stage(state: dict) -> str:
     """Determines the current status of the conversation from the state."""
-    if state.get("follow_up_done"):
+    if state.get("final_guidance"):
         return ChatStage.ASSESSMENT_COMPLETED
     return ChatStage.ASSESSMENT_IN_PROGRESS
 
@@ -42,54 +79,30 @@ async def initialize_chatbot(
     db=Depends(get_db)
 ):
     user_id = str(current_user["id"])
-    username = current_user["name"]
     try:
         logger.info(f"Initializing chatbot for {user_id}")
-        session = await db.chat_sessions.find_one({"user_id": user_id})
+        session = await db.chat_sessions.find_one({"user_id": user_id}, {"current_stage": 1, "state": 1})
         if not session:
-            # Initialize new state (removed duplicate)
-            state = getState(None)
-            current_stage = ChatStage.ASSESSMENT_IN_PROGRESS
             # chatbot needs to be initialised if not exists in chat_sessions, if it exists it must start from that point.
-            # Run graph to get initial response
-            result = run_graph(state) # it should not run every time, just initialise the
+            # Run graph to get initial response, the checkpointer stores the state under the user's thread
+            result = await run_graph(getState(None), user_id)
             next_stage = determine_stage(result)
-
-            result="Chatbot initialised"
-            next_stage = ChatStage.ASSESSMENT_IN_PROGRESS
             try:
                 await db.chat_sessions.insert_one({
                     "user_id": user_id,
-                    "state": result,
                     "current_stage": next_stage,
+                    "version": 0,
                     "created_at": datetime.now(timezone.utc),
                     "updated_at": datetime.now(timezone.utc),
                 })
             except DuplicateKeyError:
                 # Handle race condition - another request created session
-                session = await db.chat_sessions.find_one({"user_id": user_id})
-                result = session["state"]
+                session = await db.chat_sessions.find_one({"user_id": user_id}, {"current_stage": 1})
                 next_stage = session["current_stage"]
         else:
-            # Session exists - use existing state
-            state = session["state"]
-            current_stage = session.get("current_stage", ChatStage.ASSESSMENT_IN_PROGRESS)
-            
-            # Run graph with existing state
-            # result = run_graph(state)
-            next_stage = determine_stage(result) # For initialization, we might not want to run the graph, just return a welcome message
-
-            # Single DB request - atomic update
-            await db.chat_sessions.update_one(
-                {"user_id": user_id},
-                {
-                    "$set": {
-                        "state": result,
-                        "current_stage": next_stage,
-                        "updated_at": datetime.now(timezone.utc)
-                    }
-                }
-            )
+            # Session exists - resume from the saved state without running the graph
+            result = await load_session_state(session, user_id)
+            next_stage = session.get("current_stage", ChatStage.ASSESSMENT_IN_PROGRESS)
 
         return InitializeChatbotResponse(
             session_id=user_id, 
@@ -108,61 +121,161 @@ async def initialize_chatbot(
         raise HTTPException(500, "Failed to initialize chatbot")
 
 
+async def load_session_state(session: dict, user_id: str) -> dict:
+    """Conversation state saved by the checkpointer, or the inline state of sessions created before it."""
+    state = await get_graph_state(user_id)
+    if not state and session.get("state"):
+        state = session["state"]
+    return state
+
+
+async def load_turn_session(db, user_id: str):
+    """
+    Loads the chat session a turn runs on.
+
+    Returns (session, version), where version is the session version the turn is based on
+    and session is None if the assessment is already done. The conversation state itself
+    stays in the checkpointer, the turn resumes the graph at the node waiting for input.
+    """
+    session = await db.chat_sessions.find_one({"user_id": user_id}, {"current_stage": 1, "state": 1, "version": 1})
+    if not session:
+        raise HTTPException(400, "Chat not initialized. Please initialize first.")
+    version = session.get("version", 0)
+    if session["current_stage"] == ChatStage.ASSESSMENT_COMPLETED:
+        return None, version
+    return session, version
+
+
+async def claim_turn(db, user_id: str, version: int) -> int:
+    """
+    Takes the session for one turn before the graph runs and returns the version the turn owns.
+
+    The checkpointer writes the conversation while the turn runs, so a concurrent turn has
+    to be turned away before that: the claim only applies if the session is still at the
+    version the turn was based on and no other turn holds it. A turn that ends without
+    save_turn_state gives the session back with release_turn.
+    """
+    now = datetime.now(timezone.utc)
+    claimed = await db.chat_sessions.update_one(
+        {
+            "user_id": user_id,
+            # sessions created before versioning have no version field
+            "version": version if version else {"$in": [0, None]},
+            "$or": [{"turn_until": None}, {"turn_until": {"$lt": now}}],
+        },
+        {"$set": {"version": version + 1, "turn_until": now + timedelta(seconds=TURN_LEASE_SECONDS)}}
+    )
+    if claimed.matched_count == 0:
+        if await db.chat_sessions.count_documents({"user_id": user_id}, limit=1):
+            logger.warning(f"Concurrent turn on chat session of user {user_id} at version {version}")
+            raise HTTPException(409, CONFLICT_DETAIL)
+        raise HTTPException(500, "Failed to update chat session")
+    return version + 1
+
+
+async def release_turn(db, user_id: str, version: int):
+    """Gives back a session claimed by a turn that failed, so the user can send again right away."""
+    await db.chat_sessions.update_one({"user_id": user_id, "version": version}, {"$unset": {"turn_until": ""}})
+
+
+async def save_turn_state(db, user_id: str, result: dict, version: int) -> str:
+    """Updates the session after a turn and returns the new stage.
+
+    The state itself is saved by the graph's checkpointer, which only writes the
+    changed fields and the new messages, so the session only gets its stage and is
+    released. `version` is the one claim_turn returned.
+    """
+    next_stage = determine_stage(result)
+    updated = await db.chat_sessions.update_one(
+        {"user_id": user_id, "version": version},
+        {
+            "$set": {
+                "current_stage": next_stage,
+                "updated_at": datetime.now(timezone.utc)
+            },
+            # inline state of older sessions now lives in the checkpointer
+            "$unset": {"state": "", "turn_until": ""}
+        }
+    )
+    if updated.matched_count == 0:
+        # the turn outlived its lease and another one claimed the session, that one sets the stage
+        logger.warning(f"Chat session of user {user_id} was claimed again before turn {version} was saved")
+    return next_stage
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def turn_event(item):
+    """(event, data) sent to the client for a stream_turn item other than the final state."""
+    if item[0] == "token":
+        return "token", {"node": item[1], "token": item[2]}
+    if item[0] == "result":
+        return "result", {"node": item[1], **item[2]}
+    return "node", {"node": item[1], "status": "started" if item[0] == "node_start" else "finished"}
+
+
+async def run_chat_turn(db, user_id: str, text: str) -> ChatResponse:
+    """One chat turn, shared by the /chat route and its background job."""
+
+    async def turn():
+        session, version = await load_turn_session(db, user_id)
+        # Check if assessment is completed
+        if session is None:
+            return ChatResponse(
+                response=COMPLETED_REPLY,
+                stage=ChatStage.ASSESSMENT_COMPLETED
+            )
+        version = await claim_turn(db, user_id, version)
+        # Process with agent
+        try:
+            result = await run_turn(user_id, text, session.get("state"))
+        except CheckpointConflict:
+            await release_turn(db, user_id, version)
+            raise HTTPException(409, CONFLICT_DETAIL)
+        except BaseException:
+            await asyncio.shield(release_turn(db, user_id, version))
+            raise
+        next_stage = await save_turn_state(db, user_id, result, version)
+
+        return ChatResponse(
+            response=result["current_response"],
+            stage=next_stage
+        )
+
+    # the user's turns run one after the other, a repeated send shares the running turn
+    return await turn_coordinator.run(user_id, text, turn)
+
+
+@register_job("chat_turn")
+async def chat_turn_job(payload: dict) -> dict:
+    response = await run_chat_turn(get_db(), payload["user_id"], payload["message"])
+    return response.model_dump(mode="json")
+
+
 @router.post(
     "/chat",
     response_model=ChatResponse,
+    responses={202: {"model": JobAccepted, "description": "Queued as a background job"}},
     summary="Send message to chatbot",
-    description="Processes user message"
+    description="Processes user message, or with background=true queues it and returns a job id"
 )
 async def chat_with_bot(
     message: ChatMessage,
+    background: bool = Query(False, description="Return 202 with a job id instead of waiting for the reply"),
     current_user=Depends(get_current_user),
     db=Depends(get_db)
 ):
     print("In chat- chatbot")
     user_id = str(current_user["id"])
-    try:
-        # Single DB request - find session
-        session = await db.chat_sessions.find_one({"user_id": user_id})
-        if not session:
-            raise HTTPException(400, "Chat not initialized. Please initialize first.")
-        # Check if assessment is completed
-        if session["current_stage"] == ChatStage.ASSESSMENT_COMPLETED:
-            return ChatResponse(
-                response="Assessment already completed. Thank you 🙏",
-                stage=ChatStage.ASSESSMENT_COMPLETED
-            )
-        # Work with state (in-memory operations, right now)
-        state = session["state"]
-        state["user_input"] = message.message
-        state["conversation_history"].append({
-            "role": "user",
-            "content": message.message,
-            "timestamp": datetime.now(timezone.utc).isoformat()
-        })
-        # Process with agent
-        result = run_graph(state)
-        next_stage = determine_stage(result)
-        # Single DB request - atomic update
-        updated_session = await db.chat_sessions.find_one_and_update(
-            {"user_id": user_id},
-            {
-                "$set": {
-                    "state": result,
-                    "current_stage": next_stage,
-                    "updated_at": datetime.now(timezone.utc)
-                }
-            },
-            return_document=True  # Returns updated document
+    if background:
+        return await accept_job(
+            "chat_turn", {"user_id": user_id, "message": message.message}, PRIORITY_INTERACTIVE, owner=user_id
         )
 
-        if not updated_session:
-            raise HTTPException(500, "Failed to update chat session")
-
-        return ChatResponse(
-            response=result["current_response"],
-            stage=next_stage
-        )
+    try:
+        return await run_chat_turn(db, user_id, message.message)
 
     except HTTPException:
         raise
@@ -173,6 +286,293 @@ async def chat_with_bot(
         logger.error(f"Error processing message for user {user_id}: {str(e)}")
         raise HTTPException(500, "Failed to process message")
 
+
+@router.post(
+    "/chat/stream",
+    summary="Send message to chatbot and stream the reply",
+    description="Processes user message and streams node events and LLM tokens as server-sent events"
+)
+async def chat_with_bot_stream(
+    message: ChatMessage,
+    current_user=Depends(get_current_user),
+    db=Depends(get_db)
+):
+    user_id = str(current_user["id"])
+    # the user's turn lock is held until the stream is over, so turns never overlap
+    await turn_coordinator.acquire(user_id)
+    # errors before the stream starts are returned as normal HTTP errors
+    try:
+        session, version = await load_turn_session(db, user_id)
+        if session is not None:
+            version = await claim_turn(db, user_id, version)
+    except PyMongoError as e:
+        turn_coordinator.release(user_id)
+        logger.error(f"MongoDB error for user {user_id}: {str(e)}")
+        raise HTTPException(500, "Database error occurred")
+    except BaseException:
+        turn_coordinator.release(user_id)
+        raise
+
+    async def events():
+        saved = session is None
+        try:
+            if session is None:
+                yield sse_event("done", {
+                    "response": COMPLETED_REPLY,
+                    "stage": ChatStage.ASSESSMENT_COMPLETED
+                })
+                return
+            async for item in stream_turn(user_id, message.message, session.get("state")):
+                if item[0] == "final":
+                    result = item[1]
+                else:
+                    yield sse_event(*turn_event(item))
+            # the turn is saved only once the graph stopped for the next input
+            next_stage = await save_turn_state(db, user_id, result, version)
+            saved = True
+            yield sse_event("done", {"response": result["current_response"], "stage": next_stage})
+        except CheckpointConflict:
+            yield sse_event("error", {"detail": CONFLICT_DETAIL, "status": 409})
+        except HTTPException as e:
+            yield sse_event("error", {"detail": e.detail, "status": e.status_code})
+        except Exception as e:
+            logger.error(f"Error streaming message for user {user_id}: {str(e)}")
+            yield sse_event("error", {"detail": "Failed to process message"})
+        finally:
+            # also runs when the client disconnects mid-stream
+            try:
+                if not saved:
+                    await asyncio.shield(release_turn(db, user_id, version))
+            finally:
+                turn_coordinator.release(user_id)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+class Outbox:
+    """
+    Events waiting to be sent on a websocket. Tokens the client doesn't read as fast as
+    they come are merged into the token event still waiting, so a slow client never
+    holds up the turn and the backlog stays a few events long.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.events = deque()
+        self.ready = asyncio.Event()
+
+    def put(self, event: str, data: dict):
+        last = self.events[-1] if self.events else None
+        if event == "token" and last and last["type"] == "token" and last["node"] == data["node"]:
+            last["token"] += data["token"]
+        else:
+            self.events.append({"type": event, **data})
+        self.ready.set()
+
+    async def send_forever(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.events:
+                await self.websocket.send_text(json.dumps(self.events.popleft(), default=str))
+
+
+class ChatConnection:
+    """
+    One authenticated websocket. The session and the conversation state are loaded once
+    and stay in memory while the connection is open. Turns run one at a time in arrival
+    order, and the state and session stage are written back every WS_FLUSH_SECONDS and
+    when the connection closes.
+    """
+
+    def __init__(self, websocket: WebSocket, db, user_id: str, session: dict, expires_at):
+        self.websocket = websocket
+        self.db = db
+        self.user_id = user_id
+        self.stage = session["current_stage"]
+        self.version = session.get("version", 0)
+        # inline state of sessions created before the checkpointer, only needed for the first turn
+        self.legacy_state = session.get("state")
+        self.expires_at = expires_at
+        self.outbox = Outbox(websocket)
+        self.pending = asyncio.Queue(WS_MAX_PENDING)
+        # state after the last turn while the session document doesn't have its stage yet
+        self.unsaved = None
+
+    async def serve(self):
+        pin_session(self.user_id)
+        tasks = [
+            asyncio.create_task(self.outbox.send_forever()),
+            asyncio.create_task(self.answer()),
+            asyncio.create_task(self.heartbeat()),
+            asyncio.create_task(self.flush_periodically()),
+        ]
+        try:
+            await self.receive()
+        finally:
+            # shielded, so the state is saved even when the server cancels the handler on shutdown
+            await asyncio.shield(self.shutdown(tasks))
+
+    async def shutdown(self, tasks):
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await self.flush()
+            await unpin_session(self.user_id)
+        except Exception as e:
+            # the conversation stays pinned in memory, the user's next connection writes it
+            logger.error(f"Could not save chat session of user {self.user_id} on close: {str(e)}")
+
+    async def receive(self):
+        """Reads client messages until the client leaves, goes quiet or its token expires."""
+        while True:
+            try:
+                data = await asyncio.wait_for(self.websocket.receive_json(), WS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                await self.close(status.WS_1001_GOING_AWAY, "Idle timeout")
+                return
+            except (WebSocketDisconnect, RuntimeError):
+                return
+            except ValueError:
+                self.outbox.put("error", {"detail": "Messages must be JSON"})
+                continue
+            if self.expires_at and time.time() >= self.expires_at:
+                await self.close(status.WS_1008_POLICY_VIOLATION, "Token expired")
+                return
+            kind = data.get("type") if isinstance(data, dict) else None
+            if kind == "ping":
+                self.outbox.put("pong", {})
+            elif kind == "message":
+                try:
+                    message = ChatMessage(message=data.get("message"))
+                except ValidationError:
+                    self.outbox.put("error", {"detail": "Invalid message"})
+                    continue
+                try:
+                    self.pending.put_nowait(message.message)
+                except asyncio.QueueFull:
+                    self.outbox.put("error", {"detail": "Too many messages waiting for a reply", "status": 429})
+            elif kind != "pong":
+                self.outbox.put("error", {"detail": f"Unknown message type {kind!r}"})
+
+    async def answer(self):
+        while True:
+            text = await self.pending.get()
+            # HTTP turns of the same user in this worker wait for this one, and the other way round
+            await turn_coordinator.acquire(self.user_id)
+            try:
+                await self.turn(text)
+            finally:
+                turn_coordinator.release(self.user_id)
+
+    async def turn(self, text: str):
+        if self.stage == ChatStage.ASSESSMENT_COMPLETED:
+            self.outbox.put("done", {"response": COMPLETED_REPLY, "stage": self.stage})
+            return
+        try:
+            async for item in stream_turn(self.user_id, text, self.legacy_state):
+                if item[0] == "final":
+                    result = item[1]
+                else:
+                    self.outbox.put(*turn_event(item))
+        except Exception as e:
+            logger.error(f"Error processing websocket message for user {self.user_id}: {str(e)}")
+            self.outbox.put("error", {"detail": "Failed to process message"})
+            return
+        self.legacy_state = None
+        self.stage = determine_stage(result)
+        self.unsaved = result
+        self.outbox.put("done", {"response": result["current_response"], "stage": self.stage})
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_SECONDS)
+            self.outbox.put("ping", {})
+
+    async def flush(self):
+        """
+        Writes the held-back state, then the session's stage, between turns. The session is
+        claimed first, so a turn another worker ran in the meantime is never overwritten.
+        """
+        await turn_coordinator.acquire(self.user_id)
+        try:
+            if self.unsaved is None and not session_dirty(self.user_id):
+                return
+            self.version = await claim_turn(self.db, self.user_id, self.version)
+            try:
+                await flush_session(self.user_id)
+            except CheckpointConflict:
+                await release_turn(self.db, self.user_id, self.version)
+                raise HTTPException(409, CONFLICT_DETAIL)
+            except BaseException:
+                await asyncio.shield(release_turn(self.db, self.user_id, self.version))
+                raise
+            if self.unsaved is not None:
+                await save_turn_state(self.db, self.user_id, self.unsaved, self.version)
+                self.unsaved = None
+            else:
+                await release_turn(self.db, self.user_id, self.version)
+        finally:
+            turn_coordinator.release(self.user_id)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(WS_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except HTTPException as e:
+                # another request changed the session, this connection's view of it is stale
+                self.outbox.put("error", {"detail": e.detail, "status": e.status_code})
+                await self.close(status.WS_1008_POLICY_VIOLATION, "Session changed elsewhere")
+                return
+            except PyMongoError as e:
+                logger.warning(f"Could not save chat session of user {self.user_id}, retrying: {str(e)}")
+
+    async def close(self, code: int, reason: str):
+        # let the events still waiting go out first
+        for _ in range(50):
+            if not self.outbox.events:
+                break
+            await asyncio.sleep(0.01)
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except RuntimeError:
+            pass
+
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Chat over one websocket: authenticated once from the access_token cookie, then
+    {"type": "message", "message": ...} frames are answered with the same node, token,
+    done and error events as /chat/stream, as {"type": <event>, ...} frames. The server
+    sends {"type": "ping"} heartbeats, clients answer {"type": "pong"} or may ping themselves.
+    """
+    try:
+        payload = decode_access_token(websocket.cookies.get("access_token"))
+        user = await resolve_user(payload)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+        return
+    user_id = str(user["id"])
+    db = get_db()
+    try:
+        session = await db.chat_sessions.find_one({"user_id": user_id}, {"current_stage": 1, "state": 1, "version": 1})
+    except PyMongoError as e:
+        logger.error(f"MongoDB error for user {user_id}: {str(e)}")
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR, reason="Database error occurred")
+        return
+    if not session:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Chat not initialized. Please initialize first.")
+        return
+    await websocket.accept()
+    await ChatConnection(websocket, db, user_id, session, payload.get("exp")).serve()
+
     
 @router.get(
     "/status",
@@ -182,25 +582,18 @@ async def get_chatbot_status(
     current_user=Depends(get_current_user),
     db=Depends(get_db)
 ):
-    user_id = str(current_user.id)
+    user_id = str(current_user["id"])
 
     try:
-        # Single DB request - project only needed fields
         session = await db.chat_sessions.find_one(
             {"user_id": user_id},
-            {
-                "current_stage": 1,
-                "state.estimated_age": 1,
-                "state.age_category": 1,
-                "state.age_answers": 1,
-                "updated_at": 1
-            }
+            {"current_stage": 1, "state": 1, "updated_at": 1}
         )
 
         if not session:
             raise HTTPException(404, "No chat session found. Please initialize first.")
 
-        state = session.get("state", {})
+        state = await load_session_state(session, user_id)
 
         return ChatbotStatus(
             user_id=user_id,  
@@ -218,4 +611,45 @@ async def get_chatbot_status(
         raise HTTPException(500, "Database error occurred")
     except Exception as e:
         logger.error(f"Error getting status for user {user_id}: {str(e)}")
-        raise HTTPException(500, "Failed to get chatbot status")
\ No newline at end of file
+        raise HTTPException(500, "Failed to get chatbot status")
+
+
+@router.get(
+    "/history",
+    response_model=ChatHistoryPage,
+    summary="Page through the chat history",
+    description="Returns the latest messages, or with before=<next_cursor> the page of older ones"
+)
+async def get_chat_history(
+    before: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    current_user=Depends(get_current_user),
+    db=Depends(get_db)
+):
+    user_id = str(current_user["id"])
+    try:
+        if not before and not await message_store.has_messages(user_id):
+            # sessions from before the message store get their history copied once,
+            # under the turn lock so a turn running now doesn't write it twice
+            await turn_coordinator.acquire(user_id)
+            try:
+                session = await db.chat_sessions.find_one({"user_id": user_id}, {"state": 1})
+                if session:
+                    await backfill_messages(user_id, session.get("state"))
+            finally:
+                turn_coordinator.release(user_id)
+        docs, next_cursor = await message_store.page(user_id, before, limit)
+        return ChatHistoryPage(
+            session_id=user_id,
+            messages=[
+                HistoryMessage(id=str(d["_id"]), role=d["role"], content=d["content"], timestamp=d["timestamp"])
+                for d in docs
+            ],
+            next_cursor=next_cursor
+        )
+
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    except PyMongoError as e:
+        logger.error(f"MongoDB error for user {user_id}: {str(e)}")
+        raise HTTPException(500, "Database error occurred")
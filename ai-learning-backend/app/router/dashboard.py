@@ -12,8 +12,7 @@ async def get_dashboard_overview(
     current_user: dict = Depends(get_current_user),
     db = Depends(mongo_db.get_mongo_connection)
 ):
-    user = await mongo_db.user_collection.find_one({"email": current_user["email"]})
-    user_id = user["_id"] 
+    user_id = ObjectId(current_user["id"])
     user_profile = await mongo_db.user_profiles.find_one({"user_id": user_id})
     total_courses = await mongo_db.user_courses.count_documents({"user_id": user_id})
     completed_courses = await mongo_db.user_progress.count_documents({
@@ -172,7 +171,7 @@ async def delete_user_profile(
     """
     Delete user's learning profile
     """
-    user_id = ObjectId(current_user["_id"])
+    user_id = ObjectId(current_user["id"])
     profiles_collection = db["user_profiles"]
     
     result = await profiles_collection.delete_one({"user_id": user_id})
@@ -1,13 +1,38 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
 from app.services.HWhelper.helper import process_homework_image
+from app.services.jobs import PRIORITY_NORMAL, register_job
+from app.router.jobs import accept_job
+from app.schemas import JobAccepted
 
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/homework", tags=["Homework Helper"])
 
-@router.post("/upload")
-async def handle_homework(file: UploadFile = File(...)):
+async def solve_homework(file_bytes: bytes) -> dict:
+    extracted_text_and_solution = await process_homework_image(file_bytes)
+    if not extracted_text_and_solution:
+        raise HTTPException(
+            status_code=422,
+            detail="Could not extract readable text from the image. Please ensure the image is clear and contains visible text."
+        )
+    return {
+        "status": "success",
+        "result": extracted_text_and_solution,
+        "message": "Homework image processed successfully"
+    }
+
+
+@register_job("homework")
+async def homework_job(payload: dict) -> dict:
+    return await solve_homework(payload["image"])
+
+
+@router.post("/upload", responses={202: {"model": JobAccepted, "description": "Queued as a background job"}})
+async def handle_homework(
+    file: UploadFile = File(...),
+    background: bool = Query(False, description="Return 202 with a job id instead of waiting for the solution")
+):
     """
     Upload homework image and extract text/solve problems from it
     """
@@ -36,19 +61,9 @@ async def handle_homework(file: UploadFile = File(...)):
                 detail="Uploaded file appears to be empty"
             )
         
-        extracted_text_and_solution = await process_homework_image(file_bytes)
-        
-        if not extracted_text_and_solution:
-            raise HTTPException(
-                status_code=422,
-                detail="Could not extract readable text from the image. Please ensure the image is clear and contains visible text."
-            )
-        
-        return {
-            "status": "success",
-            "result": extracted_text_and_solution,
-            "message": "Homework image processed successfully"
-        }
+        if background:
+            return await accept_job("homework", {"image": file_bytes}, PRIORITY_NORMAL)
+        return await solve_homework(file_bytes)
         
     except HTTPException:
         # Re-raise HTTP exceptions as-is
@@ -0,0 +1,89 @@
+import json
+import logging
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.authentication.auth import get_current_user
+from app.schemas import JobStatus
+from app.services.jobs import FINISHED, PRIORITY_NORMAL, QUEUED, QueueFull, job_queue, public_view, token_matches
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+logger = logging.getLogger(__name__)
+
+# how often the SSE stream re-reads a job that runs in another worker process
+STREAM_POLL_SECONDS = 5.0
+
+
+async def accept_job(kind: str, payload, priority: int = PRIORITY_NORMAL, owner=None, **extra) -> JSONResponse:
+    """Queues a job for a slow endpoint and returns the 202 pointing at it, with any extra fields."""
+    try:
+        job_id = await job_queue.submit(kind, payload, priority, owner)
+    except QueueFull:
+        raise HTTPException(503, "Too many requests are waiting, please try again in a moment.",
+                            headers={"Retry-After": "30"})
+    return JSONResponse(status_code=202, content={
+        "job_id": job_id,
+        "status": QUEUED,
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+        **extra,
+    })
+
+
+async def load_job(job_id: str, request: Request) -> dict:
+    """
+    The job if the caller may see it, 404 otherwise so ids of other users' jobs don't leak.
+    A job's token in ?token= stands in for logging in as its owner.
+    """
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    if job.get("owner") and not token_matches(job, request.query_params.get("token")):
+        try:
+            user = await get_current_user(request)
+        except HTTPException:
+            raise HTTPException(404, "Job not found")
+        if str(user["id"]) != job["owner"]:
+            raise HTTPException(404, "Job not found")
+    return job
+
+
+@router.get(
+    "/{job_id}",
+    response_model=JobStatus,
+    summary="Get a background job",
+    description="Status of a job queued by a slow endpoint, with its result once it has finished"
+)
+async def get_job(job_id: str, request: Request):
+    return public_view(await load_job(job_id, request))
+
+
+@router.get(
+    "/{job_id}/events",
+    summary="Stream a background job's completion",
+    description="Server-sent events: status while the job waits or runs, then done or error"
+)
+async def stream_job(job_id: str, request: Request):
+    job = await load_job(job_id, request)
+
+    async def events():
+        current = job
+        last_status = None
+        while True:
+            if current["status"] != last_status:
+                last_status = current["status"]
+                yield f"event: status\ndata: {json.dumps({'status': last_status})}\n\n"
+            if current["status"] in FINISHED:
+                view = public_view(current)
+                event = "done" if view["error"] is None else "error"
+                yield f"event: {event}\ndata: {json.dumps(jsonable_encoder(view))}\n\n"
+                return
+            await job_queue.wait(job_id, STREAM_POLL_SECONDS)
+            current = await job_queue.get(job_id) or current
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
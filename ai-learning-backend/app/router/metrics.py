@@ -0,0 +1,88 @@
+import os
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.services.telemetry import register_counter, register_gauge, render_metrics
+from app.services.llm_pool import get_llm_pool_stats
+from app.services.chatbot.rate_limiter import get_rate_limiter_stats
+from app.services.chatbot.llm_cache import get_llm_cache_stats
+from app.services.chatbot.turns import get_turn_stats
+from app.services.jobs import get_job_stats
+from app.authentication.auth import get_user_cache_stats
+from app.authentication.passwords import get_hash_pool_stats
+from app.authentication.tokens import get_revocation_stats
+
+# optional shared secret for the scraper, the endpoint is open if unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+router = APIRouter(tags=["Metrics"])
+
+# stats that aren't counts of events, each exported as a metric of its own
+LIMITER_AMOUNTS = ("wait_seconds", "tokens_short")
+USER_CACHE_GAUGES = ("size", "hit_ratio")
+HASH_POOL_GAUGES = ("pending", "queued", "workers")
+# label value -> key prefix in get_hash_pool_stats
+HASH_POOLS = {"default": "", "bulk": "bulk_"}
+REVOCATION_GAUGES = ("tokens", "users")
+
+
+def _only(collect, keys):
+    return lambda: {k: v for k, v in collect().items() if k in keys}
+
+
+def _without(collect, keys):
+    return lambda: {k: v for k, v in collect().items() if k not in keys}
+
+
+def _value(collect, key):
+    return lambda: collect()[key]
+
+
+def _hash_pools(key):
+    return lambda: {pool: get_hash_pool_stats()[f"{prefix}{key}"] for pool, prefix in HASH_POOLS.items()}
+
+
+register_counter("llm_rate_limiter", "Rate limiter calls, throttled calls, retries and failures.",
+                 _without(get_rate_limiter_stats, LIMITER_AMOUNTS), label="stat")
+register_counter("llm_rate_limiter_wait_seconds", "Seconds calls waited for the rate limiter.",
+                 _value(get_rate_limiter_stats, "wait_seconds"), label=None)
+register_counter("llm_rate_limiter_tokens_short", "Tokens the rate limiter buckets were short of when calls came in.",
+                 _value(get_rate_limiter_stats, "tokens_short"), label=None)
+register_counter("llm_cache", "LLM reply cache hits, misses and stores.", get_llm_cache_stats, label="stat")
+register_counter("chat_turns", "Chat turns run, coalesced and queued.", get_turn_stats, label="stat")
+register_counter("jobs", "Background jobs submitted, finished and rejected.", get_job_stats, label="stat")
+register_counter("auth_user_cache", "Authenticated user cache hits, misses and invalidations.",
+                 _without(get_user_cache_stats, USER_CACHE_GAUGES), label="stat")
+register_gauge("auth_user_cache_size", "Authenticated users held in the cache.",
+               _value(get_user_cache_stats, "size"), label=None)
+register_gauge("auth_user_cache_hit_ratio", "Authenticated user cache hit ratio since start.",
+               _value(get_user_cache_stats, "hit_ratio"), label=None)
+register_counter("auth_password_hashing", "Password hashes done, rehashed on login and rejected.",
+                 _without(get_hash_pool_stats, [f"{p}{k}" for p in HASH_POOLS.values() for k in HASH_POOL_GAUGES]),
+                 label="stat")
+register_gauge("auth_password_hashing_pending", "Password hashes running or waiting, by pool.",
+               _hash_pools("pending"), label="pool")
+register_gauge("auth_password_hashing_queued", "Password hashes waiting for a worker, by pool.",
+               _hash_pools("queued"), label="pool")
+register_gauge("auth_password_hashing_workers", "Password hashing workers, by pool.",
+               _hash_pools("workers"), label="pool")
+register_counter("auth_revocations", "Token revocation checks, hits and syncs.",
+                 _without(get_revocation_stats, REVOCATION_GAUGES), label="stat")
+register_gauge("auth_revocations_held", "Revoked tokens and users held in memory.",
+               _only(get_revocation_stats, REVOCATION_GAUGES), label="stat")
+register_gauge(
+    "llm_backend_healthy", "1 if the LLM backend is taking requests, 0 while it cools down.",
+    lambda: {name: b["healthy"] for name, b in get_llm_pool_stats().items()}, label="backend"
+)
+register_gauge(
+    "llm_backend_p95_seconds", "p95 latency of the LLM backend over its recent requests.",
+    lambda: {name: b["p95_seconds"] for name, b in get_llm_pool_stats().items()}, label="backend"
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics(authorization: str | None = Header(default=None)):
+    """Prometheus text format."""
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
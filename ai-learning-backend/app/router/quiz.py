@@ -1,13 +1,29 @@
-from fastapi import APIRouter, Body
+from fastapi import APIRouter, Body, Query
 from app.services.quiz.quiz_generator import create_quiz
+from app.services.jobs import PRIORITY_NORMAL, register_job
+from app.router.jobs import accept_job
+from app.schemas import JobAccepted
 
 router = APIRouter(prefix="/quiz", tags=["Quiz Generator"])
 
-@router.post("/")
+
+@register_job("quiz")
+async def quiz_job(payload: dict) -> dict:
+    return await create_quiz(
+        payload["mental_age"], payload["topic"], payload["num_questions"], payload["time_limit"]
+    )
+
+
+@router.post("/", responses={202: {"model": JobAccepted, "description": "Queued as a background job"}})
 async def generate_quiz_api(
     mental_age: int = Body(...),
     topic: str = Body(...),
     num_questions: int = Body(5),
-    time_limit: int=Body(10)
+    time_limit: int=Body(10),
+    background: bool = Query(False, description="Return 202 with a job id instead of waiting for the quiz")
 ):
+    if background:
+        return await accept_job("quiz", {
+            "mental_age": mental_age, "topic": topic, "num_questions": num_questions, "time_limit": time_limit
+        }, PRIORITY_NORMAL)
     return await create_quiz(mental_age, topic, num_questions,time_limit)
@@ -27,7 +27,7 @@ class InitializeChatbotResponse(BaseModel):
     session_id: str
     initial_response: ChatResponse
     status: str
-    user_id: int
+    user_id: str
 
 class AssessmentReport(BaseModel):
     mental_age: int
@@ -41,19 +41,91 @@ class LearningRecommendation(BaseModel):
     subject_filter: Optional[str] = None
 
 class ChatbotStatus(BaseModel):
-    user_id: int
+    user_id: str
     current_stage: str
     mental_age: Optional[int]
     intellect_level: Optional[str]
     assessment_progress: Optional[str]
     last_interaction: Optional[datetime]
 
+class HistoryMessage(BaseModel):
+    id: str
+    role: str
+    content: str
+    timestamp: datetime
+
+class ChatHistoryPage(BaseModel):
+    session_id: str
+    # oldest first
+    messages: List[HistoryMessage]
+    # pass as `before` to get the page of older messages, None on the oldest page
+    next_cursor: Optional[str] = None
+
 class ErrorResponse(BaseModel):
     error: str
     message: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 
+# BACKGROUND JOB SCHEMAS
+
+class JobAccepted(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+    events_url: str
+
+class JobStatus(BaseModel):
+    id: str
+    kind: str
+    status: str
+    priority: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+
+
+# ADMIN SCHEMAS
+class RescoreRequest(BaseModel):
+    dry_run: bool = False
+    batch_size: int = Field(50, ge=1, le=1000)
+    concurrency: int = Field(4, ge=1, le=64)
+    limit: Optional[int] = Field(None, ge=1)
+    # continue an interrupted run with its own settings instead of starting a new one
+    resume_run_id: Optional[str] = None
+
+class RescoreAccepted(JobAccepted):
+    run_id: str
+    run_url: str
+
+class RescoreReport(BaseModel):
+    run_id: str
+    status: str
+    dry_run: bool
+    processed: int
+    updated: int
+    changed: int
+    failed: int
+    elapsed_seconds: float
+    sessions_per_sec: float
+    error: Optional[str] = None
+
+class RosterError(BaseModel):
+    row: int
+    email: Optional[str] = None
+    error: str
+
+class RosterReport(BaseModel):
+    received: int
+    created: int
+    failed: int
+    # the first ROSTER_MAX_ERRORS, by line number in the upload
+    errors: List[RosterError]
+    elapsed_seconds: float
+    rows_per_sec: float
+
 # --- QUIZ MODELS ---
 
 class QuizQuestion(BaseModel):
@@ -1,17 +1,15 @@
 # app/services/homework_helper.py
 
-import os
-import httpx
-from dotenv import load_dotenv
 from app.services.HWhelper.imagereader import extract_text_from_image
+from app.services.chatbot.llm import llm
+from app.services.chatbot.rate_limiter import limiter
+from app.services.telemetry import traced
+from app.services.token_budget import trim_text
 
-load_dotenv()
-
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-MODEL = "llama3-8b-8192"
-
+@traced("homework", kind="service")
 async def get_conversational_response(homework_text: str) -> str:
+    # OCR of a full page can be huge, the tutor only needs the gist of it
+    homework_text = trim_text(homework_text, 2500)
     prompt = f"""
 You're a friendly and supportive tutor for children aged 8 to 14.
 You are talking to a kid who just uploaded a photo of their homework.
@@ -27,27 +25,8 @@ Here is what the image says:
 Now help the child!
 """
 
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
-    payload = {
-        "model": MODEL,
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.7
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.post(GROQ_API_URL, json=payload, headers=headers)
-
-        if response.status_code != 200:
-            return f"Error: {response.status_code} - {response.text}"
-        print(response)
-        data = response.json()
-
-        # Extract the actual message content from the LLM response
-        return data["choices"][0]["message"]["content"]
+    response = await limiter.call(llm.ainvoke, prompt, temperature=0.7)
+    return response.content
 
 async def process_homework_image(file_bytes: bytes) -> str:
    
@@ -1,27 +1,66 @@
 import os
-import json
+import asyncio
+import logging
 import dotenv
+from datetime import datetime, timezone
 from langgraph.graph import StateGraph, END
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.checkpoint.memory import MemorySaver 
+from langgraph.types import Command, interrupt
 from typing import TypedDict, Literal
-from .rate_limiter import llm_rate_limiter
+from .rate_limiter import llm_rate_limiter, llm_urgent, current_llm_user
+from .checkpointer import MongoSaver
+from .llm_cache import CACHED_NODES, cached_call
+from .memory import conversation_memory, load_archive
+from .messages import message_store
+from .structured_output import AgeQuestion, AssessmentResult, QuestionBank, ainvoke_structured
+from .risk_classifier import classify, first_user_message, risk_flag
 from .llm import llm
+from app.services.telemetry import traced
+from app.services.token_budget import fit_items, trim_text
+from app import mongo_db
 dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
 api_key = os.getenv("GEMINI_API_KEY")
+# "mongo" persists conversations per user, "memory" keeps them in this process (local runs, benchmarks)
+CHECKPOINTER = os.getenv("CHAT_CHECKPOINTER", "mongo")
+# "batched" generates the whole age question set in one LLM call and picks the next question locally,
+# "sequential" asks the LLM for every question
+AGE_QUESTION_MODE = os.getenv("AGE_QUESTION_MODE", "batched")
+AGE_QUESTION_COUNT = 5
+AGE_DIMENSIONS = [
+    "abstract reasoning",
+    "emotional maturity",
+    "decision-making style",
+    "impulse control",
+    "future planning",
+]
+# asked when the LLM gives no usable question, one per dimension
+FALLBACK_AGE_QUESTIONS = [
+    "If you could change one rule at school or work, which would it be and why?",
+    "What do you usually do when something makes you really upset?",
+    "How do you decide between two things you both want?",
+    "What do you do when you want something right now but have to wait for it?",
+    "Where do you see yourself in five years, and how do you plan to get there?",
+]
 
 # wrapper to limit llm calls
 @llm_rate_limiter
-def safe_invoke(prompt):
-    return llm.invoke(prompt)
+async def safe_invoke(prompt):
+    return await llm.ainvoke(prompt)
+
+# same as safe_invoke, but nodes listed in LLM_CACHE_NODES can be answered from the response cache
+async def cached_invoke(prompt, node, key_fields=None):
+    return await cached_call(node, prompt, safe_invoke, key_fields)
 
 # State
 # this state keeps track of the conversation and assessment data, so need to store this in a database
 class State(TypedDict):
     username:str
     user_input: str
+    # only the most recent messages, older ones are archived and folded into conversation_summary
     conversation_history: list
+    conversation_summary: str
+    first_user_message: str
     
     # Age assessment fields
     estimated_age: int  
@@ -32,12 +71,18 @@ class State(TypedDict):
     age_questions_asked: int
     # age_questions_answered: int
     age_answers: list
+    # pre-generated questions when AGE_QUESTION_MODE is "batched"
+    age_question_bank: list
         
     # Mental state fields
     assessment_score: int  
     primary_concern: str  
     emotional_state: str
     risk_level: str  
+    # concern and risk as the assessment LLM gave them, before the classifier's override and floor,
+    # None where the classifier decided; the classifier is trained on these, never on its own labels
+    llm_primary_concern: str
+    llm_risk_level: str
     
     # Response fields
     current_response: str
@@ -50,7 +95,6 @@ class State(TypedDict):
     follow_up_done: bool
 
     # flags
-    router_flag: Literal["age_question_generator", "mental_state_assessor", "follow_up", "guidance"]
     age_router_flag: Literal["ask_more", "evaluate_age", "skip"]
 
 
@@ -65,15 +109,13 @@ def welcome_node(state: State) -> State:
     state["needs_more_info"] = True
     state["age_indicators"] = []
     # print("DEBUG 1: Starting new session.")
-    print(f"\n🤖 Assistant: {welcome_msg}")
+    logger.debug(f"Welcome message: {welcome_msg}")
     return state
 
-def age_question_generator(state: State) -> State:
-    """Generates the age assessment questions"""
-    print("DEBUG: Starting assessment.")
-    prev_ans=state.get("age_answers", [])
-    ques_no=state.get("age_questions_asked", 0)
-    print("DEBUG 2: Generating question number", ques_no+1)
+async def generate_next_age_question(prev_ans: list) -> str:
+    """Asks the LLM for the next question, one call per question"""
+    # the newest answers say the most about what to ask next
+    prev_ans = fit_items(prev_ans, 400, item_budget=80)
     prompt = f"""
 You are an expert cognitive psychologist. 
 You are estimating the user's **intellectual age**.
@@ -92,23 +134,91 @@ Make it short, clear, and age-diagnostic.
 Return:
 QUESTION: <question>
 """
-    response = safe_invoke(prompt)
-    question = response.content.split("QUESTION:")[1].strip()
+    result, parsed = await ainvoke_structured(safe_invoke, prompt, AgeQuestion)
+    return result.question if parsed else None
+
+@traced("age_question_bank", kind="step")
+async def generate_age_question_bank() -> list:
+    """Generates the whole adaptive question set in a single LLM call"""
+    dimensions = "\n".join(f"- {d}" for d in AGE_DIMENSIONS)
+    prompt = f"""
+You are an expert cognitive psychologist estimating a user's **intellectual age**.
+
+Write an assessment question bank. For EACH of these dimensions:
+{dimensions}
+
+write two short, clear, age-diagnostic questions:
+- "basic": simple wording a child can answer
+- "advanced": probes deeper for teens and adults
+
+Return ONLY a JSON object:
+{{
+  "questions": [
+    {{"dimension": "<dimension>", "level": "basic", "question": "<question>"}},
+    {{"dimension": "<dimension>", "level": "advanced", "question": "<question>"}}
+  ]
+}}
+"""
+    # an empty bank falls back to asking question by question
+    result, _ = await ainvoke_structured(safe_invoke, prompt, QuestionBank)
+    return [q.model_dump() for q in result.questions]
+
+def answer_maturity(answers: list) -> float:
+    """Cheap local signal of how elaborate the answers so far are, 0 (short, plain) to 1 (long, reasoned)"""
+    if not answers:
+        return 0.0
+    markers = ("because", "if ", "then", "although", "however", "depends", "plan", "future", "consider")
+    words = sum(len(a.split()) for a in answers) / len(answers)
+    reasoning = sum(any(m in a.lower() for m in markers) for a in answers) / len(answers)
+    return min(1.0, words / 25) * 0.5 + reasoning * 0.5
+
+def pick_age_question(bank: list, answers: list, ques_no: int):
+    """Chooses the next question from the bank, harder wording once the answers look mature"""
+    dimension = AGE_DIMENSIONS[ques_no % len(AGE_DIMENSIONS)]
+    level = "advanced" if answer_maturity(answers) >= 0.5 else "basic"
+    candidates = [q for q in bank if q["dimension"].lower() == dimension] or bank
+    for q in candidates:
+        if q.get("level") == level:
+            return q["question"]
+    return candidates[ques_no % len(candidates)]["question"] if candidates else None
+
+async def age_question_generator(state: State) -> State:
+    """Generates the age assessment questions"""
+    logger.debug("Starting assessment")
+    prev_ans=state.get("age_answers", [])
+    ques_no=state.get("age_questions_asked", 0)
+    logger.debug(f"Generating age question {ques_no + 1}")
+    question = None
+    if AGE_QUESTION_MODE == "batched":
+        bank = state.get("age_question_bank") or await generate_age_question_bank()
+        state["age_question_bank"] = bank
+        question = pick_age_question(bank, prev_ans, ques_no)
+    if not question:
+        question = await generate_next_age_question(prev_ans)
+    if not question:
+        question = FALLBACK_AGE_QUESTIONS[ques_no % len(FALLBACK_AGE_QUESTIONS)]
     state["current_response"] = question
     state["conversation_history"].append({
         "role": "assistant",
         "content": question
     })
-    print(f"\nAge Evaluation question DEBUG: Assistant: {question}")
+    logger.debug(f"Age question: {question}")
     return state
 
 def age_ans_node(state: State) -> State:
-    """Process the user's answer to age question"""
-    user_input = state.get("user_input", "")
+    """Waits for the user's answer to the age question, the next turn resumes the graph here"""
+    # the graph stops at this interrupt and the turn ends, run_turn resumes it with the user's message
+    user_input = interrupt({"question": state.get("current_response", "")})
+    state["user_input"] = user_input
     if user_input.strip()!="":
-        last_msg = state["conversation_history"][-1] if state["conversation_history"] else {}
-        if last_msg.get("content") != user_input:
-            state["conversation_history"].append({"role": "user", "content": user_input})
+        state["conversation_history"].append({
+            "role": "user",
+            "content": user_input,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        })
+        # high-risk wording is flagged right away, the session's LLM calls then go first
+        if risk_flag(user_input) == "high":
+            state["risk_level"] = "high"
         prev_ans = state.get("age_answers", [])
         prev_ans.append(user_input)
         state["age_answers"] = prev_ans
@@ -118,7 +228,7 @@ def age_ans_node(state: State) -> State:
 def age_router_node(state: State):
     """Update state, then decide route in conditional edge function."""
     questions_asked = state.get("age_questions_asked", 0)
-    print("DEBUG 3: Router")
+    logger.debug("Routing age assessment")
     # if questions_asked >= 5:
     #     print("DEBUG 4: Evaluating age now.")
     #     state["age_router_flag"] = "evaluate_age"
@@ -131,7 +241,7 @@ def age_router_node(state: State):
         **state,
         "age_router_flag": (
             "skip" if state.get("age_assessment_complete")
-            else "evaluate_age" if int(state["age_questions_asked"]) >= 5
+            else "evaluate_age" if int(state["age_questions_asked"]) >= AGE_QUESTION_COUNT
             else "ask_more"
         )
     }
@@ -139,18 +249,34 @@ def age_router_node(state: State):
 def age_route_decision(state: State):
     return state["age_router_flag"]
 
-def age_evaluation_node(state: State) -> State:
-    """Evaluate the user's intellectual age based on their answers"""
-    print("DEBUG 5: Evaluating age based on answers.")
-    answers = state.get("age_answers", [])
+def assessment_prompt(state: State, screening=None) -> str:
+    """Prompt of the age and mental state assessment, also used to re-score stored sessions"""
+    answers = fit_items(state.get("age_answers", []), 800, item_budget=150)
+    # the first message may already have been archived out of the history window
+    first_message = trim_text(first_user_message(state), 300)
+    # what the local classifier already labelled is given to the LLM instead of asked for
+    known, concern_fields = "", ""
+    if screening is not None and screening.clear:
+        known += f"\nTheir primary concern is already known: {screening.concern}."
+    else:
+        concern_fields += '  "primary_concern": "anxiety/depression/stress/trauma/relationships/academic/family/general",\n'
+    if screening is not None and screening.high_risk:
+        known += "\nTheir risk level is already known: high."
+    else:
+        concern_fields += '  "risk_level": "low/medium/high",\n'
     prompt = f"""
-You are a cognitive psychologist estimating the user's **intellectual age**.
+You are a cognitive psychologist and mental health professional.
 
-Here are the user's answers to age-assessment questions:
-{answers}
+The user's first message (their initial concern):
+"{first_message}"
 
-Evaluate and return ONLY a JSON object:
+Their answers to age-assessment questions:
+{answers}
 
+Estimate their **intellectual age** from the answers and assess their mental and emotional
+state from the first message, using age-appropriate expectations.
+{known}
+Return ONLY a JSON object:
 {{
   "estimated_age": <number>,
   "confidence": <0-10>,
@@ -159,78 +285,88 @@ Evaluate and return ONLY a JSON object:
       "short description of reasoning",
       "short description of emotional maturity",
       "short description of decision patterns"
-  ]
+  ],
+  "urgency_score": <1-10>,
+{concern_fields}  "emotional_state": "<brief description>",
+  "needs_immediate_help": <true/false>
 }}
 """
-    result = safe_invoke(prompt).content
-    data = json.loads(result)
+    return prompt
+
+def assessment_fields(result: AssessmentResult) -> dict:
+    """State fields set from an assessment result"""
+    return {
+        "estimated_age": result.estimated_age,
+        "age_confidence": result.confidence,
+        "age_category": result.category,
+        "age_indicators": result.indicators,
+        "assessment_score": result.urgency_score,
+        "primary_concern": result.primary_concern,
+        "emotional_state": result.emotional_state,
+        "risk_level": result.risk_level,
+    }
 
-    state["estimated_age"] = data["estimated_age"]
-    state["age_confidence"] = data["confidence"]
-    state["age_category"] = data["category"]
-    state["age_indicators"] = data["indicators"]
+LLM_LABEL_FIELDS = ("llm_primary_concern", "llm_risk_level")
+
+def llm_labels(result: AssessmentResult, screening) -> dict:
+    """The LLM's own concern and risk, call before apply_screening"""
+    return {
+        # the prompt didn't ask for what the classifier already knew
+        "llm_primary_concern": None if screening.clear else result.primary_concern,
+        "llm_risk_level": None if screening.high_risk else result.risk_level,
+    }
+
+def apply_screening(result: AssessmentResult, screening, prior_risk=None) -> AssessmentResult:
+    """Puts the local classifier's clear-cut concern and risk floor on an assessment result"""
+    if screening.clear:
+        result.primary_concern = screening.concern
+    # risky wording sets a floor, the LLM can raise the risk level but never lower it
+    if screening.high_risk or prior_risk == "high":
+        result.risk_level = "high"
+        result.needs_immediate_help = True
+    elif screening.risk == "medium" and result.risk_level == "low":
+        result.risk_level = "medium"
+    return result
+
+async def assessment_node(state: State) -> State:
+    """Estimates intellectual age and assesses mental state in a single structured LLM call"""
+    logger.debug("Assessing age and mental state")
+    # clear-cut first messages get their concern (and risk, if the wording says) from the local classifier
+    screening = classify(first_user_message(state))
+    # malformed replies are repaired locally, unreadable fields fall back to defaults
+    result, parsed = await ainvoke_structured(safe_invoke, assessment_prompt(state, screening), AssessmentResult)
+    if not parsed:
+        logger.warning("Assessment reply could not be parsed, using defaults")
+    state.update(llm_labels(result, screening) if parsed else dict.fromkeys(LLM_LABEL_FIELDS))
+    apply_screening(result, screening, state.get("risk_level"))
+
+    state.update(assessment_fields(result))
     state["age_assessment_complete"] = True
+    state["mental_assessment_complete"] = True
     state["current_response"] = (
         f"Thanks! I’ve finished understanding your thinking style. "
-        f"Estimated intellectual age: {data['estimated_age']} ({data['category']})."
+        f"Estimated intellectual age: {result.estimated_age} ({result.category})."
     )
     state["conversation_history"].append({
         "role": "assistant",
         "content": state["current_response"]
     })
+    logger.info(f"Assessment: urgency {result.urgency_score}/10, concern {result.primary_concern}, risk {result.risk_level}")
     return state
 
-# need to refine: use rag to pull in relevant knowledge
-def mental_state_assessor_node(state: State) -> State:
-    """Assess mental and emotional state"""
-    # Get the FIRST user message (their initial concern)
-    user_messages = [m["content"] for m in state.get("conversation_history", []) 
-                     if m["role"] == "user"]
-    if not user_messages:
-        state["mental_assessment_complete"] = True
-        return state
-    first_message = user_messages[0]
-    age_category = state.get("age_category", "adult")
-    estimated_age = state.get("estimated_age", 15)
-    prompt = f"""As a mental health professional, assess this message from a {age_category} (approximately {estimated_age} years old):
-"{first_message}"
-
-Provide assessment in this format:
-1. Urgency Score: [1-10]
-2. Primary Concern: [anxiety/depression/stress/trauma/relationships/academic/family/general]
-3. Emotional State: [brief description]
-4. Risk Level: [low/medium/high]
-5. Needs Immediate Help: [yes/no]
-Consider age-appropriate concerns and expression styles."""
-    
-    response = safe_invoke(prompt)
-    assessment = response.content
-    
-    # Parse assessment
-    for line in assessment.split('\n'):
-        line = line.strip()
-        if 'Urgency Score:' in line:
-            try:
-                score_str = line.split(':')[1].strip()
-                state["assessment_score"] = int(''.join(filter(str.isdigit, score_str.split()[0])))
-            except:
-                state["assessment_score"] = 5
-        elif 'Primary Concern:' in line:
-            state["primary_concern"] = line.split(':')[1].strip()
-        elif 'Emotional State:' in line:
-            state["emotional_state"] = line.split(':')[1].strip()
-        elif 'Risk Level:' in line:
-            state["risk_level"] = line.split(':')[1].strip().lower()
-    print(f"📊 Assessment - Urgency: {state.get('assessment_score', 0)}/10, Concern: {state.get('primary_concern', 'Unknown')}, Risk: {state.get('risk_level', 'Unknown')}")
-    state["mental_assessment_complete"] = True
-    return state
+def summary_context(state: State) -> str:
+    """Earlier turns folded into conversation_summary, empty until the history was first compacted"""
+    summary = state.get("conversation_summary")
+    return f"\nWhat was said earlier in the conversation:\n{trim_text(summary, 600)}\n" if summary else ""
 
-def follow_up_node(state: State) -> State:
+async def follow_up_node(state: State) -> State:
     """Ask follow-up questions to better understand the user"""
     age_category = state.get("age_category", "adult")
     estimated_age = state.get("estimated_age", 15)
     primary_concern = state.get("primary_concern", "general")
+    earlier = summary_context(state)
     prompt = f"""You're talking to a {age_category} (around {estimated_age} years old) about {primary_concern}.
+{earlier}
 Generate a warm, empathetic follow-up response that:
 1. Acknowledges their feelings briefly
 2. Asks ONE thoughtful question to understand them better
@@ -238,7 +374,8 @@ Generate a warm, empathetic follow-up response that:
 
 Keep it conversational and supportive. Make them feel heard."""
 
-    response = safe_invoke(prompt)
+    # with a summary the prompt is about this user only, a shared cached reply wouldn't fit
+    response = await (safe_invoke(prompt) if earlier else cached_invoke(prompt, "follow_up"))
     follow_up = response.content
     
     state["current_response"] = follow_up
@@ -247,12 +384,34 @@ Keep it conversational and supportive. Make them feel heard."""
         "content": follow_up
     })
     
-    print(f"\n💬 Assistant: {follow_up}")
-    state["follow_up_done"] = True
+    logger.debug(f"Follow-up: {follow_up}")
+    return state
 
+def follow_up_answer_node(state: State) -> State:
+    """Waits for the user's answer to the follow-up question, guidance then answers it"""
+    user_input = interrupt({"question": state.get("current_response", "")})
+    state["user_input"] = user_input
+    if user_input.strip():
+        state["conversation_history"].append({
+            "role": "user",
+            "content": user_input,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        })
+        # the guidance call goes first for wording like this, and its risk level can't be lower
+        if risk_flag(user_input) == "high":
+            state["risk_level"] = "high"
+    state["follow_up_done"] = True
     return state
 
-def guidance_node(state: State) -> State:
+def urgency_band(score) -> str:
+    """Urgency score in the bands the guidance prompt acts on, hotlines are added above 6"""
+    try:
+        score = float(score)
+    except (TypeError, ValueError):
+        return "moderate"
+    return "high" if score > 6 else "moderate" if score > 3 else "low"
+
+async def guidance_node(state: State) -> State:
     """Provide comprehensive, age-appropriate guidance"""
     age_category = state.get("age_category", "adult")
     estimated_age = state.get("estimated_age", 15)
@@ -268,13 +427,16 @@ def guidance_node(state: State) -> State:
         "young_adult": "supportive but mature. Respect their adult perspective.",
         "adult": "professional, empathetic counseling approach."
     }
+    earlier = summary_context(state)
+    # a cached reply is shared by users in the same categories, it mustn't carry one user's own words
+    shared = "guidance" in CACHED_NODES and not earlier
+    emotional_line = "" if shared else f"- Emotional state: {trim_text(emotional_state, 60)}\n"
     prompt = f"""Provide final guidance for a {age_category} (age ~{estimated_age}) dealing with {primary_concern}.
 
 Context:
 - Urgency: {assessment_score}/10
-- Emotional state: {emotional_state}
-- Risk level: {risk_level}
-
+{emotional_line}- Risk level: {risk_level}
+{earlier}
 Use {tone_guide.get(age_category, tone_guide['adult'])}
 
 Include:
@@ -285,7 +447,17 @@ Include:
 5. Encouraging closing message
 
 Make it warm, practical, and hopeful."""
-    response = safe_invoke(prompt)
+    if not shared:
+        response = await safe_invoke(prompt)
+    else:
+        # every state value the prompt is built from, or users would get a reply written for another age
+        response = await cached_invoke(prompt, "guidance", {
+            "age_category": age_category,
+            "estimated_age": estimated_age,
+            "primary_concern": primary_concern,
+            "risk_level": risk_level,
+            "urgency": urgency_band(assessment_score),
+        })
     guidance = response.content
     state["final_guidance"] = guidance
     state["current_response"] = guidance
@@ -293,75 +465,53 @@ Make it warm, practical, and hopeful."""
         "role": "assistant",
         "content": guidance
     })
-    print(f"\nFinal Guidance:\n{guidance}")
+    logger.debug(f"Guidance: {guidance}")
     return state
 
-def chat_service_node(state: State) -> State:
-    prompt = f"""
-Continue as a supportive counselor + general AI assistant.
-
-User said:
-"{state['user_input']}"
-
-Provide helpful, safe, supportive, and optionally informative guidance.
-    """
-    response = safe_invoke(prompt).content
-    state["current_response"] = response
-    state["conversation_history"].append({"role": "assistant", "content": response})
-    return state
-
-def router_node(state: State):
-    return {
-        **state,
-        "router_flag": (
-            "age_question_generator" if not state.get("age_assessment_complete")
-            else "mental_state_assessor" if not state.get("mental_assessment_complete")
-            else "follow_up" if not state.get("follow_up_done")
-            else "guidance"
-        )
-    }
-
-def router_decision(state: State):
-    return state["router_flag"]
-
 # === WORKFLOW ===
 workflow = StateGraph(State)
 
-# Add all nodes first
-workflow.add_node("welcome", welcome_node)
-workflow.add_node("age_question_generator", age_question_generator)
-workflow.add_node("age_answer", age_ans_node)
-workflow.add_node("age_router", age_router_node)
-workflow.add_node("age_evaluation", age_evaluation_node)
-workflow.add_node("mental_state_assessor", mental_state_assessor_node)
-workflow.add_node("follow_up", follow_up_node)
-workflow.add_node("guidance", guidance_node)
-workflow.add_node("router", router_node)
+# Add all nodes first, each one is timed and charged the LLM calls it makes
+workflow.add_node("welcome", traced("welcome")(welcome_node))
+workflow.add_node("age_question_generator", traced("age_question_generator")(age_question_generator))
+workflow.add_node("age_answer", traced("age_answer")(age_ans_node))
+workflow.add_node("age_router", traced("age_router")(age_router_node))
+workflow.add_node("assessment", traced("assessment")(assessment_node))
+workflow.add_node("follow_up", traced("follow_up")(follow_up_node))
+workflow.add_node("follow_up_answer", traced("follow_up_answer")(follow_up_answer_node))
+workflow.add_node("guidance", traced("guidance")(guidance_node))
 
 workflow.set_entry_point("welcome")
 workflow.add_edge("welcome", "age_router")
-# workflow.add_edge("age_answer", "age_router")
+# each question is followed by a stop for the user's answer
+workflow.add_edge("age_question_generator", "age_answer")
+workflow.add_edge("age_answer", "age_router")
 
 workflow.add_conditional_edges(
     "age_router",
     age_route_decision,
     {
         "ask_more": "age_question_generator",
-        "evaluate_age": "age_evaluation",
+        "evaluate_age": "assessment",
+        "skip": END,
         "done": END  # Wait for user input
     }
 )
-workflow.add_edge("age_evaluation", "mental_state_assessor")
-workflow.add_edge("mental_state_assessor", "follow_up")
-workflow.add_edge("follow_up", END)  # Wait for user response
+# one LLM call covers both the age evaluation and the mental state assessment
+workflow.add_edge("assessment", "follow_up")
+# the follow-up question stops for the user's answer, which gets the final guidance
+workflow.add_edge("follow_up", "follow_up_answer")
+workflow.add_edge("follow_up_answer", "guidance")
 workflow.add_edge("guidance", END)
 
-memory = MemorySaver()
-app = workflow.compile()
-print(app)
+if CHECKPOINTER == "memory":
+    checkpointer = MemorySaver()
+else:
+    checkpointer = MongoSaver(lambda: mongo_db.get_mongo_connection()["chat_checkpoints"])
+app = workflow.compile(checkpointer=checkpointer)
 
 # INTERACTIVE SESSION
-def run_interactive_session():
+async def run_interactive_session():
     print("\n" + "="*80)
     print("🏥 Mental Health Counseling Chatbot - Interactive Mode")
     print("="*80)
@@ -388,15 +538,12 @@ def run_interactive_session():
         "age_answers": [],
     }
     
-    # Initial welcome - only invoke ONCE
-    for event in app.stream(state):
-        if "welcome" in event:
-            state = event["welcome"]
-            print(f"\nAssistant: {state['current_response']}")
-            break
+    # Initial welcome - only invoke ONCE, the graph then waits for the first answer
+    state = await run_graph(state, "interactive")
+    print(f"\nAssistant: {state['current_response']}")
     
     while True:
-        user_input = input("\nYou: ").strip()
+        user_input = (await asyncio.to_thread(input, "\nYou: ")).strip()
         
         if user_input.lower() in ['quit', 'exit', 'bye']:
             print("\nTake care! Remember, you're not alone.")
@@ -405,50 +552,43 @@ def run_interactive_session():
         if not user_input:
             continue
         
-        # Update state with user input
-        state["user_input"] = user_input
-        state["conversation_history"].append({
-            "role": "user",
-            "content": user_input
-        })
-        
-        # Stream through remaining nodes
-        for event in app.stream(state):
-            # Get the last node's output
-            node_name = list(event.keys())[0]
-            state = event[node_name]
-            if state.get("current_response"):
-                print(f"\n🤖 Assistant: {state['current_response']}")
+        # Resume the graph where it waits for the answer
+        state = await run_turn("interactive", user_input)
+        if state.get("current_response"):
+            print(f"\n🤖 Assistant: {state['current_response']}")
         
         # Check if we've reached the end
-        if state.get("follow_up_done") or state.get("final_guidance"):
+        if state.get("final_guidance"):
             break
 # === TESTING ===
-def test_workflow():
+# sample conversations, also replayed offline by benchmarks/bench_chatbot.py
+TEST_SCENARIOS = [
+    {
+        "name": "Child Case (Age 8-10)",
+        "messages": [
+            "I'm scared to go to school because the other kids are mean to me",
+            "They call me names and don't let me play with them at recess"
+        ]
+    },
+    {
+        "name": "Teen Case (Age 14-16)",
+        "messages": [
+            "everything is so stressful rn, school is hard and my parents keep fighting",
+            "i feel like nobody gets me and i just want to be alone all the time"
+        ]
+    },
+    {
+        "name": "Adult Case (Age 25+)",
+        "messages": [
+            "I've been experiencing persistent anxiety about my career and relationships",
+            "The stress is affecting my sleep and I'm having difficulty concentrating at work"
+        ]
+    }
+]
+
+async def test_workflow():
     """Test with automated scenarios"""
-    test_cases = [
-        {
-            "name": "Child Case (Age 8-10)",
-            "messages": [
-                "I'm scared to go to school because the other kids are mean to me",
-                "They call me names and don't let me play with them at recess"
-            ]
-        },
-        {
-            "name": "Teen Case (Age 14-16)",
-            "messages": [
-                "everything is so stressful rn, school is hard and my parents keep fighting",
-                "i feel like nobody gets me and i just want to be alone all the time"
-            ]
-        },
-        {
-            "name": "Adult Case (Age 25+)",
-            "messages": [
-                "I've been experiencing persistent anxiety about my career and relationships",
-                "The stress is affecting my sleep and I'm having difficulty concentrating at work"
-            ]
-        }
-    ]   
+    test_cases = TEST_SCENARIOS
     for test_case in test_cases:
         print("\n" + "="*80)
         print(f"TEST: {test_case['name']}")
@@ -470,17 +610,14 @@ def test_workflow():
             "final_guidance": "",
             "age_questions_asked": 0,  
             "age_answers": [],          
-            "router_flag": "",          
             "age_router_flag": ""   
         }        
         # Welcome
-        state = app.invoke(state)
+        state = await run_graph(state, test_case["name"])
         # Simulate conversation
         for msg in test_case["messages"]:
-            state["user_input"] = msg
-            state["conversation_history"].append({"role": "user", "content": msg})
             print(f"\n👤 User: {msg}")
-            state = app.invoke(state)
+            state = await run_turn(test_case["name"], msg)
             if state.get("evaluation_complete"):
                 break        
         print("\n" + "="*80 + "\n")
@@ -493,9 +630,9 @@ def test_workflow():
 #         print("API Key loaded\n")
 #         mode = input("Choose mode:\n1. Interactive Session\n2. Run Tests\n\nEnter 1 or 2: ").strip()
 #         if mode == "1":
-#             run_interactive_session()
+#             asyncio.run(run_interactive_session())
 #         else:
-#             test_workflow()
+#             asyncio.run(test_workflow())
 def getState(db):
     """Either gets the state stored in database or initializes a new state."""
     if db:
@@ -518,15 +655,160 @@ def getState(db):
         "final_guidance": "",
         "age_questions_asked": 0,
         "age_answers": [],
-        "router_flag": "",
+        "age_question_bank": [],
+        "conversation_summary": "",
+        "first_user_message": "",
         "age_router_flag": ""
     }
     return state
 
 
-def run_graph(state):
-    # Runs the workflow
-    final_state = app.invoke(state)
+def thread_config(user_id):
+    """Every user has one conversation thread, keyed by their id."""
+    return {"configurable": {"thread_id": str(user_id)}}
+
+
+def pin_session(user_id):
+    """
+    Keeps the user's conversation in memory until unpin_session: turns read and save it
+    there, and it is written to Mongo by flush_session and when the last pin is released.
+    """
+    if isinstance(checkpointer, MongoSaver):
+        checkpointer.pin(str(user_id))
+
+
+async def unpin_session(user_id):
+    if isinstance(checkpointer, MongoSaver):
+        await checkpointer.unpin(str(user_id))
+
+
+def session_dirty(user_id) -> bool:
+    """Whether a hot session holds state that flush_session would write."""
+    return isinstance(checkpointer, MongoSaver) and checkpointer.is_dirty(str(user_id))
+
+
+async def flush_session(user_id) -> bool:
+    """Writes the held-back state of a hot session, False if there was nothing to write."""
+    if not session_dirty(user_id):
+        return False
+    await checkpointer.flush(str(user_id))
+    return True
+
+
+async def get_graph_state(user_id):
+    """Latest saved state of the user's conversation, empty if they never started one."""
+    snapshot = await app.aget_state(thread_config(user_id))
+    return snapshot.values
+
+
+async def run_graph(state, user_id=None):
+    # Starts the user's conversation from the entry point and runs it up to the first
+    # node waiting for input. LLM calls inside the nodes are awaited and charged to the
+    # user's rate limit budget. The checkpointer saves the changed channels once, when
+    # the run stops.
+    current_llm_user.set(user_id)
+    final_state = await app.ainvoke(state, thread_config(user_id), durability="exit")
+    await record_messages(user_id, final_state, 0)
     return final_state
 
-    
\ No newline at end of file
+
+async def turn_input(user_id, text, legacy_state=None):
+    """
+    Graph input that resumes the node waiting for the user's message, and the length of
+    the history the turn starts from (the messages after it are the turn's new ones).
+    """
+    config = thread_config(user_id)
+    snapshot = await app.aget_state(config)
+    if not snapshot.next:
+        # conversations saved before turns were resumable end at END, run them up to the
+        # node waiting for input first (no LLM call, the question bank is in the state)
+        await app.ainvoke(snapshot.values or legacy_state or getState(None), config, durability="exit")
+        snapshot = await app.aget_state(config)
+    state = snapshot.values
+    # a session flagged as high risk, or turning high risk now, gets its LLM calls first
+    llm_urgent.set(state.get("risk_level") == "high" or risk_flag(text) == "high")
+    compacted = await conversation_memory.compact(dict(state), str(user_id), safe_invoke)
+    update = {
+        key: compacted[key]
+        for key in ("conversation_history", "conversation_summary", "first_user_message")
+        if compacted.get(key) != state.get(key)
+    }
+    return Command(resume=text, update=update or None), len(compacted.get("conversation_history", []))
+
+
+async def record_messages(user_id, state, new_from):
+    """
+    Copies the messages from index new_from of the state's history to the message store.
+    A session's first write also copies the messages it had before, archived ones included.
+    """
+    if CHECKPOINTER != "mongo":
+        return
+    session_id = str(user_id)
+    history = state.get("conversation_history", [])
+    try:
+        if await message_store.has_messages(session_id):
+            messages = history[new_from:]
+        else:
+            messages = await load_archive(session_id) + history
+        await message_store.append(session_id, messages)
+    except Exception as e:
+        # the state still has them, only the paged history misses this turn
+        logger.warning(f"Could not store messages of {session_id}: {e}")
+
+
+async def backfill_messages(user_id, legacy_state=None):
+    """Stores the history of a session that has not written to the message store yet."""
+    state = await get_graph_state(user_id) or legacy_state
+    if state:
+        await record_messages(user_id, state, len(state.get("conversation_history", [])))
+
+
+async def run_turn(user_id, text, legacy_state=None):
+    """Runs one user turn: resumes at the node that asked for input and stops at the next one."""
+    current_llm_user.set(user_id)
+    graph_input, new_from = await turn_input(user_id, text, legacy_state)
+    final_state = await app.ainvoke(graph_input, thread_config(user_id), durability="exit")
+    await record_messages(user_id, final_state, new_from)
+    return final_state
+
+
+# nodes whose LLM reply is the prose sent to the user, streamed token by token
+STREAMED_NODES = ("follow_up", "guidance")
+# node -> state fields sent once it finished, the others write JSON that is only shown parsed,
+# risk and concern stay on the server
+RESULT_FIELDS = {
+    "welcome": ("current_response",),
+    "age_question_generator": ("current_response",),
+    "assessment": ("current_response", "estimated_age", "age_category"),
+}
+
+
+async def stream_turn(user_id, text, legacy_state=None):
+    """
+    Runs a turn like run_turn but yields progress while it runs: ("node_start", node),
+    ("token", node, text) for STREAMED_NODES, ("result", node, fields) for the other nodes
+    that reply, ("node_end", node) and finally ("final", state).
+    """
+    current_llm_user.set(user_id)
+    graph_input, new_from = await turn_input(user_id, text, legacy_state)
+    final_state = {}
+    async for event in app.astream_events(graph_input, thread_config(user_id), version="v2", durability="exit"):
+        kind = event["event"]
+        node = event.get("metadata", {}).get("langgraph_node")
+        if kind == "on_chat_model_stream":
+            token = event["data"]["chunk"].content
+            if token and node in STREAMED_NODES:
+                yield ("token", node, token)
+        elif kind in ("on_chain_start", "on_chain_end") and event["name"] in workflow.nodes and node == event["name"]:
+            if kind == "on_chain_start":
+                yield ("node_start", node)
+                continue
+            output = event["data"].get("output")
+            if node in RESULT_FIELDS and isinstance(output, dict):
+                yield ("result", node, {field: output.get(field) for field in RESULT_FIELDS[node]})
+            yield ("node_end", node)
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            # the root run ends last and carries the final state
+            final_state = event["data"]["output"]
+    await record_messages(user_id, final_state, new_from)
+    yield ("final", final_state)
@@ -0,0 +1,390 @@
+from collections.abc import AsyncIterator, Sequence
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+import xxhash
+from bson import Binary
+from cachetools import LRUCache
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+_PLAIN_TYPES = (str, int, float, bool, type(None), datetime)
+
+
+def _is_plain(value) -> bool:
+    """True if Mongo can store the value as is, so it stays readable and queryable."""
+    if isinstance(value, _PLAIN_TYPES):
+        return True
+    if isinstance(value, list):
+        return all(_is_plain(v) for v in value)
+    if isinstance(value, dict):
+        return all(
+            isinstance(k, str) and "." not in k and not k.startswith("$") and _is_plain(v)
+            for k, v in value.items()
+        )
+    return False
+
+
+class CheckpointConflict(Exception):
+    """The thread was written by someone else since this saver last read or wrote it."""
+
+
+class MongoSaver(BaseCheckpointSaver[str]):
+    """
+    LangGraph checkpointer backed by Motor that keeps one document per thread.
+
+    Only the latest checkpoint of a thread is kept. Each put only touches the channels
+    the step changed: scalar channels get a targeted $set, and channels listed in
+    append_channels (e.g. conversation_history) get the new items $push-ed, so the
+    bytes written per turn don't grow with the length of the conversation. A list that
+    doesn't continue the stored one (compacted, or its last message edited) is written in
+    full instead.
+    A put that finds the stored lists changed by another writer raises CheckpointConflict
+    rather than overwriting them.
+
+    A pinned thread (see pin) is kept in memory while it is pinned: reads don't go to
+    Mongo and puts are held back until flush, which writes all the channels changed
+    since the previous flush in one update.
+    """
+
+    def __init__(self, get_collection, append_channels=("conversation_history",), *, serde=None,
+                 max_lists=10_000):
+        super().__init__(serde=serde)
+        # called lazily, the Mongo client only exists once the app has started
+        self.get_collection = get_collection
+        self.append_channels = set(append_channels)
+        # (thread_id, checkpoint_ns, channel) -> (length, digest of the last item, running digest) of
+        # the list stored in Mongo. Least recently used threads are dropped, their next put writes
+        # the list in full.
+        self.lengths = LRUCache(maxsize=max_lists)
+        # pinned thread_id -> {"pins": count, "namespaces": {checkpoint_ns: latest checkpoint and what isn't flushed}}
+        self.hot = {}
+
+    def _dump(self, value):
+        if _is_plain(value):
+            return value
+        type_, data = self.serde.dumps_typed(value)
+        return {"__typed__": type_, "data": Binary(data)}
+
+    def _load(self, value):
+        if isinstance(value, dict) and "__typed__" in value:
+            return self.serde.loads_typed((value["__typed__"], bytes(value["data"])))
+        return value
+
+    def _digest(self, item, seed=0) -> int:
+        return xxhash.xxh3_64_intdigest(self.serde.dumps_typed(item)[1], seed=seed)
+
+    def _chain(self, items, running=0) -> int:
+        """Running digest of a list, extended item by item so an append only hashes the new items."""
+        for item in items:
+            running = self._digest(item, running)
+        return running
+
+    def _known(self, items, running=None):
+        """What self.lengths keeps for a stored list, `running` if the caller already has it."""
+        return (
+            len(items),
+            self._digest(items[-1]) if items else None,
+            self._chain(items) if running is None else running,
+        )
+
+    def _load_values(self, doc, thread_id, checkpoint_ns):
+        values = {}
+        for channel, value in doc.get("values", {}).items():
+            if channel in self.append_channels:
+                value = [self._load(v) for v in value]
+                known = self._known(value)
+                # lists saved with another digest get written in full once, then appended to again
+                if doc.get("digests", {}).get(channel) == f"{known[2]:016x}":
+                    self.lengths[(thread_id, checkpoint_ns, channel)] = known
+                else:
+                    self.lengths.pop((thread_id, checkpoint_ns, channel), None)
+            else:
+                value = self._load(value)
+            values[channel] = value
+        return values
+
+    def _write_items(self, writes, task_id, task_path):
+        return [
+            {
+                "task_id": task_id,
+                "idx": WRITES_IDX_MAP.get(channel, idx),
+                "channel": channel,
+                "value": self._dump(value),
+                "task_path": task_path,
+            }
+            for idx, (channel, value) in enumerate(writes)
+        ]
+
+    def _load_writes(self, writes):
+        pending = {}
+        for w in writes:
+            key = (w["task_id"], w["idx"])
+            # regular writes keep the first copy, special writes (interrupts, errors) the last one
+            if w["idx"] >= 0 and key in pending:
+                continue
+            pending[key] = (w["task_id"], w["channel"], self._load(w["value"]))
+        return list(pending.values())
+
+    def pin(self, thread_id: str) -> None:
+        """Keeps the thread in memory until each pin is released with unpin."""
+        self.hot.setdefault(thread_id, {"pins": 0, "namespaces": {}})["pins"] += 1
+
+    async def unpin(self, thread_id: str) -> None:
+        """Releases a pin, the last one flushes the thread and drops it from memory."""
+        hot = self.hot[thread_id]
+        if hot["pins"] == 1:
+            await self.flush(thread_id)
+            del self.hot[thread_id]
+        else:
+            hot["pins"] -= 1
+
+    def is_dirty(self, thread_id: str) -> bool:
+        hot = self.hot.get(thread_id)
+        return bool(hot) and any(e["put"] or e["unflushed"] for e in hot["namespaces"].values())
+
+    async def flush(self, thread_id: str) -> None:
+        """
+        Writes what a pinned thread held back. Call it between runs of the thread, e.g.
+        under the user's turn lock. What fails to write stays held for the next flush.
+        """
+        hot = self.hot.get(thread_id)
+        for entry in (hot["namespaces"].values() if hot else ()):
+            if entry["put"]:
+                config, metadata, channels = entry["put"]
+                checkpoint = self.serde.loads_typed(entry["checkpoint"])
+                await self._put_db(config, checkpoint, metadata, channels)
+                entry["put"] = None
+                # the put cleared the stored writes, all of the checkpoint's writes go again
+                entry["unflushed"] = entry["writes"]
+            if entry["unflushed"]:
+                await self._put_writes_db(entry["config"], entry["unflushed"])
+                entry["unflushed"] = []
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        hot = self.hot.get(thread_id)
+        entry = hot["namespaces"].get(checkpoint_ns) if hot else None
+        if entry is None:
+            doc = await self.get_collection().find_one({"thread_id": thread_id, "checkpoint_ns": checkpoint_ns})
+            if not doc:
+                return None
+            checkpoint_tuple = self._doc_tuple(doc, thread_id, checkpoint_ns)
+            if hot:
+                entry = hot["namespaces"][checkpoint_ns] = {
+                    "config": checkpoint_tuple.config,
+                    # serialised like MemorySaver does, so the graph changing its objects doesn't change ours
+                    "checkpoint": self.serde.dumps_typed(checkpoint_tuple.checkpoint),
+                    "metadata": checkpoint_tuple.metadata,
+                    "parent_config": checkpoint_tuple.parent_config,
+                    "writes": doc.get("writes", []),
+                    "put": None,
+                    "unflushed": [],
+                }
+        else:
+            checkpoint_tuple = CheckpointTuple(
+                config=entry["config"],
+                checkpoint=self.serde.loads_typed(entry["checkpoint"]),
+                metadata=entry["metadata"],
+                parent_config=entry["parent_config"],
+                pending_writes=self._load_writes(entry["writes"]),
+            )
+        checkpoint_id = get_checkpoint_id(config)
+        if checkpoint_id and checkpoint_id != checkpoint_tuple.config["configurable"]["checkpoint_id"]:
+            # older checkpoints are not kept
+            return None
+        return checkpoint_tuple
+
+    def _doc_tuple(self, doc, thread_id, checkpoint_ns) -> CheckpointTuple:
+        checkpoint = self.serde.loads_typed((doc["checkpoint"]["type"], bytes(doc["checkpoint"]["data"])))
+        checkpoint["channel_values"] = self._load_values(doc, thread_id, checkpoint_ns)
+        parent_id = doc.get("parent_checkpoint_id")
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": doc["checkpoint_id"],
+                }
+            },
+            checkpoint=checkpoint,
+            metadata=self._load(doc.get("metadata", {})),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id}}
+                if parent_id
+                else None
+            ),
+            pending_writes=self._load_writes(doc.get("writes", [])),
+        )
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        # only the latest checkpoint is stored, so there is at most one to list
+        if config is None or limit == 0:
+            return
+        checkpoint = await self.aget_tuple(config)
+        if checkpoint is None:
+            return
+        if before and get_checkpoint_id(before) and checkpoint.config["configurable"]["checkpoint_id"] >= get_checkpoint_id(before):
+            return
+        if filter and any(checkpoint.metadata.get(k) != v for k, v in filter.items()):
+            return
+        yield checkpoint
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        hot = self.hot.get(thread_id)
+        if hot is None:
+            return await self._put_db(config, checkpoint, metadata, new_versions)
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        entry = hot["namespaces"].get(checkpoint_ns)
+        # channels changed by earlier puts that weren't flushed yet are written with this one
+        channels = set(new_versions) | (entry["put"][2] if entry and entry["put"] else set())
+        new_config = {
+            "configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}
+        }
+        hot["namespaces"][checkpoint_ns] = {
+            "config": new_config,
+            "checkpoint": self.serde.dumps_typed(checkpoint),
+            "metadata": get_checkpoint_metadata(config, metadata),
+            "parent_config": (
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                  "checkpoint_id": config["configurable"]["checkpoint_id"]}}
+                if config["configurable"].get("checkpoint_id")
+                else None
+            ),
+            "writes": [],
+            "put": (config, metadata, channels),
+            "unflushed": [],
+        }
+        return new_config
+
+    async def _put_db(self, config, checkpoint, metadata, new_versions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        c = checkpoint.copy()
+        values = c.pop("channel_values")
+        type_, data = self.serde.dumps_typed(c)
+
+        set_fields = {
+            "checkpoint": {"type": type_, "data": Binary(data)},
+            "metadata": self._dump(get_checkpoint_metadata(config, metadata)),
+            "checkpoint_id": checkpoint["id"],
+            "parent_checkpoint_id": config["configurable"].get("checkpoint_id"),
+            "writes": [],
+            "updated_at": datetime.now(timezone.utc),
+        }
+        unset_fields = {}
+        push_fields = {}
+        # appends are only valid if Mongo still holds the list we last saw, same length and running digest
+        expected_lengths = {}
+        new_lengths = {}
+        for channel in new_versions:
+            if channel not in values:
+                unset_fields[f"values.{channel}"] = ""
+                continue
+            value = values[channel]
+            if channel in self.append_channels and isinstance(value, list):
+                known, last, running = self.lengths.get((thread_id, checkpoint_ns, channel), (None, None, None))
+                # the list continues the stored one if it is as long and still ends with the stored last
+                # item; histories are appended to or compacted (shorter), so the older items aren't hashed
+                if known is not None and len(value) >= known and (
+                        not known or self._digest(value[known - 1]) == last):
+                    expected_lengths[channel] = (known, running)
+                    new_lengths[channel] = self._known(value, self._chain(value[known:], running))
+                    if len(value) > known:
+                        push_fields[f"values.{channel}"] = {"$each": [self._dump(v) for v in value[known:]]}
+                else:
+                    new_lengths[channel] = self._known(value)
+                    set_fields[f"values.{channel}"] = self._dump(value)
+                set_fields[f"lengths.{channel}"] = len(value)
+                set_fields[f"digests.{channel}"] = f"{new_lengths[channel][2]:016x}"
+                continue
+            set_fields[f"values.{channel}"] = self._dump(value)
+
+        collection = self.get_collection()
+        key = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}
+        update = {"$set": set_fields}
+        if unset_fields:
+            update["$unset"] = unset_fields
+        if push_fields:
+            update["$push"] = push_fields
+        if expected_lengths:
+            guard = {}
+            for channel, (length, running) in expected_lengths.items():
+                guard.update({f"lengths.{channel}": length, f"digests.{channel}": f"{running:016x}"})
+            result = await collection.update_one({**key, **guard}, update)
+            if result.matched_count == 0:
+                # someone else wrote this thread in the meantime, the next read loads what they wrote
+                for channel in expected_lengths:
+                    self.lengths.pop((thread_id, checkpoint_ns, channel), None)
+                raise CheckpointConflict(f"Thread {thread_id} was changed by another writer")
+        else:
+            await collection.update_one(key, update, upsert=True)
+
+        for channel, known in new_lengths.items():
+            self.lengths[(thread_id, checkpoint_ns, channel)] = known
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        if not writes:
+            return
+        items = self._write_items(writes, task_id, task_path)
+        hot = self.hot.get(config["configurable"]["thread_id"])
+        entry = hot["namespaces"].get(config["configurable"].get("checkpoint_ns", "")) if hot else None
+        if entry and entry["config"]["configurable"]["checkpoint_id"] == config["configurable"]["checkpoint_id"]:
+            entry["writes"] = entry["writes"] + items
+            entry["unflushed"] = entry["unflushed"] + items
+            return
+        await self._put_writes_db(config, items)
+
+    async def _put_writes_db(self, config, items) -> None:
+        await self.get_collection().update_one(
+            {
+                "thread_id": config["configurable"]["thread_id"],
+                "checkpoint_ns": config["configurable"].get("checkpoint_ns", ""),
+                "checkpoint_id": config["configurable"]["checkpoint_id"],
+            },
+            {"$push": {"writes": {"$each": items}}},
+        )
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self.get_collection().delete_many({"thread_id": thread_id})
+        if thread_id in self.hot:
+            self.hot[thread_id]["namespaces"].clear()
+        for key in [k for k in self.lengths if k[0] == thread_id]:
+            del self.lengths[key]
@@ -1,17 +1,12 @@
 import os
 import dotenv
 dotenv.load_dotenv()
-os.environ["GROQ_API_KEY"] = os.getenv("GROQ_API_KEY_TEST")
-from langchain_groq import ChatGroq
+if os.getenv("GROQ_API_KEY_TEST"):
+    os.environ["GROQ_API_KEY"] = os.getenv("GROQ_API_KEY_TEST")
+from app.services.llm_pool import build_pool
 
-llm = ChatGroq(
-    model="llama-3.1-8b-instant",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    # other params...
-)
+# every LLM call in the app goes through this pool, see LLM_BACKENDS in llm_pool.py
+llm = build_pool()
 
 if __name__ == "__main__":
     messages = [
@@ -22,4 +17,4 @@ if __name__ == "__main__":
     ("human", "I love programming."),
 ]
     ai_msg = llm.invoke(messages)
-    print(ai_msg.content)
\ No newline at end of file
+    print(ai_msg.content)
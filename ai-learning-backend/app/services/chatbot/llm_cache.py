@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+import dotenv
+import xxhash
+from cachetools import TTLCache
+from langchain_core.messages import AIMessage
+
+dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+# nodes whose prompts only depend on a few categorical fields, so replies can be shared between users
+CACHED_NODES = {n.strip() for n in os.getenv("LLM_CACHE_NODES", "follow_up,guidance").split(",") if n.strip()}
+CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+CACHE_TTL = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(24 * 3600)))
+# how many different replies are kept per prompt, one of them is served at random once all are cached
+CACHE_VARIANTS = int(os.getenv("LLM_CACHE_VARIANTS", "1"))
+# second tier in Mongo so the cache survives restarts and is shared by workers
+CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST", "1") == "1"
+
+
+def normalize_prompt(prompt: str) -> str:
+    return re.sub(r"\s+", " ", prompt).strip().lower()
+
+
+def prompt_key(node: str, prompt: str) -> str:
+    return f"{node}:{xxhash.xxh3_64_hexdigest(normalize_prompt(prompt).encode())}"
+
+
+def fields_key(node: str, fields: dict) -> str:
+    """Key of a prompt that carries free text too, only the categorical fields it was built from count."""
+    return f"{node}:{xxhash.xxh3_64_hexdigest(json.dumps(fields, sort_keys=True, default=str).encode())}"
+
+
+class LLMResponseCache:
+    """LRU + TTL cache of LLM replies with an optional Mongo tier."""
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL, variants=CACHE_VARIANTS, persist=CACHE_PERSIST,
+                 collection_name="llm_cache"):
+        self.memory = TTLCache(maxsize=size, ttl=ttl)
+        self.ttl = ttl
+        self.variants = variants
+        self.persist = persist
+        self.collection_name = collection_name
+        self._indexed = False
+        # key -> task asking the LLM, concurrent misses on the same key wait for it instead of calling again
+        self.pending = {}
+        self.stats = {"hits": 0, "mongo_hits": 0, "misses": 0, "coalesced": 0, "stores": 0, "errors": 0}
+
+    def _collection(self):
+        from app.mongo_db import get_mongo_connection
+        return get_mongo_connection()[self.collection_name]
+
+    async def _load(self, key):
+        if key in self.memory:
+            return self.memory[key]
+        if not self.persist:
+            return None
+        try:
+            doc = await self._collection().find_one({"_id": key}, {"variants": 1})
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"LLM cache lookup failed: {e}")
+            return None
+        if doc and doc.get("variants"):
+            self.memory[key] = doc["variants"]
+            self.stats["mongo_hits"] += 1
+            return doc["variants"]
+        return None
+
+    async def get(self, key):
+        """A cached reply, or None when the caller should ask the LLM (miss, or more variants wanted)."""
+        variants = await self._load(key)
+        if variants and len(variants) >= self.variants:
+            self.stats["hits"] += 1
+            return random.choice(variants)
+        self.stats["misses"] += 1
+        return None
+
+    async def put(self, key, content):
+        variants = (self.memory.get(key) or []) + [content]
+        self.memory[key] = variants[-self.variants:]
+        self.stats["stores"] += 1
+        if not self.persist:
+            return
+        try:
+            collection = self._collection()
+            if not self._indexed:
+                await collection.create_index("expires_at", expireAfterSeconds=0)
+                self._indexed = True
+            await collection.update_one(
+                {"_id": key},
+                {
+                    "$push": {"variants": {"$each": [content], "$slice": -self.variants}},
+                    "$set": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl)},
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"LLM cache write failed: {e}")
+
+
+response_cache = LLMResponseCache()
+
+
+def get_llm_cache_stats():
+    return dict(response_cache.stats)
+
+
+async def _fill(key, prompt, invoke):
+    try:
+        response = await invoke(prompt)
+        await response_cache.put(key, response.content)
+        return response
+    finally:
+        response_cache.pending.pop(key, None)
+
+
+async def cached_call(node: str, prompt: str, invoke, key_fields: dict = None):
+    """
+    Serves the node's prompt from the cache if the node opted in, otherwise awaits invoke(prompt).
+    With key_fields the reply is cached under those fields instead of the prompt text.
+    """
+    if node not in CACHED_NODES:
+        return await invoke(prompt)
+    key = fields_key(node, key_fields) if key_fields is not None else prompt_key(node, prompt)
+    content = await response_cache.get(key)
+    if content is not None:
+        return AIMessage(content=content)
+    task = response_cache.pending.get(key)
+    if task is None:
+        task = response_cache.pending[key] = asyncio.create_task(_fill(key, prompt, invoke))
+    else:
+        response_cache.stats["coalesced"] += 1
+    # shielded, a caller that goes away doesn't cancel the reply the others wait for
+    response = await asyncio.shield(task)
+    return AIMessage(content=response.content)
@@ -0,0 +1,92 @@
+import os
+import logging
+from datetime import datetime, timezone
+import dotenv
+from app.services.telemetry import traced
+from app.services.token_budget import fit_items, prompt_budget, trim_text
+
+dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+# messages kept in the state after a compaction
+HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+# compaction only runs once this many messages piled up past the window, so the
+# history list is rewritten once every few turns instead of on every turn
+COMPACT_CHUNK = int(os.getenv("CHAT_HISTORY_COMPACT_CHUNK", "10"))
+SUMMARY_MAX_WORDS = 120
+
+
+async def archive_to_mongo(thread_id, messages):
+    """Cold storage for messages that left the window."""
+    from app.mongo_db import get_mongo_connection
+
+    await get_mongo_connection()["chat_history_archive"].insert_one({
+        "thread_id": thread_id,
+        "messages": messages,
+        "archived_at": datetime.now(timezone.utc),
+    })
+
+
+async def load_archive(thread_id) -> list:
+    """Messages archived for the thread, oldest first."""
+    from app.mongo_db import get_mongo_connection
+
+    cursor = get_mongo_connection()["chat_history_archive"].find({"thread_id": thread_id}).sort("archived_at", 1)
+    return [m async for doc in cursor for m in doc.get("messages", [])]
+
+
+class ConversationMemory:
+    """Keeps conversation_history to a bounded window plus a rolling summary of older turns."""
+
+    def __init__(self, window=HISTORY_WINDOW, chunk=COMPACT_CHUNK, archive=archive_to_mongo):
+        self.window = window
+        self.chunk = chunk
+        self.archive = archive
+
+    def needs_compaction(self, state) -> bool:
+        return len(state.get("conversation_history", [])) > self.window + self.chunk
+
+    @traced("history_summary", kind="service")
+    async def summarize(self, summary, messages, invoke) -> str:
+        """Folds the messages into the existing summary with one short LLM call."""
+        lines = [f"{m.get('role')}: {m.get('content')}" for m in messages]
+        # long messages are cut, and if the chunk is still too big the oldest lines are left out
+        transcript = "\n".join(fit_items(lines, prompt_budget("history_summary") - 500, item_budget=200))
+        prompt = f"""Update the running summary of a counseling conversation.
+
+Current summary:
+{trim_text(summary, 300) if summary else "(none yet)"}
+
+New messages:
+{transcript}
+
+Return ONLY the updated summary in at most {SUMMARY_MAX_WORDS} words. Keep the user's main concerns,
+feelings, and anything they asked to be remembered."""
+        response = await invoke(prompt)
+        return response.content.strip()
+
+    async def compact(self, state, thread_id, invoke):
+        """Moves the oldest messages out of the state once the window overflows, returns the state."""
+        if not self.needs_compaction(state):
+            return state
+        history = state["conversation_history"]
+        overflow, recent = history[:-self.window], history[-self.window:]
+        try:
+            await self.archive(thread_id, overflow)
+        except Exception as e:
+            # keep the messages rather than lose them, the next turn tries again
+            logger.warning(f"Could not archive history for {thread_id}: {e}")
+            return state
+        if not state.get("first_user_message"):
+            first = next((m["content"] for m in overflow if m.get("role") == "user"), None)
+            if first:
+                state["first_user_message"] = first
+        try:
+            state["conversation_summary"] = await self.summarize(state.get("conversation_summary", ""), overflow, invoke)
+        except Exception as e:
+            logger.warning(f"Could not update summary for {thread_id}: {e}")
+        state["conversation_history"] = recent
+        return state
+
+
+conversation_memory = ConversationMemory()
@@ -0,0 +1,128 @@
+import os
+from datetime import datetime, timedelta, timezone
+import dotenv
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+
+dotenv.load_dotenv()
+
+MESSAGES_COLLECTION = "chat_messages"
+HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = 200
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# only what the history endpoint returns is read back
+_PROJECTION = {"role": 1, "content": 1, "timestamp": 1}
+
+
+def _as_utc(value):
+    """Message timestamp as an aware datetime at Mongo's millisecond precision, None if missing."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def encode_cursor(doc) -> str:
+    millis = (_as_utc(doc["timestamp"]) - _EPOCH) // timedelta(milliseconds=1)
+    return f"{millis}-{doc['_id']}"
+
+
+def decode_cursor(cursor: str):
+    """(timestamp, ObjectId) of a cursor, ValueError if it isn't one."""
+    millis, _, object_id = cursor.partition("-")
+    try:
+        return _EPOCH + timedelta(milliseconds=int(millis)), ObjectId(object_id)
+    except (InvalidId, TypeError, OverflowError) as e:
+        raise ValueError(f"Invalid cursor {cursor!r}") from e
+
+
+class MessageStore:
+    """
+    Chat messages, one document per message, next to the checkpointed conversation state.
+
+    The state only keeps a window of recent messages for the prompts, this collection
+    keeps all of them so clients can page through the history without loading the state.
+    Pages are read newest first along the (session_id, timestamp, _id) index.
+    """
+
+    def __init__(self, get_collection):
+        # called lazily, the Mongo client only exists once the app has started
+        self.get_collection = get_collection
+        self._indexed = False
+        # sessions known to have their messages in the collection
+        self.known = set()
+
+    async def _collection(self):
+        collection = self.get_collection()
+        if not self._indexed:
+            # _id breaks ties between messages written in the same millisecond
+            await collection.create_index([("session_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)])
+            self._indexed = True
+        return collection
+
+    async def has_messages(self, session_id) -> bool:
+        if session_id in self.known:
+            return True
+        found = await (await self._collection()).find_one({"session_id": session_id}, {"_id": 1})
+        if found:
+            self.known.add(session_id)
+        return found is not None
+
+    async def append(self, session_id, messages):
+        """
+        Writes messages in one insert_many. Messages without their own timestamp get the
+        current time, and timestamps never go backwards so the stored order is the given one.
+        """
+        if not messages:
+            return
+        now = _as_utc(datetime.now(timezone.utc))
+        last = _EPOCH
+        docs = []
+        for message in messages:
+            last = max(last, _as_utc(message.get("timestamp")) or now)
+            docs.append({
+                "session_id": session_id,
+                "role": message.get("role", ""),
+                "content": message.get("content", ""),
+                "timestamp": last,
+            })
+        await (await self._collection()).insert_many(docs, ordered=True)
+        self.known.add(session_id)
+
+    async def page(self, session_id, before=None, limit=HISTORY_PAGE_SIZE):
+        """
+        The `limit` messages before the `before` cursor (the latest ones without it), oldest first.
+        Returns (messages, cursor of the next older page or None).
+        """
+        query = {"session_id": session_id}
+        if before:
+            timestamp, object_id = decode_cursor(before)
+            query["$or"] = [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$lt": object_id}},
+            ]
+        cursor = (await self._collection()).find(query, _PROJECTION).sort(
+            [("timestamp", DESCENDING), ("_id", DESCENDING)]
+        ).limit(limit + 1)
+        docs = await cursor.to_list(limit + 1)
+        more = len(docs) > limit
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1]) if more else None
+        return docs[::-1], next_cursor
+
+
+def _messages_collection():
+    from app.mongo_db import get_mongo_connection
+
+    return get_mongo_connection()[MESSAGES_COLLECTION]
+
+
+message_store = MessageStore(_messages_collection)
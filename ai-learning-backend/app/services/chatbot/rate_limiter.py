@@ -1,19 +1,221 @@
-
+import os
 import time
-import openai
+import random
+import asyncio
+import logging
+import functools
+import contextvars
+import dotenv
+from pymongo import ReturnDocument
+from app.services.telemetry import record_rate_limit_wait, record_retry
 
-MAX_REQUESTS_PER_MIN = 20 
-DELAY = 60 / MAX_REQUESTS_PER_MIN
-def llm_rate_limiter(func):
-    def wrapper(*args, **kwargs):
-        time.sleep(DELAY)  # delay each call
-        for attempt in range(5):
+dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+# provider quota shared by every caller of the LLM
+MAX_REQUESTS_PER_MIN = int(os.getenv("LLM_MAX_REQUESTS_PER_MIN", "20"))
+BURST = int(os.getenv("LLM_BURST", "5"))
+# part of the global burst only urgent calls (high-risk sessions) may use, so they don't queue behind others
+URGENT_RESERVE = int(os.getenv("LLM_URGENT_RESERVE", "1"))
+# budget of a single user, so one chatty student can't eat the whole quota
+USER_REQUESTS_PER_MIN = int(os.getenv("LLM_USER_REQUESTS_PER_MIN", "6"))
+USER_BURST = int(os.getenv("LLM_USER_BURST", "3"))
+
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+# "memory" keeps the buckets in this process, "mongo" shares them between uvicorn workers
+BACKEND = os.getenv("LLM_RATE_LIMIT_BACKEND", "memory")
+
+# set by the caller (run_graph, routers) so the limiter knows whose budget to charge
+current_llm_user: contextvars.ContextVar = contextvars.ContextVar("current_llm_user", default=None)
+# set for LLM calls of a session flagged as high risk
+llm_urgent: contextvars.ContextVar = contextvars.ContextVar("llm_urgent", default=False)
+
+
+class MemoryBucketBackend:
+    """Token buckets kept in process memory."""
+
+    def __init__(self):
+        self.buckets = {}
+
+    async def take(self, key, rate, capacity, tokens=1, reserve=0):
+        """
+        Takes tokens from the bucket, returns 0 if granted or the seconds to wait before retrying.
+        `reserve` tokens must stay in the bucket after the take.
+        """
+        # no await in here, so the read-modify-write can't interleave with another task
+        now = time.monotonic()
+        level, updated = self.buckets.get(key, (capacity, now))
+        level = min(capacity, level + (now - updated) * rate)
+        if level >= tokens + reserve:
+            self.buckets[key] = (level - tokens, now)
+            return 0.0
+        self.buckets[key] = (level, now)
+        return (tokens + reserve - level) / rate
+
+
+class MongoBucketBackend:
+    """Token buckets stored in Mongo so several workers split one provider quota."""
+
+    def __init__(self, collection_name="llm_rate_limits"):
+        self.collection_name = collection_name
+
+    async def take(self, key, rate, capacity, tokens=1, reserve=0):
+        from app.mongo_db import get_mongo_connection
+
+        collection = get_mongo_connection()[self.collection_name]
+        # refill and take in one atomic pipeline update, $$NOW keeps all workers on the server clock
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, rate]}]}]}
+        doc = await collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": "$$NOW"}},
+                {"$set": {"granted": {"$gte": ["$tokens", tokens + reserve]}}},
+                {"$set": {"tokens": {"$cond": ["$granted", {"$subtract": ["$tokens", tokens]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc["granted"]:
+            return 0.0
+        return (tokens + reserve - doc["tokens"]) / rate
+
+
+class RateLimiter:
+    """Async token bucket limiter with a global and a per-user budget."""
+
+    def __init__(self, backend, rate_per_min, burst, user_rate_per_min, user_burst, max_retries=MAX_RETRIES,
+                 urgent_reserve=URGENT_RESERVE):
+        self.backend = backend
+        self.rate = rate_per_min / 60
+        self.burst = burst
+        self.urgent_reserve = max(0, min(urgent_reserve, burst - 1))
+        self.user_rate = user_rate_per_min / 60
+        self.user_burst = user_burst
+        self.max_retries = max_retries
+        # set when the provider answers 429 with Retry-After, every caller waits until then
+        self.blocked_until = 0.0
+        self.stats = {
+            "calls": 0,
+            "throttled_calls": 0,
+            # tokens the buckets were short of when calls came in, summed
+            "tokens_short": 0.0,
+            "wait_seconds": 0.0,
+            "retries": 0,
+            "provider_rate_limited": 0,
+            "failures": 0,
+            "urgent_calls": 0,
+        }
+
+    async def _wait_for(self, key, rate, capacity, reserve=0):
+        waited = 0.0
+        while True:
+            wait = await self.backend.take(key, rate, capacity, reserve=reserve)
+            if wait <= 0:
+                return waited
+            if not waited:
+                self.stats["tokens_short"] += wait * rate
+            waited += wait
+            await asyncio.sleep(wait)
+
+    async def acquire(self, user=None):
+        """
+        Waits until both the user's and the global bucket grant a token, returns the seconds waited.
+        Urgent calls skip the user's budget and may use the reserved part of the global burst.
+        """
+        waited = 0.0
+        urgent = llm_urgent.get()
+        pause = self.blocked_until - time.monotonic()
+        if pause > 0:
+            waited += pause
+            await asyncio.sleep(pause)
+        if user is not None and not urgent:
+            waited += await self._wait_for(f"user:{user}", self.user_rate, self.user_burst)
+        waited += await self._wait_for("global", self.rate, self.burst, reserve=0 if urgent else self.urgent_reserve)
+
+        self.stats["calls"] += 1
+        if urgent:
+            self.stats["urgent_calls"] += 1
+        record_rate_limit_wait(waited)
+        if waited > 0:
+            self.stats["throttled_calls"] += 1
+            self.stats["wait_seconds"] += waited
+        return waited
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to sleep before the next attempt, the provider's Retry-After wins over jittered backoff."""
+        if retry_after is not None:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            return retry_after
+        return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    async def call(self, func, *args, **kwargs):
+        last_error = None
+        for attempt in range(self.max_retries):
+            await self.acquire(current_llm_user.get())
             try:
-                return func(*args, **kwargs)
-            except openai.RateLimitError:
-                wait = 2 ** attempt
-                print(f"Rate limit reached. Retrying in {wait}s ...")
-                time.sleep(wait)
-        raise Exception("Failed after multiple retries.")
-    return wrapper
+                return await func(*args, **kwargs)
+            except Exception as e:
+                status = "timeout" if _is_timeout(e) else _status_code(e)
+                if status != "timeout" and status != 429 and not (isinstance(status, int) and status >= 500):
+                    raise
+                last_error = e
+                if status == 429:
+                    self.stats["provider_rate_limited"] += 1
+                wait = self.backoff(attempt, _retry_after(e))
+                self.stats["retries"] += 1
+                record_retry(status)
+                logger.warning(f"LLM call failed with {status}, retrying in {wait:.1f}s")
+                await asyncio.sleep(wait)
+        self.stats["failures"] += 1
+        raise Exception("Failed after multiple retries.") from last_error
+
+
+def _status_code(error):
+    """HTTP status of a provider error (groq, openai and httpx errors all carry a response)."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    return status
+
+
+def _is_timeout(error):
+    """asyncio and socket timeouts, and the timeout errors of httpx and the provider SDKs."""
+    return isinstance(error, TimeoutError) or any("Timeout" in cls.__name__ for cls in type(error).__mro__)
 
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header in ("retry-after", "x-ratelimit-reset-requests"):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return float(str(value).rstrip("s"))
+        except ValueError:
+            continue
+    return None
+
+
+limiter = RateLimiter(
+    MongoBucketBackend() if BACKEND == "mongo" else MemoryBucketBackend(),
+    MAX_REQUESTS_PER_MIN,
+    BURST,
+    USER_REQUESTS_PER_MIN,
+    USER_BURST,
+)
+
+
+def get_rate_limiter_stats():
+    return dict(limiter.stats)
+
+
+def llm_rate_limiter(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await limiter.call(func, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,242 @@
+"""
+Re-scores stored age assessments with the current assessment prompt and model.
+
+Usage (from ai-learning-backend/):
+    python -m app.services.chatbot.rescore --dry-run --limit 200
+    python -m app.services.chatbot.rescore --batch-size 100 --concurrency 8
+    python -m app.services.chatbot.rescore --resume <run id>
+"""
+import os
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timezone
+import dotenv
+from pymongo import ASCENDING, UpdateOne
+
+from app import mongo_db
+from app.services.telemetry import traced
+from app.services.token_budget import usage_recorder
+from . import agent_chatbot
+from .risk_classifier import classify_many, first_user_message, risk_flag
+from .structured_output import AssessmentResult, parse_structured
+
+dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+RESCORE_BATCH_SIZE = int(os.getenv("RESCORE_BATCH_SIZE", "50"))
+RESCORE_CONCURRENCY = int(os.getenv("RESCORE_CONCURRENCY", "4"))
+RUNS_COLLECTION = "rescore_runs"
+
+# (collection, field holding the conversation state), read in this order
+SOURCES = [
+    ("chat_checkpoints", "values"),
+    # sessions that finished before the checkpointer kept their state inline
+    ("chat_sessions", "state"),
+]
+# assessment fields compared to tell whether the new score differs from the stored one
+COMPARED_FIELDS = ("estimated_age", "age_category", "risk_level", "primary_concern")
+
+RUNNING, FINISHED, FAILED = "running", "finished", "failed"
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _projection(prefix):
+    return {
+        f"{prefix}.age_answers": 1,
+        f"{prefix}.first_user_message": 1,
+        # the first user messages, for older sessions and the risk floor
+        f"{prefix}.conversation_history": {"$slice": 5},
+        **{f"{prefix}.{field}": 1 for field in agent_chatbot.assessment_fields(AssessmentResult())},
+        **{f"{prefix}.{field}": 1 for field in agent_chatbot.LLM_LABEL_FIELDS},
+    }
+
+
+def report(run: dict) -> dict:
+    """Progress of a run as shown by the CLI and the admin endpoint."""
+    elapsed = run.get("elapsed_seconds", 0.0)
+    return {
+        "run_id": run["_id"],
+        "status": run["status"],
+        "dry_run": run["dry_run"],
+        "processed": run["processed"],
+        "updated": run["updated"],
+        "changed": run["changed"],
+        "failed": run["failed"],
+        "elapsed_seconds": round(elapsed, 1),
+        "sessions_per_sec": round(run["processed"] / elapsed, 2) if elapsed else 0.0,
+        "error": run.get("error"),
+    }
+
+
+async def create_run(db=None, dry_run=False, batch_size=RESCORE_BATCH_SIZE,
+                     concurrency=RESCORE_CONCURRENCY, limit=None) -> dict:
+    """Stores a new run with its settings, a resumed run keeps them."""
+    db = db if db is not None else mongo_db.get_mongo_connection()
+    run = {
+        "_id": uuid.uuid4().hex,
+        "status": RUNNING,
+        "dry_run": dry_run,
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "limit": limit,
+        # checkpoint cursor: index in SOURCES and the last _id done there
+        "source": 0,
+        "last_id": None,
+        "processed": 0,
+        "updated": 0,
+        "changed": 0,
+        "failed": 0,
+        "elapsed_seconds": 0.0,
+        "started_at": _now(),
+        "updated_at": _now(),
+    }
+    await db[RUNS_COLLECTION].insert_one(run)
+    return run
+
+
+async def get_run(run_id: str, db=None):
+    db = db if db is not None else mongo_db.get_mongo_connection()
+    return await db[RUNS_COLLECTION].find_one({"_id": run_id})
+
+
+def prior_risk(state: dict):
+    """
+    'high' if the user's own answers or messages are worded that way, like age_ans_node flags them.
+    The stored risk_level is the previous assessment's output and can't be its own floor.
+    """
+    texts = list(state.get("age_answers") or []) + [
+        m.get("content", "") for m in state.get("conversation_history") or [] if m.get("role") == "user"
+    ]
+    return "high" if any(risk_flag(text) == "high" for text in texts) else None
+
+
+@traced("assessment", kind="rescore")
+async def evaluate(states, screenings, concurrency):
+    """Assessment replies for a batch of states, an exception in place of a call that failed."""
+    prompts = [agent_chatbot.assessment_prompt(state, screening) for state, screening in zip(states, screenings)]
+    return await agent_chatbot.llm.abatch(prompts, max_concurrency=concurrency, return_exceptions=True)
+
+
+async def rescore_batch(collection, prefix, docs, run):
+    """Re-scores one batch and writes the new fields back with a single bulk_write."""
+    states = [doc.get(prefix) or {} for doc in docs]
+    # screened like assessment_node does, so a re-score can't go below the classifier's risk floor
+    screenings = classify_many([first_user_message(state) for state in states])
+    replies = await evaluate(states, screenings, run["concurrency"])
+    requests = []
+    for doc, state, screening, reply in zip(docs, states, screenings, replies):
+        run["processed"] += 1
+        if isinstance(reply, Exception):
+            logger.warning(f"Re-scoring {collection.name} {doc['_id']} failed: {reply}")
+            run["failed"] += 1
+            continue
+        result, parsed = parse_structured(reply.content, AssessmentResult)
+        if not parsed:
+            # defaults would overwrite a real score, leave the session as it is
+            run["failed"] += 1
+            continue
+        labels = agent_chatbot.llm_labels(result, screening)
+        agent_chatbot.apply_screening(result, screening, prior_risk(state))
+        fields = {**agent_chatbot.assessment_fields(result), **labels}
+        if any(state.get(field) != fields[field] for field in COMPARED_FIELDS):
+            run["changed"] += 1
+        requests.append(UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {
+                **{f"{prefix}.{field}": value for field, value in fields.items()},
+                "rescored": {
+                    "run_id": run["_id"],
+                    "at": _now(),
+                    "previous": {field: state.get(field) for field in fields},
+                },
+            }},
+        ))
+    # a dry run counts what it would have written
+    if requests and not run["dry_run"]:
+        await collection.bulk_write(requests, ordered=False)
+    run["updated"] += len(requests)
+
+
+async def rescore_assessments(run_id: str, db=None, progress=None) -> dict:
+    """
+    Re-evaluates every completed assessment of the run's sources, batch by batch in _id order.
+
+    The run's cursor is saved after each batch, so calling this again with the same
+    run id continues where an interrupted run stopped. `progress` is called with the
+    report after every batch. Returns the final report.
+    """
+    db = db if db is not None else mongo_db.get_mongo_connection()
+    runs = db[RUNS_COLLECTION]
+    run = await runs.find_one({"_id": run_id})
+    if run is None:
+        raise ValueError(f"No rescore run {run_id}")
+    if run["status"] == FINISHED:
+        return report(run)
+
+    started = time.perf_counter()
+    elapsed_before = run["elapsed_seconds"]
+
+    async def save(**fields):
+        run.update(fields, elapsed_seconds=elapsed_before + time.perf_counter() - started, updated_at=_now())
+        await runs.update_one({"_id": run_id}, {"$set": {k: v for k, v in run.items() if k != "_id"}})
+
+    await save(status=RUNNING, error=None)
+    try:
+        while run["source"] < len(SOURCES):
+            remaining = run["limit"] - run["processed"] if run["limit"] else run["batch_size"]
+            if remaining <= 0:
+                break
+            name, prefix = SOURCES[run["source"]]
+            query = {f"{prefix}.age_assessment_complete": True, f"{prefix}.age_answers.0": {"$exists": True}}
+            if run["last_id"] is not None:
+                query["_id"] = {"$gt": run["last_id"]}
+            size = min(run["batch_size"], remaining)
+            docs = await db[name].find(query, _projection(prefix)).sort("_id", ASCENDING).limit(size).to_list(size)
+            if not docs:
+                await save(source=run["source"] + 1, last_id=None)
+                continue
+            await rescore_batch(db[name], prefix, docs, run)
+            await save(last_id=docs[-1]["_id"])
+            if progress:
+                progress(report(run))
+        await save(status=FINISHED, finished_at=_now())
+    except Exception as e:
+        await save(status=FAILED, error=str(e))
+        raise
+    return report(run)
+
+
+async def main(args):
+    await mongo_db.connect_to_mongo()
+    try:
+        if args.resume:
+            run_id = args.resume
+        else:
+            run_id = (await create_run(
+                dry_run=args.dry_run, batch_size=args.batch_size, concurrency=args.concurrency, limit=args.limit
+            ))["_id"]
+        print(f"Rescore run {run_id}")
+        result = await rescore_assessments(run_id, progress=lambda r: print(
+            f"{r['processed']} processed, {r['updated']} updated, {r['changed']} changed, "
+            f"{r['failed']} failed, {r['sessions_per_sec']} sessions/s"
+        ))
+        print(result)
+    finally:
+        await usage_recorder.flush()
+        await mongo_db.close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="evaluate and report without writing")
+    parser.add_argument("--batch-size", type=int, default=RESCORE_BATCH_SIZE, help="sessions read and written at once")
+    parser.add_argument("--concurrency", type=int, default=RESCORE_CONCURRENCY, help="LLM calls in flight")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many sessions")
+    parser.add_argument("--resume", metavar="RUN_ID", help="continue an interrupted run with its settings")
+    asyncio.run(main(parser.parse_args()))
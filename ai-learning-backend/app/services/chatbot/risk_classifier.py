@@ -0,0 +1,276 @@
+"""
+Local concern and risk screening of a user's message, before the assessment LLM call.
+
+A keyword lexicon and a TF-IDF logistic model (NumPy only) score the message against
+the assessment's concern labels. Clear-cut messages are labelled here, ambiguous ones
+are left to the LLM. High-risk language is flagged from a fixed pattern list, the model
+never decides that on its own.
+
+Training on the labels the LLM gave stored sessions (from ai-learning-backend/), --export
+also keeps them for benchmarks/bench_risk_classifier.py:
+    python -m app.services.chatbot.risk_classifier
+    python -m app.services.chatbot.risk_classifier --export benchmarks/results/concern_labels.jsonl
+"""
+import os
+import re
+import json
+import asyncio
+import logging
+import argparse
+from dataclasses import dataclass
+import numpy as np
+import dotenv
+
+dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+RISK_MODEL_PATH = os.getenv("RISK_MODEL_PATH", os.path.join(os.path.dirname(__file__), "risk_model.npz"))
+# top concern probability from which the local label is used without asking the LLM
+CLASSIFIER_THRESHOLD = float(os.getenv("RISK_CLASSIFIER_THRESHOLD", "0.7"))
+# logit added per lexicon hit, two hits of the same concern make a clear-cut message
+LEXICON_WEIGHT = 2.5
+
+CONCERNS = ["anxiety", "depression", "stress", "trauma", "relationships", "academic", "family", "general"]
+LEXICON = {
+    "anxiety": ["anxious", "anxiety", "panic", "nervous", "worried", "worry", "scared", "afraid", "fear",
+                "overthinking", "restless"],
+    "depression": ["depressed", "depression", "sad", "hopeless", "empty", "numb", "worthless", "crying",
+                   "no energy", "no motivation", "don't enjoy"],
+    "stress": ["stress", "stressed", "stressful", "overwhelmed", "pressure", "burnout", "burned out",
+               "exhausted", "too much"],
+    "trauma": ["trauma", "traumatic", "abuse", "abused", "assault", "assaulted", "flashback", "flashbacks",
+               "nightmares", "attacked", "accident"],
+    "relationships": ["friend", "friends", "boyfriend", "girlfriend", "breakup", "broke up", "lonely",
+                      "bullied", "bully", "mean to me", "call me names", "relationship", "relationships"],
+    "academic": ["school", "exam", "exams", "grades", "homework", "teacher", "class", "study", "studying",
+                 "college", "test", "career"],
+    "family": ["parents", "mom", "dad", "mother", "father", "brother", "sister", "family", "divorce",
+               "at home"],
+}
+# language that always marks a high-risk session, whatever the concern
+HIGH_RISK_PATTERNS = [re.compile(p) for p in (
+    r"\bkill(ing)? myself\b",
+    r"\bsuicid",
+    r"\bend (it all|my life)\b",
+    r"\bwant(ed)? to die\b",
+    r"\bdon'?t want to (live|be alive|exist|wake up)\b",
+    r"\bself[- ]?harm",
+    r"\b(hurt|hurting|cut|cutting) myself\b",
+    r"\bno reason to live\b",
+    r"\bbetter off (dead|without me)\b",
+    r"\boverdose\b",
+)]
+MEDIUM_RISK_WORDS = ["can't cope", "cant cope", "can't take it", "hopeless", "worthless", "give up",
+                     "nobody cares", "can't sleep", "panic attack", "falling apart"]
+
+_TOKEN = re.compile(r"[a-z']+")
+
+
+def _normalize(text: str) -> str:
+    return " ".join(_TOKEN.findall(text.lower().replace("’", "'")))
+
+
+def tokenize(text: str) -> list:
+    """Unigrams and bigrams of the lowercased words."""
+    words = _normalize(text).split()
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def lexicon_scores(text: str) -> np.ndarray:
+    """Lexicon hits per concern, in CONCERNS order."""
+    padded = f" {_normalize(text)} "
+    return np.array(
+        [sum(padded.count(f" {word} ") for word in LEXICON.get(concern, ())) for concern in CONCERNS],
+        dtype=np.float32,
+    )
+
+
+def risk_flag(text: str):
+    """'high' or 'medium' from the message's wording, None if it doesn't say."""
+    lowered = text.lower().replace("’", "'")
+    if any(p.search(lowered) for p in HIGH_RISK_PATTERNS):
+        return "high"
+    if any(word in lowered for word in MEDIUM_RISK_WORDS):
+        return "medium"
+    return None
+
+
+class ConcernModel:
+    """Multinomial logistic regression over L2-normalised TF-IDF features, trained with NumPy."""
+
+    def __init__(self, vocabulary=None, idf=None, weights=None, bias=None):
+        self.vocabulary = vocabulary or {}
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+
+    def transform(self, texts) -> np.ndarray:
+        X = np.zeros((len(texts), len(self.vocabulary)), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                column = self.vocabulary.get(token)
+                if column is not None:
+                    X[row, column] += 1.0
+        X *= self.idf
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        return X / np.where(norms == 0, 1.0, norms)
+
+    def fit(self, texts, labels, max_features=5000, min_df=2, epochs=300, lr=1.0, l2=1e-3):
+        documents = [set(tokenize(text)) for text in texts]
+        df = {}
+        for tokens in documents:
+            for token in tokens:
+                df[token] = df.get(token, 0) + 1
+        kept = sorted((t for t, n in df.items() if n >= min_df), key=lambda t: (-df[t], t))[:max_features]
+        self.vocabulary = {token: i for i, token in enumerate(kept)}
+        counts = np.array([df[t] for t in kept], dtype=np.float32)
+        self.idf = (np.log((1 + len(texts)) / (1 + counts)) + 1).astype(np.float32)
+
+        X = self.transform(texts)
+        Y = np.zeros((len(texts), len(CONCERNS)), dtype=np.float32)
+        Y[np.arange(len(texts)), [CONCERNS.index(label) for label in labels]] = 1.0
+        self.weights = np.zeros((X.shape[1], len(CONCERNS)), dtype=np.float32)
+        self.bias = np.zeros(len(CONCERNS), dtype=np.float32)
+        # full-batch gradient descent, the training sets are a few thousand messages at most
+        for _ in range(epochs):
+            gradient = (_softmax(X @ self.weights + self.bias) - Y) / len(texts)
+            self.weights -= lr * (X.T @ gradient + l2 * self.weights)
+            self.bias -= lr * gradient.sum(axis=0)
+        return self
+
+    def logits(self, texts) -> np.ndarray:
+        return self.transform(texts) @ self.weights + self.bias
+
+    def save(self, path):
+        np.savez_compressed(
+            path, vocabulary=np.array(list(self.vocabulary)), idf=self.idf, weights=self.weights,
+            bias=self.bias, concerns=np.array(CONCERNS),
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        if list(data["concerns"]) != CONCERNS:
+            raise ValueError("model was trained on a different concern label set")
+        vocabulary = {str(token): i for i, token in enumerate(data["vocabulary"])}
+        return cls(vocabulary, data["idf"], data["weights"], data["bias"])
+
+
+def _softmax(z: np.ndarray) -> np.ndarray:
+    z = z - z.max(axis=-1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+@dataclass
+class Screening:
+    concern: str
+    confidence: float
+    # clear-cut: the concern can be used without asking the LLM
+    clear: bool = False
+    # from the message's wording, None when the LLM should decide
+    risk: str = None
+
+    @property
+    def high_risk(self) -> bool:
+        return self.risk == "high"
+
+
+_model = None
+_model_loaded = False
+
+
+def get_model():
+    """Trained model from RISK_MODEL_PATH, None until one was trained (the lexicon works alone)."""
+    global _model, _model_loaded
+    if not _model_loaded:
+        _model_loaded = True
+        if os.path.exists(RISK_MODEL_PATH):
+            try:
+                _model = ConcernModel.load(RISK_MODEL_PATH)
+            except Exception as e:
+                logger.warning(f"Could not load concern model {RISK_MODEL_PATH}: {e}")
+    return _model
+
+
+def classify_many(texts, model=None, threshold=None) -> list:
+    """Screens a list of messages in one vectorised pass, model=False scores with the lexicon only."""
+    if not texts:
+        return []
+    if model is None:
+        model = get_model()
+    threshold = CLASSIFIER_THRESHOLD if threshold is None else threshold
+    logits = np.stack([lexicon_scores(text) for text in texts]) * LEXICON_WEIGHT
+    if model:
+        logits = logits + model.logits(texts)
+    probabilities = _softmax(logits)
+    results = []
+    for text, p in zip(texts, probabilities):
+        best = int(p.argmax())
+        concern, confidence = CONCERNS[best], float(p[best])
+        results.append(Screening(concern, confidence, confidence >= threshold, risk_flag(text)))
+    return results
+
+
+def classify(text: str) -> Screening:
+    return classify_many([text or ""])[0]
+
+
+def first_user_message(state: dict) -> str:
+    return state.get("first_user_message") or next(
+        (m.get("content", "") for m in state.get("conversation_history") or [] if m.get("role") == "user"), ""
+    )
+
+
+async def load_labelled_sessions(db, limit=None) -> list:
+    """
+    (first message, concern, risk) of stored sessions, as the assessment LLM labelled them.
+
+    Only the LLM's own labels are read, the stored primary_concern and risk_level already carry
+    the classifier's override and floor and would train it on its own output. Sessions assessed
+    before the labels were kept are skipped, a risk the LLM wasn't asked for is None.
+    """
+    cursor = db["chat_checkpoints"].find(
+        {"values.mental_assessment_complete": True, "values.llm_primary_concern": {"$in": CONCERNS}},
+        {"values.first_user_message": 1, "values.conversation_history": {"$slice": 5},
+         "values.llm_primary_concern": 1, "values.llm_risk_level": 1},
+    )
+    if limit:
+        cursor = cursor.limit(limit)
+    rows = []
+    async for doc in cursor:
+        values = doc.get("values") or {}
+        text = first_user_message(values)
+        if text:
+            rows.append({"text": text, "concern": values["llm_primary_concern"], "risk": values.get("llm_risk_level")})
+    return rows
+
+
+async def main(args):
+    from app import mongo_db
+
+    await mongo_db.connect_to_mongo()
+    try:
+        rows = await load_labelled_sessions(mongo_db.get_mongo_connection(), args.limit)
+    finally:
+        await mongo_db.close_mongo_connection()
+    print(f"{len(rows)} labelled sessions")
+    if args.export:
+        with open(args.export, "w") as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+    if len(rows) < args.min_samples:
+        print(f"Need at least {args.min_samples} sessions to train, keeping the current model")
+        return
+    model = ConcernModel().fit([r["text"] for r in rows], [r["concern"] for r in rows])
+    model.save(args.output)
+    print(f"Saved {len(model.vocabulary)} features to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=RISK_MODEL_PATH, help="where to save the trained model")
+    parser.add_argument("--export", help="also write the labelled messages to this JSONL file")
+    parser.add_argument("--limit", type=int, default=None, help="read at most this many sessions")
+    parser.add_argument("--min-samples", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,338 @@
+import re
+import json
+import logging
+from typing import ClassVar, List, Literal, Optional
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+from app.services.telemetry import current_operation, structured_parses
+from app.services.token_budget import trim_text
+
+logger = logging.getLogger(__name__)
+
+AGE_CATEGORIES = ("child", "teen", "young_adult", "adult")
+CONCERNS = ("anxiety", "depression", "stress", "trauma", "relationships", "academic", "family", "general")
+RISK_LEVELS = ("low", "medium", "high")
+
+
+def _first_number(value):
+    if isinstance(value, (int, float)):
+        return value
+    match = re.search(r"-?\d+(\.\d+)?", str(value))
+    return float(match.group()) if match else value
+
+
+def _clamp(value, low, high):
+    value = _first_number(value)
+    if isinstance(value, (int, float)):
+        return int(round(min(high, max(low, value))))
+    return value
+
+
+class AssessmentResult(BaseModel):
+    """Combined intellectual age and mental state assessment returned by the assessment node."""
+
+    model_config = ConfigDict(json_schema_extra={"example": {
+        "estimated_age": 14, "confidence": 7, "category": "teen",
+        "indicators": ["reasoning", "emotional maturity", "decision patterns"],
+        "urgency_score": 4, "primary_concern": "stress", "emotional_state": "worried but coping",
+        "risk_level": "low", "needs_immediate_help": False,
+    }})
+    # labels of the older line-based format
+    aliases: ClassVar[dict] = {"urgency": "urgency_score", "concern": "primary_concern", "risk": "risk_level",
+               "age": "estimated_age", "age_category": "category"}
+
+    estimated_age: int = 15
+    confidence: int = 5
+    category: Literal["child", "teen", "young_adult", "adult"] = "teen"
+    indicators: List[str] = Field(default_factory=list)
+    urgency_score: int = 5
+    primary_concern: Literal[
+        "anxiety", "depression", "stress", "trauma", "relationships", "academic", "family", "general"
+    ] = "general"
+    emotional_state: str = ""
+    # an unreadable risk level is treated as medium rather than low
+    risk_level: Literal["low", "medium", "high"] = "medium"
+    needs_immediate_help: bool = False
+
+    @field_validator("estimated_age", mode="before")
+    @classmethod
+    def _age(cls, v):
+        return _clamp(v, 4, 99)
+
+    @field_validator("confidence", mode="before")
+    @classmethod
+    def _confidence(cls, v):
+        return _clamp(v, 0, 10)
+
+    @field_validator("urgency_score", mode="before")
+    @classmethod
+    def _urgency(cls, v):
+        return _clamp(v, 1, 10)
+
+    @field_validator("category", mode="before")
+    @classmethod
+    def _category(cls, v):
+        v = str(v).strip().lower().replace(" ", "_").replace("-", "_")
+        for category in AGE_CATEGORIES:
+            if category in v:
+                # "young_adult" contains "adult", so it is checked first
+                return "young_adult" if "young" in v else category
+        return v
+
+    @field_validator("primary_concern", mode="before")
+    @classmethod
+    def _concern(cls, v):
+        v = str(v).strip().lower()
+        return next((c for c in CONCERNS if c in v), "general")
+
+    @field_validator("risk_level", mode="before")
+    @classmethod
+    def _risk(cls, v):
+        v = str(v).strip().lower()
+        return next((r for r in RISK_LEVELS if r in v), v)
+
+    @field_validator("indicators", mode="before")
+    @classmethod
+    def _indicators(cls, v):
+        if isinstance(v, str):
+            return [part.strip(" -•") for part in re.split(r"\n|;", v) if part.strip(" -•")]
+        return [str(item) for item in v] if isinstance(v, list) else v
+
+    @field_validator("needs_immediate_help", mode="before")
+    @classmethod
+    def _help(cls, v):
+        if isinstance(v, str):
+            return v.strip().lower().startswith(("y", "true"))
+        return v
+
+
+def _clean_question(v):
+    v = re.sub(r"^\s*question\s*\d*\s*[:.)-]\s*", "", str(v), flags=re.IGNORECASE)
+    v = v.strip().strip('"').strip()
+    if not v:
+        raise ValueError("empty question")
+    return v
+
+
+class AgeQuestion(BaseModel):
+    """Next age-assessment question, asked for in the "QUESTION: <question>" format."""
+
+    model_config = ConfigDict(json_schema_extra={"example": {"question": "What would you do if a friend broke a promise?"}})
+
+    question: str = ""
+
+    @field_validator("question", mode="before")
+    @classmethod
+    def _question(cls, v):
+        return _clean_question(v)
+
+    @classmethod
+    def from_text(cls, text: str):
+        """Replies that are just the question, without the label."""
+        lines = [line.strip() for line in text.splitlines() if line.strip().endswith("?")]
+        return {"question": lines[-1]} if lines else None
+
+
+class BankQuestion(BaseModel):
+    dimension: str
+    level: str = "basic"
+    question: str
+
+    @field_validator("question", mode="before")
+    @classmethod
+    def _question(cls, v):
+        return _clean_question(v)
+
+    @field_validator("level", mode="before")
+    @classmethod
+    def _level(cls, v):
+        v = str(v).strip().lower()
+        return "advanced" if "adv" in v else "basic"
+
+
+class QuestionBank(BaseModel):
+    """Age-assessment question bank, two questions per dimension."""
+
+    model_config = ConfigDict(json_schema_extra={"example": {"questions": [
+        {"dimension": "impulse control", "level": "basic", "question": "What do you do when you really want something right away?"},
+        {"dimension": "impulse control", "level": "advanced", "question": "Tell me about a time you chose to wait for something better."},
+    ]}})
+
+    questions: List[BankQuestion] = Field(default_factory=list)
+
+    @field_validator("questions", mode="before")
+    @classmethod
+    def _questions(cls, v):
+        # one broken item doesn't cost the whole bank
+        if not isinstance(v, list):
+            raise ValueError("questions must be a list")
+        items = [q for q in v if isinstance(q, dict) and q.get("question") and q.get("dimension")]
+        if not items:
+            raise ValueError("no usable questions")
+        return items
+
+
+def strip_fences(text: str) -> str:
+    match = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+    return match.group(1) if match else text
+
+
+def close_json(text: str) -> str:
+    """Closes a reply cut off mid-object (e.g. at max_tokens): open string, dangling key, open brackets."""
+    closers, in_string, escaped = [], False, False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+        elif ch in "}]" and closers:
+            closers.pop()
+    if in_string:
+        text += '"'
+    text = re.sub(r"[,:]\s*$", "", text.rstrip())
+    if closers and closers[-1] == "}":
+        # a key whose value never came
+        text = re.sub(r'([{,])\s*"[^"]*"\s*$', lambda m: "{" if m.group(1) == "{" else "", text)
+    return text + "".join(reversed(closers))
+
+
+def repair_json(text: str) -> str:
+    """Fixes the usual ways LLMs break JSON: prose around it, trailing commas, Python literals, unclosed braces."""
+    start = text.find("{")
+    if start == -1:
+        return text
+    text = text[start:]
+    end = text.rfind("}")
+    if end != -1 and text.count("{") == text.count("}"):
+        text = text[:end + 1]
+    text = re.sub(r",\s*([}\]])", r"\1", text)
+    text = re.sub(r"\bTrue\b", "true", re.sub(r"\bFalse\b", "false", re.sub(r"\bNone\b", "null", text)))
+    return close_json(text)
+
+
+def _key_value_lines(text: str) -> dict:
+    """Last resort for replies in 'Key Name: value' lines instead of JSON."""
+    data = {}
+    for line in text.splitlines():
+        if ":" not in line:
+            continue
+        key, value = line.split(":", 1)
+        key = re.sub(r"^[\s\d.\-*#]+", "", key).strip().lower().replace(" ", "_")
+        if key and value.strip():
+            data[key] = value.strip().strip('",')
+    return data
+
+
+def _extract(text: str, model_cls=None):
+    """(dict, repaired) out of an LLM reply, (None, True) if nothing usable was found."""
+    text = strip_fences(text or "")
+    for i, candidate in enumerate((text, repair_json(text), repair_json(text).replace("'", '"'))):
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data, i > 0
+    # "Label: value" lines are what some prompts ask for, not a repair;
+    # lines none of whose labels the model knows (e.g. "Note: ...") are just prose
+    data = _key_value_lines(text)
+    known = set(getattr(model_cls, "model_fields", {})) | set(getattr(model_cls, "aliases", {}))
+    if data and (model_cls is None or known & data.keys()):
+        return data, False
+    if hasattr(model_cls, "from_text"):
+        return model_cls.from_text(text), True
+    return None, True
+
+
+def extract_json(text: str) -> Optional[dict]:
+    """Best effort dict out of an LLM reply, None if nothing usable was found."""
+    return _extract(text)[0]
+
+
+def coerce_model(model_cls, data: dict):
+    """
+    Validates data against the schema, dropping fields that can't be fixed so their defaults are used.
+    Returns (result, fields kept from data).
+    """
+    data = {k: v for k, v in (data or {}).items() if k in model_cls.model_fields}
+    while True:
+        try:
+            return model_cls.model_validate(data), set(data)
+        except ValidationError as e:
+            bad = {err["loc"][0] for err in e.errors() if err["loc"]}
+            if not bad & data.keys():
+                return model_cls(), set()
+            for key in bad:
+                data.pop(key, None)
+
+
+def _parse(text: str, model_cls):
+    """(result, outcome), outcome is "ok", "repaired" or "failed"."""
+    data, repaired = _extract(text, model_cls)
+    if data is None:
+        return model_cls(), "failed"
+    for alias, field in getattr(model_cls, "aliases", {}).items():
+        if alias in data and field not in data:
+            data[field] = data.pop(alias)
+    result, kept = coerce_model(model_cls, data)
+    if not kept:
+        return model_cls(), "failed"
+    return result, "repaired" if repaired or kept != data.keys() & model_cls.model_fields.keys() else "ok"
+
+
+def _record(outcome, text):
+    operation = current_operation.get()
+    structured_parses.inc(operation=operation, outcome=outcome)
+    if outcome == "failed":
+        logger.warning(f"Unreadable {operation} reply: {(text or '')[:200]!r}")
+
+
+def parse_structured(text: str, model_cls):
+    """Parses an LLM reply into model_cls without raising, returns (result, parsed_ok)."""
+    result, outcome = _parse(text, model_cls)
+    _record(outcome, text)
+    return result, outcome != "failed"
+
+
+REASK_PROMPT = """{prompt}
+
+Your previous reply to this could not be read:
+{reply}
+
+Reply again with ONLY a JSON object in exactly this format (the values are an example), no other text:
+{example}
+"""
+
+
+def reask_prompt(prompt: str, reply: str, model_cls) -> str:
+    example = (model_cls.model_config.get("json_schema_extra") or {}).get("example") or model_cls().model_dump()
+    return REASK_PROMPT.format(
+        prompt=prompt.strip(), reply=trim_text(reply or "(empty)", 200), example=json.dumps(example, indent=2)
+    )
+
+
+async def ainvoke_structured(invoke, prompt, model_cls):
+    """
+    Calls the LLM and parses its reply into model_cls, returns (result, parsed_ok).
+
+    Replies are repaired locally first. Only if nothing can be read is the model
+    asked once more, with its reply and the expected format; after that the
+    schema defaults are returned.
+    """
+    response = await invoke(prompt)
+    result, outcome = _parse(response.content, model_cls)
+    if outcome == "failed":
+        retry = await invoke(reask_prompt(prompt, response.content, model_cls))
+        result, outcome = _parse(retry.content, model_cls)
+        if outcome != "failed":
+            outcome = "reasked"
+        response = retry
+    _record(outcome, response.content)
+    return result, outcome != "failed"
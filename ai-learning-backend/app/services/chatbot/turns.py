@@ -0,0 +1,81 @@
+import asyncio
+
+
+class TurnCoordinator:
+    """
+    Runs one chat turn at a time per user, in arrival order.
+
+    A turn identical to one that is still queued or running (a double-tapped send)
+    doesn't run again, it waits for the first one and gets the same result. This only
+    covers the current worker, the version field on chat_sessions catches the rest.
+    """
+
+    def __init__(self):
+        # user_id -> [lock, requests holding or waiting for it]
+        self.locks = {}
+        # (user_id, message) -> future of the turn being run for it
+        self.inflight = {}
+        self.stats = {"turns": 0, "coalesced": 0, "queued": 0}
+
+    async def acquire(self, user_id):
+        entry = self.locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        if entry[0].locked():
+            self.stats["queued"] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._drop(user_id)
+            raise
+
+    def release(self, user_id):
+        self.locks[user_id][0].release()
+        self._drop(user_id)
+
+    def _drop(self, user_id):
+        entry = self.locks[user_id]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.locks[user_id]
+
+    async def run(self, user_id, message, turn):
+        """Awaits turn() under the user's lock, or the result of an identical turn already in flight."""
+        key = (user_id, " ".join(message.split()))
+        while key in self.inflight:
+            shared = self.inflight[key]
+            self.stats["coalesced"] += 1
+            await asyncio.wait({shared})
+            # a cancelled turn (client went away) has no result to share, run our own
+            if not shared.cancelled():
+                return shared.result()
+
+        future = asyncio.get_running_loop().create_future()
+        # mark the outcome as retrieved, there may be nobody else waiting for it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.inflight[key] = future
+        try:
+            await self.acquire(user_id)
+            try:
+                self.stats["turns"] += 1
+                result = await turn()
+            finally:
+                self.release(user_id)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+
+turn_coordinator = TurnCoordinator()
+
+
+def get_turn_stats():
+    return dict(turn_coordinator.stats)
@@ -0,0 +1,343 @@
+import os
+import hmac
+import uuid
+import asyncio
+import hashlib
+import secrets
+import logging
+import itertools
+from collections import deque
+from datetime import datetime, timedelta, timezone
+import dotenv
+from pymongo import ASCENDING, ReturnDocument
+
+from app.services.telemetry import current_endpoint
+from app.services.chatbot.rate_limiter import current_llm_user
+
+dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+# "memory" runs jobs in this process, "mongo" shares one queue between uvicorn workers
+JOB_BACKEND = os.getenv("JOB_BACKEND", "memory")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+# a running Mongo job whose worker stopped renewing it is picked up again after this,
+# workers renew the lease of the job they run every third of it
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_POLL_SECONDS = 0.5
+
+# lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 5
+PRIORITY_BULK = 10
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+# kind -> async handler(payload) returning a JSON-able result
+HANDLERS = {}
+
+
+class QueueFull(Exception):
+    pass
+
+
+class LeaseLost(Exception):
+    """Another worker took over the job, this one stops running it."""
+
+
+def register_job(kind: str):
+    """Registers the coroutine that runs jobs of this kind."""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def new_job_token() -> str:
+    """Secret that lets its holder read one job without logging in, e.g. right after registering."""
+    return secrets.token_urlsafe(24)
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def token_matches(job: dict, token) -> bool:
+    return bool(token and job.get("token_hash")) and hmac.compare_digest(job["token_hash"], _token_hash(token))
+
+
+def public_view(job: dict) -> dict:
+    """What GET /jobs/{id} shows, the payload stays private."""
+    return {k: job.get(k) for k in ("id", "kind", "status", "priority", "created_at", "started_at",
+                                    "finished_at", "result", "error")}
+
+
+class MemoryJobBackend:
+    """Jobs and their priority queue in process memory."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.queue = None
+        self.counter = itertools.count()
+        # (expires_at, job_id) in finishing order, which is expiry order as every result has the same TTL
+        self.finished = deque()
+
+    def _queue(self):
+        # created lazily so it binds to the running event loop
+        if self.queue is None:
+            self.queue = asyncio.PriorityQueue()
+        return self.queue
+
+    async def queued_count(self):
+        return self._queue().qsize()
+
+    async def put(self, job):
+        self._expire()
+        self.jobs[job["id"]] = job
+        await self._queue().put((job["priority"], next(self.counter), job["id"]))
+
+    async def claim(self, worker_id):
+        _, _, job_id = await self._queue().get()
+        self._expire()
+        job = self.jobs[job_id]
+        job.update(status=RUNNING, started_at=_now(), worker=worker_id)
+        return job
+
+    async def get(self, job_id):
+        self._expire()
+        return self.jobs.get(job_id)
+
+    async def renew(self, job_id, worker_id) -> bool:
+        # nothing else can take a job from this process
+        return True
+
+    async def finish(self, job_id, status, result=None, error=None, worker_id=None) -> bool:
+        job = self.jobs[job_id]
+        if worker_id is not None and job.get("worker") != worker_id:
+            return False
+        job.update(status=status, result=result, error=error, finished_at=_now(),
+                   expires_at=_now() + timedelta(seconds=JOB_RESULT_TTL))
+        job.pop("payload", None)
+        self.finished.append((job["expires_at"], job_id))
+        self._expire()
+        return True
+
+    def _expire(self):
+        """Drops the results nobody fetched in time, also runs as jobs come and go so unpolled ones go too."""
+        now = _now()
+        while self.finished and self.finished[0][0] < now:
+            self.jobs.pop(self.finished.popleft()[1], None)
+
+
+class MongoJobBackend:
+    """Queue in the jobs collection, workers claim jobs with an atomic find_one_and_update."""
+
+    def __init__(self, collection_name="jobs"):
+        self.collection_name = collection_name
+        self._indexed = False
+
+    async def _collection(self):
+        from app.mongo_db import get_mongo_connection
+
+        collection = get_mongo_connection()[self.collection_name]
+        if not self._indexed:
+            await collection.create_index([("status", ASCENDING), ("priority", ASCENDING), ("created_at", ASCENDING)])
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+        return collection
+
+    async def queued_count(self):
+        return await (await self._collection()).count_documents({"status": QUEUED})
+
+    async def put(self, job):
+        await (await self._collection()).insert_one({**job, "_id": job["id"]})
+
+    async def claim(self, worker_id):
+        collection = await self._collection()
+        while True:
+            now = _now()
+            job = await collection.find_one_and_update(
+                {"$or": [
+                    {"status": QUEUED},
+                    # the worker that had it died without finishing
+                    {"status": RUNNING, "lease_until": {"$lt": now}},
+                ]},
+                {"$set": {"status": RUNNING, "started_at": now, "worker": worker_id,
+                          "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS)}},
+                sort=[("priority", ASCENDING), ("created_at", ASCENDING)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if job:
+                return job
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+    async def get(self, job_id):
+        return await (await self._collection()).find_one({"_id": job_id})
+
+    async def renew(self, job_id, worker_id) -> bool:
+        """Extends the lease, False once another worker has claimed the job."""
+        result = await (await self._collection()).update_one(
+            {"_id": job_id, "status": RUNNING, "worker": worker_id},
+            {"$set": {"lease_until": _now() + timedelta(seconds=JOB_LEASE_SECONDS)}},
+        )
+        return result.matched_count > 0
+
+    async def finish(self, job_id, status, result=None, error=None, worker_id=None) -> bool:
+        """Records the outcome, only while worker_id still holds the job when it is given."""
+        query = {"_id": job_id}
+        if worker_id is not None:
+            query.update(status=RUNNING, worker=worker_id)
+        result = await (await self._collection()).update_one(
+            query,
+            {
+                "$set": {"status": status, "result": result, "error": error, "finished_at": _now(),
+                         "expires_at": _now() + timedelta(seconds=JOB_RESULT_TTL)},
+                "$unset": {"payload": "", "lease_until": ""},
+            },
+        )
+        return result.matched_count > 0
+
+
+class JobQueue:
+    """Bounded pool of worker tasks running registered handlers off the request path."""
+
+    def __init__(self, backend, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, lease_seconds=JOB_LEASE_SECONDS):
+        self.backend = backend
+        self.workers = workers
+        self.max_queued = max_queued
+        self.lease_seconds = lease_seconds
+        self.tasks = []
+        # job id -> event set when this process finishes the job, saves polling for local waiters
+        self.finished = {}
+        self.stats = {"submitted": 0, "succeeded": 0, "failed": 0, "rejected": 0, "leases_lost": 0,
+                      "finish_errors": 0}
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._work(f"{os.getpid()}-{i}")) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def submit(self, kind, payload, priority=PRIORITY_NORMAL, owner=None, token=None) -> str:
+        """
+        Queues a job and returns its id, raises QueueFull when the backlog is at its limit.
+        A job with an owner is only shown to them, or to whoever presents `token` (see new_job_token).
+        """
+        if kind not in HANDLERS:
+            raise ValueError(f"No handler registered for job kind {kind}")
+        if await self.backend.queued_count() >= self.max_queued:
+            self.stats["rejected"] += 1
+            raise QueueFull(f"{self.max_queued} jobs already queued")
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": QUEUED,
+            "priority": priority,
+            "owner": str(owner) if owner is not None else None,
+            # only the hash is stored, like a password
+            "token_hash": _token_hash(token) if token else None,
+            "payload": payload,
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        await self.backend.put(job)
+        self.stats["submitted"] += 1
+        return job["id"]
+
+    async def get(self, job_id):
+        return await self.backend.get(job_id)
+
+    async def wait(self, job_id, timeout):
+        """Returns once the job may have changed, at the latest after timeout seconds."""
+        event = self.finished.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            # the job may be running in another worker process, the caller reads it again
+            if self.finished.get(job_id) is event:
+                del self.finished[job_id]
+
+    async def _keep_lease(self, job_id, worker_id):
+        """Renews the job's lease while it runs, returns once another worker has taken it over."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if not await self.backend.renew(job_id, worker_id):
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # a missed renewal is fine, the lease still has two thirds left
+                logger.warning(f"Could not renew the lease of job {job_id}: {e}")
+
+    async def _run(self, job, worker_id):
+        """Runs the handler under a renewed lease, LeaseLost if the job was claimed again meanwhile."""
+        handler = asyncio.create_task(HANDLERS[job["kind"]](job["payload"]))
+        heartbeat = asyncio.create_task(self._keep_lease(job["id"], worker_id))
+        try:
+            await asyncio.wait({handler, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+            lost = not handler.done()
+        finally:
+            heartbeat.cancel()
+            handler.cancel()
+            await asyncio.gather(heartbeat, handler, return_exceptions=True)
+        if lost:
+            raise LeaseLost(job["id"])
+        return handler.result()
+
+    async def _work(self, worker_id):
+        while True:
+            job = await self.backend.claim(worker_id)
+            # jobs don't inherit the request's context, charge the LLM calls to the job's owner
+            current_llm_user.set(job.get("owner"))
+            current_endpoint.set(f"job:{job['kind']}")
+            status, result, error = SUCCEEDED, None, None
+            try:
+                result = await self._run(job, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except LeaseLost:
+                logger.warning(f"Job {job['id']} ({job['kind']}) was claimed by another worker, stopped here")
+                self.stats["leases_lost"] += 1
+                continue
+            except Exception as e:
+                logger.error(f"Job {job['id']} ({job['kind']}) failed: {e}", exc_info=True)
+                status, error = FAILED, getattr(e, "detail", None) or str(e)
+            try:
+                recorded = await self.backend.finish(job["id"], status, result=result, error=error,
+                                                     worker_id=worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # the worker stays in the pool, the job is retried once its lease runs out
+                logger.error(f"Could not record the outcome of job {job['id']}: {e}")
+                self.stats["finish_errors"] += 1
+                continue
+            if not recorded:
+                self.stats["leases_lost"] += 1
+                continue
+            self.stats["succeeded" if status == SUCCEEDED else "failed"] += 1
+            event = self.finished.pop(job["id"], None)
+            if event:
+                event.set()
+
+
+job_queue = JobQueue(MongoJobBackend() if JOB_BACKEND == "mongo" else MemoryJobBackend())
+
+
+def get_job_stats():
+    return dict(job_queue.stats)
+
@@ -0,0 +1,244 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+import dotenv
+from app.services.telemetry import (
+    current_endpoint, current_operation, llm_prompt_over_budget, record_llm_call, span, token_usage
+)
+from app.services.chatbot import rate_limiter
+from app.services.chatbot.rate_limiter import current_llm_user
+from app.services.token_budget import completion_cap, count_tokens, prompt_budget, usage_recorder
+
+dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+# comma separated "provider:model" list, in order of preference
+LLM_BACKENDS = os.getenv("LLM_BACKENDS", "groq:llama-3.1-8b-instant")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+# fire a second backend when the first is slower than its p95, off by default
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+# used as the hedge budget until a backend has enough samples for a p95
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "4"))
+# consecutive failures before a backend is skipped, and for how long
+FAILURE_THRESHOLD = 3
+COOLDOWN_SECONDS = 30.0
+
+API_KEY_ENV = {
+    "groq": "GROQ_API_KEY",
+    "openai": "OPENAI_API_KEY",
+    "google": "GEMINI_API_KEY",
+}
+
+
+def build_chat_model(provider: str, model: str):
+    """LangChain chat model for a provider, retries are left to the pool and the rate limiter."""
+    if provider == "groq":
+        from langchain_groq import ChatGroq
+        return ChatGroq(model=model, temperature=0, timeout=LLM_TIMEOUT, max_retries=0)
+    if provider == "openai":
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(model=model, temperature=0, timeout=LLM_TIMEOUT, max_retries=0)
+    if provider == "google":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(
+            model=model, temperature=0, timeout=LLM_TIMEOUT, max_retries=0,
+            google_api_key=os.getenv(API_KEY_ENV["google"]),
+        )
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+
+def is_retryable(error) -> bool:
+    """429, 5xx, timeouts and connection problems move on to the next backend, anything else is a real error."""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+class Backend:
+    """One provider/model with its health and latency record."""
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self.variants = {}
+        self.latencies = deque(maxlen=200)
+        self.failures = 0
+        self.down_until = 0.0
+        self.stats = {"calls": 0, "errors": 0, "failovers": 0, "hedges": 0}
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def p95(self):
+        if len(self.latencies) < 20:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def record_success(self, seconds):
+        self.latencies.append(seconds)
+        self.failures = 0
+        self.down_until = 0.0
+
+    def record_failure(self):
+        self.stats["errors"] += 1
+        self.failures += 1
+        if self.failures >= FAILURE_THRESHOLD:
+            self.down_until = time.monotonic() + COOLDOWN_SECONDS
+
+    def configured(self, temperature=None, max_tokens=None):
+        """Copy of the model with other settings, not every provider takes them as call arguments."""
+        update = {}
+        if temperature is not None:
+            update["temperature"] = temperature
+        if max_tokens is not None:
+            # gemini calls the completion cap max_output_tokens
+            fields = getattr(type(self.model), "model_fields", {})
+            update["max_output_tokens" if "max_output_tokens" in fields else "max_tokens"] = max_tokens
+        if not update:
+            return self.model
+        key = tuple(sorted(update.items()))
+        if key not in self.variants:
+            self.variants[key] = self.model.model_copy(update=update)
+        return self.variants[key]
+
+    async def ainvoke(self, prompt, temperature=None, max_tokens=None, **kwargs):
+        self.stats["calls"] += 1
+        model = self.configured(temperature, max_tokens)
+        start = time.perf_counter()
+        try:
+            with span(f"llm {self.name}", backend=self.name):
+                response = await asyncio.wait_for(model.ainvoke(prompt, **kwargs), LLM_TIMEOUT)
+        except Exception as e:
+            self.record_failure()
+            record_llm_call(self.name, time.perf_counter() - start, error=e)
+            raise
+        self.record_success(time.perf_counter() - start)
+        record_llm_call(self.name, time.perf_counter() - start, response)
+        return response
+
+
+class LLMPool:
+    """Provider pool shared by the chatbot, quiz and homework services, used like a chat model."""
+
+    def __init__(self, backends, hedge=LLM_HEDGE, hedge_after=LLM_HEDGE_AFTER):
+        self.backends = backends
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+
+    def candidates(self):
+        """Healthy backends first, in configured order, then the ones cooling down as a last resort."""
+        return [b for b in self.backends if b.healthy] + [b for b in self.backends if not b.healthy]
+
+    async def _hedged(self, primary, secondary, prompt, **kwargs):
+        first = asyncio.ensure_future(primary.ainvoke(prompt, **kwargs))
+        done, _ = await asyncio.wait({first}, timeout=primary.p95() or self.hedge_after)
+        if done:
+            return first.result()
+        secondary.stats["hedges"] += 1
+        second = asyncio.ensure_future(secondary.ainvoke(prompt, **kwargs))
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    async def ainvoke(self, prompt, max_tokens=None, **kwargs):
+        backends = self.candidates()
+        if not backends:
+            raise RuntimeError("No LLM backend configured, check LLM_BACKENDS and the API keys.")
+        operation = current_operation.get()
+        prompt_tokens = count_tokens(prompt)
+        if prompt_tokens > prompt_budget(operation):
+            # callers trim their inputs, this catches the ones that don't
+            llm_prompt_over_budget.inc(operation=operation)
+            logger.warning(f"{operation} prompt is {prompt_tokens} tokens, budget {prompt_budget(operation)}")
+        kwargs["max_tokens"] = max_tokens or completion_cap(operation)
+        last_error = None
+        for i, backend in enumerate(backends):
+            try:
+                if self.hedge and i + 1 < len(backends):
+                    response = await self._hedged(backend, backends[i + 1], prompt, **kwargs)
+                else:
+                    response = await backend.ainvoke(prompt, **kwargs)
+                self.record_usage(operation, prompt_tokens, response)
+                return response
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+                backend.stats["failovers"] += 1
+                logger.warning(f"LLM backend {backend.name} failed ({type(e).__name__}), trying the next one")
+        raise last_error
+
+    async def abatch(self, prompts, max_concurrency=None, return_exceptions=False, **kwargs):
+        """
+        Runs the prompts concurrently like a chat model's abatch, replies come back in prompt order.
+        Every call takes its token from the shared rate limiter, so bulk work and chat turns split one quota.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or max(1, len(prompts)))
+
+        async def one(prompt):
+            async with semaphore:
+                try:
+                    return await rate_limiter.limiter.call(self.ainvoke, prompt, **kwargs)
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    return e
+
+        return await asyncio.gather(*(one(prompt) for prompt in prompts))
+
+    def record_usage(self, operation, prompt_tokens, response):
+        reported_prompt, reported_completion = token_usage(response)
+        usage_recorder.record(
+            current_llm_user.get(), current_endpoint.get(), operation,
+            reported_prompt or prompt_tokens, reported_completion or count_tokens(response.content),
+        )
+
+    def invoke(self, prompt, **kwargs):
+        """Blocking call for scripts, never use it inside the app's event loop."""
+        return asyncio.run(self.ainvoke(prompt, **kwargs))
+
+    def health(self):
+        return {
+            b.name: {
+                **b.stats,
+                "healthy": b.healthy,
+                "p95_seconds": b.p95(),
+                "consecutive_failures": b.failures,
+            }
+            for b in self.backends
+        }
+
+
+def build_pool(spec: str = LLM_BACKENDS) -> LLMPool:
+    backends = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        provider, _, model = entry.partition(":")
+        if not os.getenv(API_KEY_ENV.get(provider, "")):
+            logger.warning(f"Skipping LLM backend {entry}: {API_KEY_ENV.get(provider)} is not set")
+            continue
+        backends.append(Backend(entry, build_chat_model(provider, model)))
+    return LLMPool(backends)
+
+
+def get_llm_pool_stats():
+    from app.services.chatbot.llm import llm
+    return llm.health() if isinstance(llm, LLMPool) else {}
@@ -1,26 +1,9 @@
-import os
-import httpx
-from dotenv import load_dotenv
+from app.services.chatbot.llm import llm
+from app.services.chatbot.rate_limiter import limiter
+from app.services.telemetry import traced
 
-load_dotenv()
-
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-MODEL = os.getenv("MODEL")
-headers = {
-    "Authorization": f"Bearer {GROQ_API_KEY}",
-    "Content-Type": "application/json"
-}
 
+@traced("quiz", kind="service")
 async def generate_quiz(prompt: str):
-    payload = {
-        "model": MODEL,
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.7
-    }
-    timeout = httpx.Timeout(30.0, connect=10.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        response = await client.post(GROQ_API_URL, json=payload, headers=headers)
-        response.raise_for_status()
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
+    response = await limiter.call(llm.ainvoke, prompt, temperature=0.7)
+    return response.content
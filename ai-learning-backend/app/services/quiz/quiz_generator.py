@@ -1,6 +1,7 @@
 import json
 from app.services.quiz.prompt import build_quiz_prompt
 from app.services.quiz.groq import generate_quiz
+from app.services.token_budget import trim_text
 
 import json
 import re
@@ -66,7 +67,7 @@ def convert_quiz_to_json(quiz_text):
 
 
 async def create_quiz(mental_age: int, topic: str, time_limit:int,num_questions:int):
-    prompt = build_quiz_prompt(mental_age, topic,time_limit, num_questions)
+    prompt = build_quiz_prompt(mental_age, trim_text(topic, 60),time_limit, num_questions)
     response = await generate_quiz(prompt)
 
     response=convert_quiz_to_json(response)
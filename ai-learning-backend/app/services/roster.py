@@ -0,0 +1,321 @@
+"""
+Bulk student onboarding from class rosters.
+
+Reads a CSV roster with a header line, or NDJSON with one student object per line, as
+it arrives. Columns: name, username, email, password, and optionally grade_level,
+date_of_birth and gender. Students are hashed on the bulk process pool and written
+with insert_many a chunk at a time; the next chunk is hashed while the previous one is
+written. Rows that can't be imported (missing fields, duplicates in the roster or in
+the database) are reported by line number and the rest of the roster goes in.
+
+Usage (from ai-learning-backend/):
+    python -m app.services.roster rosters/7b.csv
+    python -m app.services.roster students.ndjson --chunk-size 500
+"""
+import os
+import csv
+import json
+import time
+import codecs
+import asyncio
+from collections import deque
+import logging
+import argparse
+from datetime import datetime, timezone
+import dotenv
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from app import mongo_db
+from app.authentication.accounts import (
+    DUPLICATE_MESSAGES, companion_documents, duplicate_field, ensure_user_indexes, find_taken, new_user_document
+)
+from app.authentication.passwords import bulk_hash_pool
+from app.model.user_model import UserCreate
+
+dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+ROSTER_CHUNK_SIZE = int(os.getenv("ROSTER_CHUNK_SIZE", "200"))
+# errors listed in the report, "failed" counts all of them
+ROSTER_MAX_ERRORS = 500
+FORMATS = ("csv", "ndjson")
+# spreadsheet headers seen in school exports
+COLUMN_ALIASES = {"full_name": "name", "student_name": "name", "grade": "grade_level", "dob": "date_of_birth"}
+# images go through the profile_image job of /auth/register, not rosters
+IGNORED_COLUMNS = ("profile_image",)
+WRITE_FAILED = "Could not be saved, import this row again"
+
+
+async def iter_lines(chunks):
+    """Text lines out of an async iterable of byte chunks, however the chunks split them."""
+    # utf-8-sig drops the byte order mark Excel puts in front of CSV exports
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+def ends_quoted(line: str, quoted=False) -> bool:
+    """Whether a CSV line ends inside a quoted field, `quoted` if it started inside one."""
+    if not quoted and '"' not in line:
+        return False
+    field_start = not quoted
+    i = 0
+    while i < len(line):
+        char = line[i]
+        if quoted:
+            if char == '"':
+                if line[i + 1:i + 2] == '"':
+                    i += 1
+                else:
+                    quoted = False
+        elif char == '"' and field_start:
+            quoted = True
+        field_start = not quoted and char == ","
+        i += 1
+    return quoted
+
+
+async def iter_records(lines):
+    """(first line number, CSV record) with the lines of a quoted multiline field joined back together."""
+    number, start, record, quoted = 0, 0, [], False
+    async for line in lines:
+        number += 1
+        if not record:
+            start = number
+        record.append(line)
+        quoted = ends_quoted(line, quoted)
+        if not quoted:
+            yield start, "\n".join(record)
+            record = []
+    if record:
+        # the file ended inside a quoted field, csv reads it up to there
+        yield start, "\n".join(record)
+
+
+async def iter_rows(lines, fmt="csv"):
+    """(line number, row dict or error message) for every non-empty record after the CSV header."""
+    if fmt == "ndjson":
+        number = 0
+        async for line in lines:
+            number += 1
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield number, f"Invalid JSON: {e.msg}"
+                continue
+            yield number, row if isinstance(row, dict) else "Expected a JSON object"
+        return
+    header = None
+    # one reader for the whole roster, fed a complete record at a time; it only asks for more
+    # when the file ended inside a quoted field, and then gets the end of input
+    pending = deque()
+    reader = csv.reader(iter(lambda: pending.popleft() if pending else None, None))
+    async for number, record in iter_records(lines):
+        if not record.strip():
+            continue
+        pending.append(record)
+        try:
+            values = next(reader)
+        except csv.Error as e:
+            yield number, f"Invalid CSV: {e}"
+            continue
+        if header is None:
+            header = [h.strip().lower().replace(" ", "_") for h in values]
+            continue
+        if len(values) > len(header):
+            yield number, f"{len(values)} values for {len(header)} columns"
+            continue
+        yield number, dict(zip(header, (v.strip() for v in values)))
+
+
+def to_user(row: dict) -> UserCreate:
+    data = {COLUMN_ALIASES.get(k, k): v for k, v in row.items() if v not in ("", None) and k not in IGNORED_COLUMNS}
+    return UserCreate(**data)
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in error.errors())
+
+
+class RosterImport:
+    """One roster upload, counts and per-row errors are kept in self.report."""
+
+    def __init__(self, chunk_size=ROSTER_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        # emails and usernames earlier in this roster, the unique indexes only see what was written
+        self.seen = {"email": set(), "username": set()}
+        self.report = {"received": 0, "created": 0, "failed": 0, "errors": []}
+        self.started = time.perf_counter()
+
+    def fail(self, row, error, email=None):
+        self.report["failed"] += 1
+        if len(self.report["errors"]) < ROSTER_MAX_ERRORS:
+            self.report["errors"].append({"row": row, "email": email, "error": error})
+
+    def validate(self, number, row):
+        """The row as a UserCreate, None (and the error recorded) if it can't be imported."""
+        self.report["received"] += 1
+        if isinstance(row, str):
+            self.fail(number, row)
+            return None
+        try:
+            user = to_user(row)
+        except ValidationError as e:
+            self.fail(number, _validation_message(e), row.get("email"))
+            return None
+        for field in ("email", "username"):
+            if getattr(user, field) in self.seen[field]:
+                self.fail(number, f"{DUPLICATE_MESSAGES[field]} earlier in the roster", user.email)
+                return None
+        for field in ("email", "username"):
+            self.seen[field].add(getattr(user, field))
+        return user
+
+    async def write(self, batch, hashes):
+        """
+        Inserts a chunk of (line number, user), students already in the database become row errors.
+        A write that fails doesn't stop the roster: the chunk's students it may have left half
+        created (without their companion documents) are deleted again and reported as row errors.
+        """
+        taken = await find_taken([user.email for _, user in batch], [user.username for _, user in batch])
+        if taken:
+            kept = []
+            for (number, user), hashed in zip(batch, hashes):
+                field = next((f for f in taken if getattr(user, f) in taken[f]), None)
+                if field:
+                    self.fail(number, DUPLICATE_MESSAGES[field], user.email)
+                else:
+                    kept.append(((number, user), hashed))
+            batch, hashes = [b for b, _ in kept], [h for _, h in kept]
+            if not batch:
+                return
+        created_at = datetime.now(timezone.utc)
+        docs = [new_user_document(user, hashed, created_at) for (_, user), hashed in zip(batch, hashes)]
+        # index in the chunk -> error, and the students that have to be removed again
+        failed, orphans = {}, set()
+        try:
+            await mongo_db.user_collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = (
+                    DUPLICATE_MESSAGES[duplicate_field(error, error.get("errmsg", ""))]
+                    if error.get("code") == 11000 else error.get("errmsg", "Write failed")
+                )
+        except Exception as e:
+            # no telling which of the chunk went in
+            logger.error(f"Could not write {len(docs)} roster students: {e}")
+            failed = dict.fromkeys(range(len(docs)), WRITE_FAILED)
+            orphans.update(failed)
+        inserted = [i for i in range(len(docs)) if i not in failed]
+        if inserted:
+            companions = [companion_documents(docs[i]["_id"], created_at) for i in inserted]
+            results = await asyncio.gather(*(
+                getattr(mongo_db, name).insert_many([c[name] for c in companions], ordered=False)
+                for name in companions[0]
+            ), return_exceptions=True)
+            for result in results:
+                if isinstance(result, BulkWriteError):
+                    orphans.update(inserted[error["index"]] for error in result.details.get("writeErrors", []))
+                elif isinstance(result, Exception):
+                    logger.error(f"Could not write companion documents of {len(inserted)} roster students: {result}")
+                    orphans.update(inserted)
+            failed.update(dict.fromkeys(orphans, WRITE_FAILED))
+        if orphans:
+            await self.remove([docs[i]["_id"] for i in sorted(orphans)])
+        for index, message in sorted(failed.items()):
+            self.fail(batch[index][0], message, batch[index][1].email)
+        self.report["created"] += len(docs) - len(failed)
+
+    async def remove(self, user_ids):
+        """Deletes students of a failed write with whatever companion documents they got."""
+        names = list(companion_documents(None, None))
+        results = await asyncio.gather(
+            mongo_db.user_collection.delete_many({"_id": {"$in": user_ids}}),
+            *(getattr(mongo_db, name).delete_many({"user_id": {"$in": user_ids}}) for name in names),
+            return_exceptions=True,
+        )
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            logger.error(f"Could not remove partly created roster students {[str(i) for i in user_ids]}: {errors[0]}")
+
+    async def _flush(self, batch, writing):
+        """Hashes a chunk while the previous one is still being written, returns the chunk's write task."""
+        if not batch:
+            return writing
+        hashes = await bulk_hash_pool.hash_many([user.password for _, user in batch])
+        if writing:
+            await writing
+        return asyncio.create_task(self.write(batch, hashes))
+
+    async def run(self, rows) -> dict:
+        batch, writing = [], None
+        try:
+            async for number, row in rows:
+                user = self.validate(number, row)
+                if user:
+                    batch.append((number, user))
+                if len(batch) >= self.chunk_size:
+                    writing = await self._flush(batch, writing)
+                    batch = []
+            writing = await self._flush(batch, writing)
+            if writing:
+                await writing
+        except BaseException:
+            if writing:
+                writing.cancel()
+            raise
+        elapsed = time.perf_counter() - self.started
+        return {
+            **self.report,
+            "errors": sorted(self.report["errors"], key=lambda e: e["row"]),
+            "elapsed_seconds": round(elapsed, 2),
+            "rows_per_sec": round(self.report["received"] / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+def detect_format(name: str = "", content_type: str = "") -> str:
+    if "json" in content_type or name.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    return "csv"
+
+
+async def import_roster(chunks, fmt="csv", chunk_size=ROSTER_CHUNK_SIZE) -> dict:
+    """Imports a roster from an async iterable of byte chunks, returns the report."""
+    return await RosterImport(chunk_size).run(iter_rows(iter_lines(chunks), fmt))
+
+
+async def file_chunks(path, size=1 << 16):
+    with open(path, "rb") as f:
+        while chunk := await asyncio.to_thread(f.read, size):
+            yield chunk
+
+
+async def main(args):
+    await mongo_db.connect_to_mongo()
+    try:
+        await ensure_user_indexes()
+        report = await import_roster(
+            file_chunks(args.path), args.format or detect_format(args.path), args.chunk_size
+        )
+        print(json.dumps(report, indent=2, default=str))
+    finally:
+        bulk_hash_pool.shutdown()
+        await mongo_db.close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="CSV or NDJSON roster")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="default: from the file extension")
+    parser.add_argument("--chunk-size", type=int, default=ROSTER_CHUNK_SIZE, help="students hashed and written at once")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,232 @@
+import os
+import time
+import asyncio
+import functools
+import contextvars
+from collections import defaultdict
+import dotenv
+
+dotenv.load_dotenv()
+
+try:
+    from opentelemetry import trace
+except ImportError:  # spans are optional, metrics work without them
+    trace = None
+
+# spans go to whatever tracer provider the deployment configured (OTLP exporter etc.)
+TRACING = os.getenv("OTEL_TRACING", "0") == "1" and trace is not None
+tracer = trace.get_tracer("learning-platform") if TRACING else None
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+# the node or service an LLM call is made for, so calls can be charged to it
+current_operation: contextvars.ContextVar = contextvars.ContextVar("current_operation", default="other")
+# path of the HTTP request being served, set by the request middleware
+current_endpoint: contextvars.ContextVar = contextvars.ContextVar("current_endpoint", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = defaultdict(float)
+
+    def inc(self, value=1.0, **labels):
+        self.values[tuple(labels.get(n, "") for n in self.labels)] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., +Inf count, sum]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        row = self.values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+                break
+        else:
+            row[len(self.buckets)] += 1
+        row[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, row in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), row[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {row[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+operation_duration = Histogram(
+    "app_operation_duration_seconds", "Duration of graph nodes and service operations.", ("kind", "name"))
+operation_errors = Counter(
+    "app_operation_errors_total", "Graph nodes and service operations that raised.", ("kind", "name"))
+llm_duration = Histogram(
+    "llm_request_duration_seconds", "Duration of a single LLM provider request.", ("operation", "backend"))
+llm_requests = Counter(
+    "llm_requests_total", "LLM provider requests by outcome.", ("operation", "backend", "outcome"))
+llm_tokens = Counter(
+    "llm_tokens_total", "Prompt and completion tokens reported by the provider.", ("operation", "backend", "kind"))
+llm_completion_tokens = Histogram(
+    "llm_completion_tokens", "Completion tokens per LLM request.", ("operation",), buckets=TOKEN_BUCKETS)
+llm_queue_wait = Histogram(
+    "llm_rate_limit_wait_seconds", "Time an LLM call waited for the rate limiter.", ("operation",))
+llm_prompt_over_budget = Counter(
+    "llm_prompt_over_budget_total", "Prompts sent with more tokens than their operation's budget.", ("operation",))
+structured_parses = Counter(
+    "llm_structured_parses_total", "Structured LLM replies by outcome: ok, repaired, reasked or failed.",
+    ("operation", "outcome"))
+llm_retries = Counter(
+    "llm_retries_total", "LLM calls retried after a 429, 5xx or timeout.", ("operation", "status"))
+http_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request duration by route.", ("method", "route", "status"))
+password_hash_duration = Histogram(
+    "auth_password_hash_seconds", "Password hashing time in a worker and waiting for one.", ("operation", "phase"))
+
+METRICS = [operation_duration, operation_errors, llm_duration, llm_requests, llm_tokens,
+           llm_completion_tokens, llm_queue_wait, llm_prompt_over_budget, structured_parses, llm_retries,
+           http_duration, password_hash_duration]
+# name -> (type, help, label name, function returning {label value: number}), read at scrape time;
+# with label None the function returns the one number
+COLLECTED = {}
+
+
+def register_gauge(name, help, collect, label="key"):
+    COLLECTED[name] = ("gauge", help, label, collect)
+
+
+def register_counter(name, help, collect, label="key"):
+    """Like register_gauge for values that only go up, exported as <name>_total so rate() works."""
+    COLLECTED[f"{name}_total"] = ("counter", help, label, collect)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for name, (kind, help, label, collect) in COLLECTED.items():
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} {kind}"])
+        try:
+            values = collect()
+        except Exception:
+            continue
+        if label is None:
+            values = {None: values}
+        for key, value in values.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                lines.append(f"{name}{_labels((label,), (key,)) if label else ''} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+def span(name, **attributes):
+    """OpenTelemetry span when OTEL_TRACING=1 and the SDK is installed, a no-op otherwise."""
+    if tracer is None:
+        return _NoSpan()
+    return tracer.start_as_current_span(name, attributes={k: v for k, v in attributes.items() if v is not None})
+
+
+def traced(name, kind="node"):
+    """Times a graph node or service call and charges the LLM calls made inside it to `name`."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                token = current_operation.set(name)
+                start = time.perf_counter()
+                try:
+                    with span(f"{kind} {name}"):
+                        return await func(*args, **kwargs)
+                except Exception:
+                    operation_errors.inc(kind=kind, name=name)
+                    raise
+                finally:
+                    operation_duration.observe(time.perf_counter() - start, kind=kind, name=name)
+                    current_operation.reset(token)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = current_operation.set(name)
+            start = time.perf_counter()
+            try:
+                with span(f"{kind} {name}"):
+                    return func(*args, **kwargs)
+            except Exception:
+                operation_errors.inc(kind=kind, name=name)
+                raise
+            finally:
+                operation_duration.observe(time.perf_counter() - start, kind=kind, name=name)
+                current_operation.reset(token)
+        return wrapper
+    return decorator
+
+
+def token_usage(response):
+    """(prompt, completion) tokens of a LangChain reply, zeros if the provider didn't say."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+def record_llm_call(backend, seconds, response=None, error=None):
+    operation = current_operation.get()
+    llm_duration.observe(seconds, operation=operation, backend=backend)
+    if error is not None:
+        llm_requests.inc(operation=operation, backend=backend, outcome=type(error).__name__)
+        return
+    llm_requests.inc(operation=operation, backend=backend, outcome="ok")
+    prompt_tokens, completion_tokens = token_usage(response)
+    llm_tokens.inc(prompt_tokens, operation=operation, backend=backend, kind="prompt")
+    llm_tokens.inc(completion_tokens, operation=operation, backend=backend, kind="completion")
+    llm_completion_tokens.observe(completion_tokens, operation=operation)
+
+
+def record_rate_limit_wait(seconds):
+    llm_queue_wait.observe(seconds, operation=current_operation.get())
+
+
+def record_retry(status):
+    llm_retries.inc(operation=current_operation.get(), status=status)
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+import dotenv
+from pymongo import UpdateOne
+
+dotenv.load_dotenv()
+logger = logging.getLogger(__name__)
+
+# cl100k is not Llama's tokenizer, but it is within a few percent for English text
+TOKEN_ENCODING = os.getenv("LLM_TOKEN_ENCODING", "cl100k_base")
+# operation -> (prompt budget, completion cap) in tokens, operations are the @traced names
+NODE_BUDGETS = {
+    "age_question_bank": (500, 800),
+    "age_question_generator": (600, 80),
+    "assessment": (1500, 400),
+    "follow_up": (400, 250),
+    "guidance": (700, 700),
+    "history_summary": (2500, 250),
+    "quiz": (1500, 2500),
+    "homework": (3000, 1200),
+    "other": (4000, 1024),
+}
+# e.g. LLM_TOKEN_BUDGETS='{"guidance": [900, 800]}'
+NODE_BUDGETS.update({k: tuple(v) for k, v in json.loads(os.getenv("LLM_TOKEN_BUDGETS", "{}")).items()})
+
+# usage counters are flushed to Mongo in one bulk write every few seconds instead of per call
+USAGE_FLUSH_SECONDS = float(os.getenv("LLM_USAGE_FLUSH_SECONDS", "10"))
+USAGE_FLUSH_KEYS = int(os.getenv("LLM_USAGE_FLUSH_KEYS", "200"))
+USAGE_PERSIST = os.getenv("LLM_USAGE_PERSIST", "1") == "1"
+
+_encoding = None
+_encoding_failed = False
+
+
+def get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            # the BPE file is downloaded on first use, fall back to an estimate if that's not possible
+            _encoding_failed = True
+            logger.warning(f"tiktoken encoding {TOKEN_ENCODING} unavailable ({e}), estimating tokens from length")
+    return _encoding
+
+
+def prompt_text(prompt) -> str:
+    """Text of a prompt given as a string, LangChain messages or (role, content) tuples."""
+    if isinstance(prompt, str):
+        return prompt
+    parts = []
+    for message in prompt:
+        content = message[1] if isinstance(message, tuple) else getattr(message, "content", message)
+        parts.append(content if isinstance(content, str) else str(content))
+    return "\n".join(parts)
+
+
+def count_tokens(text) -> int:
+    text = prompt_text(text)
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def prompt_budget(operation: str) -> int:
+    return NODE_BUDGETS.get(operation, NODE_BUDGETS["other"])[0]
+
+
+def completion_cap(operation: str) -> int:
+    return NODE_BUDGETS.get(operation, NODE_BUDGETS["other"])[1]
+
+
+def trim_text(text: str, budget: int) -> str:
+    """Cuts text to about `budget` tokens, keeping its start and end, which usually carry the point."""
+    if count_tokens(text) <= budget:
+        return text
+    encoding = get_encoding()
+    half = max(1, budget // 2)
+    if encoding is None:
+        return text[:half * 4] + " … " + text[-half * 4:]
+    tokens = encoding.encode(text, disallowed_special=())
+    return encoding.decode(tokens[:half]) + " … " + encoding.decode(tokens[-half:])
+
+
+def fit_items(items: list, budget: int, item_budget: int = None) -> list:
+    """Newest items that fit in `budget` tokens together, each one trimmed to `item_budget` first."""
+    kept, used = [], 0
+    for item in reversed(items):
+        text = str(item)
+        if item_budget:
+            text = trim_text(text, item_budget)
+        cost = count_tokens(text)
+        if used + cost > budget:
+            break
+        kept.append(text)
+        used += cost
+    return kept[::-1]
+
+
+class UsageRecorder:
+    """Token usage per user and endpoint per day, buffered in memory and flushed with $inc bulk writes."""
+
+    def __init__(self, persist=USAGE_PERSIST, flush_seconds=USAGE_FLUSH_SECONDS, flush_keys=USAGE_FLUSH_KEYS,
+                 collection_name="llm_usage"):
+        self.persist = persist
+        self.flush_seconds = flush_seconds
+        self.flush_keys = flush_keys
+        self.collection_name = collection_name
+        # (user_id, endpoint, day) -> {field: increment}
+        self.pending = defaultdict(lambda: defaultdict(int))
+        self.last_flush = time.monotonic()
+        self._flushing = None
+
+    def record(self, user_id, endpoint, operation, prompt_tokens, completion_tokens):
+        day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        counters = self.pending[(str(user_id or "anonymous"), endpoint or "internal", day)]
+        counters["calls"] += 1
+        counters["prompt_tokens"] += prompt_tokens
+        counters["completion_tokens"] += completion_tokens
+        counters[f"operations.{operation}.prompt_tokens"] += prompt_tokens
+        counters[f"operations.{operation}.completion_tokens"] += completion_tokens
+        due = len(self.pending) >= self.flush_keys or time.monotonic() - self.last_flush >= self.flush_seconds
+        if due and self.persist and (self._flushing is None or self._flushing.done()):
+            self._flushing = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        """Writes the buffered counters, they are put back if the write fails."""
+        self.last_flush = time.monotonic()
+        if not self.pending or not self.persist:
+            return
+        pending, self.pending = self.pending, defaultdict(lambda: defaultdict(int))
+        now = datetime.now(timezone.utc)
+        requests = [
+            UpdateOne(
+                {"user_id": user_id, "endpoint": endpoint, "day": day},
+                {"$inc": dict(counters), "$set": {"updated_at": now}},
+                upsert=True,
+            )
+            for (user_id, endpoint, day), counters in pending.items()
+        ]
+        try:
+            from app.mongo_db import get_mongo_connection
+            await get_mongo_connection()[self.collection_name].bulk_write(requests, ordered=False)
+        except Exception as e:
+            logger.warning(f"Could not flush LLM usage: {e}")
+            for key, counters in pending.items():
+                for field, value in counters.items():
+                    self.pending[key][field] += value
+
+
+usage_recorder = UsageRecorder()
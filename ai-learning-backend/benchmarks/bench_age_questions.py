@@ -0,0 +1,102 @@
+"""
+Age-assessment question generation: batched vs sequential.
+
+Drives complete assessments (5 questions, 5 answers, assessment) through the
+chatbot graph turn by turn with a fake model, once per AGE_QUESTION_MODE, and
+reports LLM calls and wall time per completed assessment. With --limiter the production
+rate limits (LLM_* settings) are applied, which is where the extra calls hurt most.
+
+Usage (from ai-learning-backend/):
+    python -m benchmarks.bench_age_questions --assessments 5 --latency 0.3 --limiter
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+
+os.environ.setdefault("GROQ_API_KEY_TEST", "offline-benchmark")
+os.environ.setdefault("CHAT_CHECKPOINTER", "memory")
+os.environ.setdefault("LLM_CACHE_PERSIST", "0")
+
+from app.services.chatbot import agent_chatbot, rate_limiter
+
+ANSWERS = [
+    "I would think about why it happened before deciding what to do",
+    "I get upset but then I try to calm down",
+    "I usually ask my parents",
+    "If I really want something I save up for it because it is worth waiting",
+    "I want to be a doctor so I plan to study biology",
+]
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeLLM:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if "question bank" in prompt:
+            questions = [
+                {"dimension": d, "level": level, "question": f"{level} question about {d}?"}
+                for d in agent_chatbot.AGE_DIMENSIONS
+                for level in ("basic", "advanced")
+            ]
+            return FakeMessage(json.dumps({"questions": questions}))
+        if "QUESTION:" in prompt:
+            return FakeMessage("QUESTION: What would you do if you found a lost wallet?")
+        return FakeMessage(json.dumps({
+            "estimated_age": 14, "confidence": 7, "category": "teen",
+            "indicators": ["reasoning", "emotions", "decisions"],
+        }))
+
+
+async def run_assessment(user):
+    state = await agent_chatbot.run_graph(agent_chatbot.getState(None), user)
+    for answer in ANSWERS[:agent_chatbot.AGE_QUESTION_COUNT]:
+        state = await agent_chatbot.run_turn(user, answer)
+    return state
+
+
+async def run_mode(mode, assessments, latency):
+    agent_chatbot.AGE_QUESTION_MODE = mode
+    agent_chatbot.llm = FakeLLM(latency)
+    start = time.perf_counter()
+    await asyncio.gather(*(run_assessment(f"bench-{mode}-{i}") for i in range(assessments)))
+    return time.perf_counter() - start, agent_chatbot.llm.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--assessments", type=int, default=5, help="assessments run concurrently")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake LLM latency in seconds")
+    parser.add_argument("--limiter", action="store_true", help="apply the production rate limits")
+    args = parser.parse_args()
+
+    print(f"{args.assessments} assessments, fake LLM latency {args.latency * 1000:.0f} ms, "
+          f"rate limits {'on' if args.limiter else 'off'}")
+    print(f"{'mode':<12}{'LLM calls/assessment':>22}{'wall time/assessment':>22}")
+    for mode in ("sequential", "batched"):
+        if not args.limiter:
+            rate_limiter.limiter = rate_limiter.RateLimiter(
+                rate_limiter.MemoryBucketBackend(), 10**6, 10**6, 10**6, 10**6
+            )
+        else:
+            rate_limiter.limiter = rate_limiter.RateLimiter(
+                rate_limiter.MemoryBucketBackend(),
+                rate_limiter.MAX_REQUESTS_PER_MIN, rate_limiter.BURST,
+                rate_limiter.USER_REQUESTS_PER_MIN, rate_limiter.USER_BURST,
+            )
+        elapsed, calls = asyncio.run(run_mode(mode, args.assessments, args.latency))
+        print(f"{mode:<12}{calls / args.assessments:>22.1f}{elapsed / args.assessments:>21.2f}s")
+
+
+if __name__ == "__main__":
+    main()
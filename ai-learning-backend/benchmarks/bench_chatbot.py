@@ -0,0 +1,269 @@
+"""
+Offline load test for the chatbot, through the graph or the /chatbot/* endpoints.
+
+Replays the child/teen/adult scenarios from agent_chatbot.TEST_SCENARIOS (followed
+by age-question answers) as concurrent sessions against a deterministic fake LLM
+(benchmarks/fake_llm.py), so no provider quota is used. Reports turns/s, turn
+latency p50/p99, per-node latency, LLM calls per session and how the saved state
+grows turn after turn.
+
+Results can be saved and compared against an earlier run; the comparison exits
+with status 1 if a metric got worse by more than --tolerance.
+
+Usage (from ai-learning-backend/):
+    python -m benchmarks.bench_chatbot --sessions 30 --concurrency 10 --latency lognormal:0.2:0.5
+    python -m benchmarks.bench_chatbot --target endpoints --save benchmarks/results/baseline.json
+    python -m benchmarks.bench_chatbot --compare benchmarks/results/baseline.json
+
+The endpoint target runs the FastAPI app in-process on mongomock-motor (not part
+of requirements.txt, install it next to the app to use this target).
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+from collections import defaultdict
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+os.environ.setdefault("GROQ_API_KEY_TEST", "offline-benchmark")
+os.environ.setdefault("CHAT_CHECKPOINTER", "memory")
+os.environ.setdefault("LLM_CACHE_PERSIST", "0")
+
+import bson
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+from app.services.chatbot import agent_chatbot, rate_limiter
+from benchmarks.bench_age_questions import ANSWERS
+from benchmarks.fake_llm import FakeChatModel
+
+# metrics where a higher value is a regression, the rest are better when higher
+LOWER_IS_BETTER = ("turn_p50_ms", "turn_p99_ms", "llm_calls_per_session", "state_bytes_last_turn",
+                   "state_growth_bytes_per_turn")
+HIGHER_IS_BETTER = ("turns_per_sec",)
+
+node_timer_var = ContextVar("bench_node_timer", default=None)
+# every LangChain run started while the var is set reports to the timer, graph nodes included
+register_configure_hook(node_timer_var, inheritable=True)
+
+
+class NodeTimer(BaseCallbackHandler):
+    """Collects the wall time of every graph node run."""
+
+    run_inline = True
+
+    def __init__(self):
+        self.started = {}
+        self.samples = defaultdict(list)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # nested runnables inside a node carry the same metadata, only time the node itself
+        if node and kwargs.get("name") == node:
+            self.started[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        if run_id in self.started:
+            node, start = self.started.pop(run_id)
+            self.samples[node].append(time.perf_counter() - start)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.started.pop(run_id, None)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def session_script(i, turns):
+    scenario = agent_chatbot.TEST_SCENARIOS[i % len(agent_chatbot.TEST_SCENARIOS)]
+    messages = scenario["messages"] + ANSWERS
+    return [messages[t % len(messages)] for t in range(turns)]
+
+
+async def state_size(user_id):
+    return len(bson.encode(await agent_chatbot.get_graph_state(user_id)))
+
+
+class GraphTarget:
+    """Calls run_graph and run_turn directly, the way the chat routes do."""
+
+    async def start(self, user_id):
+        await agent_chatbot.run_graph(agent_chatbot.getState(None), user_id)
+
+    async def turn(self, user_id, text):
+        # the route answers finished conversations without running the graph
+        if (await agent_chatbot.get_graph_state(user_id)).get("final_guidance"):
+            return
+        await agent_chatbot.run_turn(user_id, text)
+
+    async def close(self):
+        pass
+
+
+class EndpointTarget:
+    """Drives /chatbot/initialize and /chatbot/chat over ASGI, with the user taken from a header."""
+
+    def __init__(self):
+        import httpx
+        from fastapi import Request
+        from mongomock_motor import AsyncMongoMockClient
+        from app import mongo_db
+        from app.main import app
+        from app.router import chatbot
+        from app.authentication.auth import get_current_user
+
+        db = AsyncMongoMockClient()["bench"]
+        mongo_db.get_mongo_connection = lambda: db
+
+        def bench_user(request: Request):
+            return {"id": request.headers["x-bench-user"]}
+
+        app.dependency_overrides[get_current_user] = bench_user
+        app.dependency_overrides[chatbot.get_db] = lambda: db
+        # the lifespan handler would connect to the real cluster, ASGITransport doesn't run it
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+    async def start(self, user_id):
+        response = await self.client.post("/chatbot/initialize", headers={"x-bench-user": user_id})
+        response.raise_for_status()
+
+    async def turn(self, user_id, text):
+        response = await self.client.post("/chatbot/chat", json={"message": text}, headers={"x-bench-user": user_id})
+        response.raise_for_status()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+async def run(args, llm):
+    timer = NodeTimer()
+    node_timer_var.set(timer)
+    target = EndpointTarget() if args.target == "endpoints" else GraphTarget()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    turn_times = []
+    sizes = defaultdict(list)
+
+    async def session(i):
+        user_id = f"bench-{i}"
+        async with semaphore:
+            await target.start(user_id)
+            for t, text in enumerate(session_script(i, args.turns)):
+                start = time.perf_counter()
+                await target.turn(user_id, text)
+                turn_times.append(time.perf_counter() - start)
+                sizes[t].append(await state_size(user_id))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(args.sessions)))
+    elapsed = time.perf_counter() - start
+    await target.close()
+
+    mean_sizes = [statistics.mean(sizes[t]) for t in sorted(sizes)]
+    return {
+        "turns_per_sec": len(turn_times) / elapsed,
+        "turn_p50_ms": percentile(turn_times, 0.50) * 1000,
+        "turn_p99_ms": percentile(turn_times, 0.99) * 1000,
+        "llm_calls_per_session": sum(llm.calls.values()) / args.sessions,
+        "state_bytes_first_turn": mean_sizes[0],
+        "state_bytes_last_turn": mean_sizes[-1],
+        "state_growth_bytes_per_turn": (mean_sizes[-1] - mean_sizes[0]) / max(1, len(mean_sizes) - 1),
+        "nodes": {
+            node: {
+                "count": len(samples),
+                "p50_ms": percentile(samples, 0.50) * 1000,
+                "p99_ms": percentile(samples, 0.99) * 1000,
+                "mean_ms": statistics.mean(samples) * 1000,
+            }
+            for node, samples in sorted(timer.samples.items())
+        },
+    }
+
+
+def report(metrics):
+    print(f"{'turns/s':<30}{metrics['turns_per_sec']:>12.1f}")
+    print(f"{'turn p50 / p99':<30}{metrics['turn_p50_ms']:>9.0f} ms / {metrics['turn_p99_ms']:.0f} ms")
+    print(f"{'LLM calls/session':<30}{metrics['llm_calls_per_session']:>12.1f}")
+    print(f"{'state size first -> last turn':<30}{metrics['state_bytes_first_turn']:>10.0f} B -> "
+          f"{metrics['state_bytes_last_turn']:.0f} B ({metrics['state_growth_bytes_per_turn']:+.0f} B/turn)")
+    print(f"\n{'node':<26}{'runs':>8}{'p50':>10}{'p99':>10}{'mean':>10}")
+    for node, n in metrics["nodes"].items():
+        print(f"{node:<26}{n['count']:>8}{n['p50_ms']:>8.1f}ms{n['p99_ms']:>8.1f}ms{n['mean_ms']:>8.1f}ms")
+
+
+def compare(metrics, baseline, tolerance):
+    """Prints the change of every tracked metric, returns the ones that regressed past the tolerance."""
+    regressions = []
+    print(f"\n{'metric':<30}{'baseline':>12}{'now':>12}{'change':>10}")
+    for name in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+        old, new = baseline["metrics"].get(name), metrics[name]
+        if not old:
+            continue
+        change = (new - old) / old
+        worse = -change if name in HIGHER_IS_BETTER else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<30}{old:>12.1f}{new:>12.1f}{change:>+9.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=("graph", "endpoints"), default="graph")
+    parser.add_argument("--sessions", type=int, default=30, help="chat sessions to run")
+    parser.add_argument("--concurrency", type=int, default=10, help="sessions running at the same time")
+    parser.add_argument("--turns", type=int, default=7, help="user messages per session")
+    parser.add_argument("--latency", default="lognormal:0.2:0.5",
+                        help="fake LLM latency: fixed:S, uniform:LO:HI or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--tail", default=None, help="P:S adds S seconds to a fraction P of the calls")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--limiter", action="store_true", help="apply the production rate limits")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args()
+
+    if not args.limiter:
+        rate_limiter.limiter = rate_limiter.RateLimiter(
+            rate_limiter.MemoryBucketBackend(), 10**6, 10**6, 10**6, 10**6
+        )
+    tail = tuple(float(x) for x in args.tail.split(":")) if args.tail else None
+    llm = FakeChatModel(latency=args.latency, tail=tail, seed=args.seed)
+    agent_chatbot.llm = llm
+
+    print(f"{args.target}: {args.sessions} sessions x {args.turns} turns, concurrency {args.concurrency}, "
+          f"latency {args.latency}{f', tail {args.tail}' if args.tail else ''}\n")
+    metrics = asyncio.run(run(args, llm))
+    report(metrics)
+
+    config = {k: v for k, v in vars(args).items() if k not in ("save", "compare", "tolerance")}
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump({
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "config": config,
+                "metrics": metrics,
+            }, f, indent=2)
+        print(f"\nsaved to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print(f"\nwarning: baseline was run with {baseline['config']}")
+        if compare(metrics, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Concurrent chat-turn benchmark for the chatbot graph.
+
+Runs N chat turns at once through run_graph with the Groq client swapped for a
+fake model that takes a fixed time to answer. In "blocking" mode the fake model
+sleeps with time.sleep (what llm.invoke did inside the async handlers), in
+"async" mode it awaits asyncio.sleep like llm.ainvoke. A ticker task measures
+how long the event loop was frozen while the turns ran.
+
+Usage (from ai-learning-backend/):
+    python -m benchmarks.bench_concurrent_chat --turns 20 --latency 0.2
+"""
+import os
+import time
+import asyncio
+import argparse
+
+os.environ.setdefault("GROQ_API_KEY_TEST", "offline-benchmark")
+os.environ.setdefault("CHAT_CHECKPOINTER", "memory")
+os.environ.setdefault("LLM_CACHE_PERSIST", "0")
+
+from app.services.chatbot import agent_chatbot, rate_limiter
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeLLM:
+    def __init__(self, latency, blocking):
+        self.latency = latency
+        self.blocking = blocking
+
+    async def ainvoke(self, prompt):
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+        return FakeMessage("QUESTION: What would you do if a friend broke a promise?")
+
+
+async def loop_lag_probe(stop, interval=0.01):
+    """Returns the worst delay seen between scheduled ticks of the event loop."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run_turns(turns, mode):
+    async def one_turn(i):
+        state = agent_chatbot.getState(None)
+        state["user_input"] = f"benchmark message {i}"
+        state["conversation_history"].append({"role": "user", "content": state["user_input"]})
+        return await agent_chatbot.run_graph(state, f"bench-{mode}-{i}")
+
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(one_turn(i) for i in range(turns)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return elapsed, await probe
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20, help="concurrent chat turns")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM latency in seconds")
+    args = parser.parse_args()
+
+    # the provider quota would dominate the numbers, we only measure the LLM wait here
+    rate_limiter.limiter = rate_limiter.RateLimiter(
+        rate_limiter.MemoryBucketBackend(), 10**6, 10**6, 10**6, 10**6
+    )
+
+    print(f"{args.turns} concurrent turns, fake LLM latency {args.latency * 1000:.0f} ms")
+    print(f"{'mode':<10}{'wall time':>12}{'turns/s':>10}{'max loop lag':>15}")
+    for mode in ("blocking", "async"):
+        agent_chatbot.llm = FakeLLM(args.latency, blocking=(mode == "blocking"))
+        elapsed, lag = asyncio.run(run_turns(args.turns, mode))
+        print(f"{mode:<10}{elapsed:>11.2f}s{args.turns / elapsed:>10.1f}{lag * 1000:>13.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
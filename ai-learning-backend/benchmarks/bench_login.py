@@ -0,0 +1,101 @@
+"""
+Login throughput: password verification inline on the event loop vs in the hash pool.
+
+Fires --logins verifications at once, the way a class signing in together does, and
+reports logins per second, per-login latency and the worst event loop stall seen by a
+ticker task. "inline" calls passlib from the coroutine like login_user used to, "pool"
+goes through app.authentication.passwords.hash_pool. Mongo is left out, this measures
+the hashing part of a login only.
+
+With --stored-scheme/--stored-rounds the stored hashes use other settings than the
+configured ones, so every login also rehashes (the migration path).
+
+Usage (from ai-learning-backend/):
+    python -m benchmarks.bench_login --logins 40
+    python -m benchmarks.bench_login --scheme argon2 --stored-scheme bcrypt --workers 4
+"""
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+
+async def loop_lag_probe(stop, interval=0.01):
+    """Returns the worst delay seen between scheduled ticks of the event loop."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run_logins(mode, logins, stored_hash, password):
+    from app.authentication import passwords
+
+    latencies = []
+
+    async def login():
+        if mode == "inline":
+            passwords.pwd_context.verify_and_update(password, stored_hash)
+        else:
+            await passwords.hash_pool.verify(password, stored_hash)
+        # from when the whole batch was sent, inline logins also wait for the ones before them
+        latencies.append(time.perf_counter() - start)
+
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    lag = await probe
+    latencies.sort()
+    return {
+        "logins_per_sec": logins / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000,
+        "max_loop_lag_ms": lag * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--scheme", choices=["bcrypt", "argon2"], default="bcrypt")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost")
+    parser.add_argument("--stored-scheme", choices=["bcrypt", "argon2"], default=None)
+    parser.add_argument("--stored-rounds", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--modes", default="inline,pool")
+    args = parser.parse_args()
+
+    # read by the passwords module and by process pool workers when they import it
+    os.environ.update({
+        "PASSWORD_SCHEME": args.scheme,
+        "BCRYPT_ROUNDS": str(args.rounds),
+        "PASSWORD_HASH_WORKERS": str(args.workers),
+        "PASSWORD_HASH_EXECUTOR": args.executor,
+        "PASSWORD_HASH_MAX_PENDING": str(args.logins),
+    })
+    from app.authentication import passwords
+
+    password = "correct horse battery staple"
+    stored = passwords.build_context(args.stored_scheme or args.scheme, args.stored_rounds or args.rounds)
+    stored_hash = stored.hash(password)
+    print(f"{args.logins} logins, {args.scheme} (stored {stored_hash[:7]}...), "
+          f"rehash on login: {passwords.pwd_context.needs_update(stored_hash)}, "
+          f"{args.workers} {args.executor} workers, {os.cpu_count()} CPUs")
+    print(f"  {'mode':<8}{'logins/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'loop lag ms':>14}")
+    for mode in args.modes.split(","):
+        result = asyncio.run(run_logins(mode, args.logins, stored_hash, password))
+        print(f"  {mode:<8}{result['logins_per_sec']:>10.1f}{result['p50_ms']:>10.0f}"
+              f"{result['p99_ms']:>10.0f}{result['max_loop_lag_ms']:>14.0f}")
+    passwords.hash_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
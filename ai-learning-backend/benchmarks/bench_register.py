@@ -0,0 +1,171 @@
+"""
+Registration latency: the old lookup-then-insert sequence against create_account.
+
+Mongo is replaced by in-memory collections that wait --rtt seconds per operation, so the
+numbers show what the round trips cost at a given network latency ("ops/reg" counts
+operations, the four writes of "after" overlap in a single round trip). "before" is the flow
+register_user used to run: a $or lookup for duplicates, a bcrypt hash on the event loop,
+then the users, user_profiles, user_courses and user_progress inserts one after another.
+"after" hashes in the pool and writes the four documents concurrently through
+app.authentication.accounts.create_account. A tenth of the registrations reuse an email
+to exercise the duplicate path. "raced" counts duplicates that got past the lookup
+because a concurrent registration hadn't been written yet; without the unique index
+they would have become second accounts.
+
+Usage (from ai-learning-backend/):
+    python -m benchmarks.bench_register --users 50 --rtt 0.02
+"""
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+os.environ.setdefault("GROQ_API_KEY_TEST", "offline-benchmark")
+os.environ.setdefault("BCRYPT_ROUNDS", "10")
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app import mongo_db
+from app.authentication.accounts import UNIQUE_FIELDS, AccountExists, create_account, indexed_fields
+from app.authentication.passwords import hash_pool, pwd_context
+from app.model.user_model import UserCreate
+
+
+class Result:
+    def __init__(self, inserted_id=None):
+        self.inserted_id = inserted_id
+
+
+class SlowCollection:
+    """Just enough of a Motor collection, every call costs one round trip."""
+
+    def __init__(self, rtt, counter, unique=()):
+        self.rtt = rtt
+        self.counter = counter
+        self.unique = unique
+        self.docs = {}
+
+    async def _round_trip(self):
+        self.counter["round_trips"] += 1
+        await asyncio.sleep(self.rtt)
+
+    def _matches(self, doc, query):
+        if "$or" in query:
+            return any(self._matches(doc, q) for q in query["$or"])
+        return all(doc.get(k) == v for k, v in query.items())
+
+    async def find_one(self, query, projection=None):
+        await self._round_trip()
+        return next((d for d in self.docs.values() if self._matches(d, query)), None)
+
+    def _insert(self, doc):
+        for field in self.unique:
+            if any(d.get(field) == doc.get(field) for d in self.docs.values()):
+                raise DuplicateKeyError("E11000", details={"keyPattern": {field: 1}, "keyValue": {field: doc[field]}})
+        doc.setdefault("_id", len(self.docs) + 1)
+        self.docs[doc["_id"]] = doc
+
+    async def insert_one(self, doc):
+        await self._round_trip()
+        self._insert(doc)
+        return Result(doc["_id"])
+
+    async def insert_many(self, docs, ordered=True):
+        await self._round_trip()
+        errors = []
+        for i, doc in enumerate(docs):
+            try:
+                self._insert(doc)
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, **e.details})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    async def delete_one(self, query):
+        await self.delete_many(query)
+
+    async def delete_many(self, query):
+        await self._round_trip()
+        for key in [k for k, d in self.docs.items() if self._matches(d, query)]:
+            del self.docs[key]
+
+
+def install_collections(rtt):
+    counter = {"round_trips": 0}
+    mongo_db.user_collection = SlowCollection(rtt, counter, unique=("email", "username"))
+    mongo_db.user_profiles = SlowCollection(rtt, counter)
+    mongo_db.user_courses = SlowCollection(rtt, counter)
+    mongo_db.user_progress = SlowCollection(rtt, counter)
+    # what ensure_user_indexes records once the unique indexes are built
+    indexed_fields.update(UNIQUE_FIELDS)
+    return counter
+
+
+async def register_before(user):
+    if await mongo_db.user_collection.find_one({"$or": [{"email": user.email}, {"username": user.username}]}):
+        raise AccountExists("email")
+    hashed = pwd_context.hash(user.password)
+    result = await mongo_db.user_collection.insert_one({"email": user.email, "username": user.username,
+                                                       "hashed_password": hashed})
+    for name in ("user_profiles", "user_courses", "user_progress"):
+        await getattr(mongo_db, name).insert_one({"user_id": result.inserted_id})
+
+
+async def register_after(user):
+    await create_account(user, await hash_pool.hash(user.password))
+
+
+async def run(mode, users, rtt):
+    counter = install_collections(rtt)
+    register = register_before if mode == "before" else register_after
+    latencies, conflicts, raced = [], 0, 0
+
+    async def one(i):
+        nonlocal conflicts, raced
+        # every tenth registration reuses the previous email
+        email = f"student{i - 1 if i % 10 == 9 else i}@school.example.com"
+        user = UserCreate(name=f"Student {i}", username=f"student{i}", email=email, password="correct horse")
+        start = time.perf_counter()
+        try:
+            await register(user)
+        except AccountExists:
+            conflicts += 1
+        except DuplicateKeyError:
+            raced += 1
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    # a handful at a time, like sign-ups trickling in
+    for batch in range(0, users, 5):
+        await asyncio.gather(*(one(i) for i in range(batch, min(users, batch + 5))))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000,
+        "per_sec": users / elapsed,
+        "round_trips": counter["round_trips"] / users,
+        "conflicts": conflicts,
+        "raced": raced,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rtt", type=float, default=0.02, help="seconds per Mongo round trip")
+    args = parser.parse_args()
+
+    print(f"{args.users} registrations, {args.rtt * 1000:.0f} ms per round trip, "
+          f"bcrypt cost {os.environ['BCRYPT_ROUNDS']}")
+    print(f"  {'mode':<8}{'p50 ms':>10}{'p99 ms':>10}{'regs/s':>10}{'ops/reg':>11}{'conflicts':>11}{'raced':>7}")
+    for mode in ("before", "after"):
+        r = asyncio.run(run(mode, args.users, args.rtt))
+        print(f"  {mode:<8}{r['p50_ms']:>10.0f}{r['p99_ms']:>10.0f}{r['per_sec']:>10.1f}"
+              f"{r['round_trips']:>11.1f}{r['conflicts']:>11}{r['raced']:>7}")
+    hash_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
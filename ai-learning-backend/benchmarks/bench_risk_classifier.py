@@ -0,0 +1,172 @@
+"""
+Local concern/risk classifier against LLM labels: accuracy, coverage and latency.
+
+Compares app/services/chatbot/risk_classifier.py with the concern and risk level the
+assessment LLM gave the same first messages. Labels come from --data, a JSONL file of
+{"text", "concern", "risk"} rows exported from stored sessions with
+    python -m app.services.chatbot.risk_classifier --export benchmarks/results/concern_labels.jsonl
+or, with --live, from the configured LLM right now (uses provider quota). Without
+either, a small hand-labelled sample is used.
+
+With --train-split the TF-IDF model is trained on part of the rows and the rest is
+scored twice, lexicon only and lexicon plus model.
+
+Usage (from ai-learning-backend/):
+    python -m benchmarks.bench_risk_classifier
+    python -m benchmarks.bench_risk_classifier --data benchmarks/results/concern_labels.jsonl --train-split 0.7
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+os.environ.setdefault("GROQ_API_KEY_TEST", "offline-benchmark")
+os.environ.setdefault("CHAT_CHECKPOINTER", "memory")
+os.environ.setdefault("LLM_CACHE_PERSIST", "0")
+
+from app.services.chatbot import risk_classifier
+from app.services.chatbot.risk_classifier import ConcernModel, classify_many
+
+SAMPLES = [
+    ("I'm scared to go to school because the other kids are mean to me", "relationships", "low"),
+    ("They call me names and don't let me play with them at recess", "relationships", "low"),
+    ("everything is so stressful rn, school is hard and my parents keep fighting", "stress", "medium"),
+    ("i feel like nobody gets me and i just want to be alone all the time", "depression", "medium"),
+    ("I've been experiencing persistent anxiety about my career and relationships", "anxiety", "low"),
+    ("The stress is affecting my sleep and I'm having difficulty concentrating at work", "stress", "medium"),
+    ("I get so nervous before exams that I feel sick and can't stop worrying", "anxiety", "low"),
+    ("My heart races and I panic whenever I have to speak in class", "anxiety", "low"),
+    ("I feel empty and sad every day and nothing is fun anymore", "depression", "medium"),
+    ("I'm so tired of everything, I feel worthless and hopeless", "depression", "high"),
+    ("I failed my math test again and my grades keep dropping", "academic", "low"),
+    ("I have too much homework and I can't keep up with my classes", "academic", "low"),
+    ("My parents are getting a divorce and I don't know what to do", "family", "medium"),
+    ("My dad yells at my mom all the time and I hate being at home", "family", "medium"),
+    ("My brother and sister always gang up on me and my mom takes their side", "family", "low"),
+    ("My best friend stopped talking to me and I don't know why", "relationships", "low"),
+    ("My girlfriend broke up with me and I feel so lonely", "relationships", "medium"),
+    ("I keep having nightmares and flashbacks about the accident", "trauma", "medium"),
+    ("Someone abused me when I was younger and I still think about it", "trauma", "high"),
+    ("I was attacked on the way home last month and now I'm afraid to go out", "trauma", "medium"),
+    ("I'm overwhelmed with work and exhausted all the time", "stress", "medium"),
+    ("There is so much pressure on me from everyone, I'm burned out", "stress", "medium"),
+    ("I don't really know, I just wanted to talk to someone", "general", "low"),
+    ("Hi, how does this work?", "general", "low"),
+    ("I want to kill myself, nothing matters anymore", "depression", "high"),
+    ("Sometimes I hurt myself when things get bad", "depression", "high"),
+    ("I don't want to live anymore, everyone would be better off without me", "depression", "high"),
+    ("I can't cope with school and my parents at the same time", "stress", "medium"),
+    ("I worry about my family all the time and can't sleep", "anxiety", "medium"),
+    ("I'm bored and a bit annoyed with my teacher", "academic", "low"),
+]
+
+
+def load_rows(args):
+    if args.data:
+        with open(args.data) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    return [{"text": t, "concern": c, "risk": r} for t, c, r in SAMPLES]
+
+
+async def live_labels(rows, concurrency):
+    """Concern and risk the assessment LLM gives each message, with the call latency."""
+    from app.services.chatbot import agent_chatbot
+    from app.services.chatbot.structured_output import AssessmentResult, parse_structured
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def label(row):
+        async with semaphore:
+            prompt = agent_chatbot.assessment_prompt({"first_user_message": row["text"], "age_answers": []})
+            start = time.perf_counter()
+            reply = await agent_chatbot.llm.ainvoke(prompt)
+            latencies.append(time.perf_counter() - start)
+        result, _ = parse_structured(reply.content, AssessmentResult)
+        return {"text": row["text"], "concern": result.primary_concern, "risk": result.risk_level}
+
+    return await asyncio.gather(*(label(row) for row in rows)), latencies
+
+
+def evaluate(rows, model):
+    texts = [row["text"] for row in rows]
+    single = []
+    for text in texts:
+        start = time.perf_counter()
+        classify_many([text], model=model)
+        single.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    screenings = classify_many(texts, model=model)
+    batch_seconds = time.perf_counter() - start
+
+    clear = [(row, s) for row, s in zip(rows, screenings) if s.clear]
+    # rows whose risk the LLM wasn't asked for say nothing about the flags
+    rated = [(row, s) for row, s in zip(rows, screenings) if row.get("risk")]
+    worded = [(row, s) for row, s in rated if s.risk]
+    high = [row["risk"] == "high" for row, _ in rated]
+    flagged = [s.high_risk for _, s in rated]
+    true_flags = sum(h and f for h, f in zip(high, flagged))
+    ordered = sorted(single)
+    return {
+        "messages": len(rows),
+        "clear_cut": len(clear) / len(rows),
+        "concern_accuracy_clear": sum(r["concern"] == s.concern for r, s in clear) / len(clear) if clear else 0.0,
+        "risk_labelled": len(worded) / len(rows),
+        "risk_accuracy": sum(r["risk"] == s.risk for r, s in worded) / len(worded) if worded else 0.0,
+        "concern_accuracy_all": sum(r["concern"] == s.concern for r, s in zip(rows, screenings)) / len(rows),
+        "high_risk_recall": true_flags / sum(high) if any(high) else 1.0,
+        "high_risk_precision": true_flags / sum(flagged) if any(flagged) else 1.0,
+        "p50_us": ordered[len(ordered) // 2] * 1e6,
+        "p99_us": ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))] * 1e6,
+        "batch_msgs_per_sec": len(rows) / batch_seconds,
+    }
+
+
+def report(name, m):
+    print(f"\n{name}")
+    print(f"  {'clear-cut, labelled locally':<34}{m['clear_cut']:>8.0%} of {m['messages']}")
+    print(f"  {'concern accuracy (clear-cut)':<34}{m['concern_accuracy_clear']:>8.0%}")
+    print(f"  {'risk labelled from wording':<34}{m['risk_labelled']:>8.0%}, {m['risk_accuracy']:.0%} accurate")
+    print(f"  {'concern accuracy (all, argmax)':<34}{m['concern_accuracy_all']:>8.0%}")
+    print(f"  {'high-risk recall / precision':<34}{m['high_risk_recall']:>8.0%} / {m['high_risk_precision']:.0%}")
+    print(f"  {'latency p50 / p99':<34}{m['p50_us']:>6.0f} us / {m['p99_us']:.0f} us")
+    print(f"  {'batched throughput':<34}{m['batch_msgs_per_sec']:>8.0f} msgs/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", help="JSONL of {text, concern, risk} rows labelled by the LLM")
+    parser.add_argument("--live", action="store_true", help="label the messages with the configured LLM now")
+    parser.add_argument("--concurrency", type=int, default=4, help="LLM calls in flight with --live")
+    parser.add_argument("--train-split", type=float, default=None, help="fraction of rows to train the model on")
+    parser.add_argument("--threshold", type=float, default=None, help="override RISK_CLASSIFIER_THRESHOLD")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threshold is not None:
+        risk_classifier.CLASSIFIER_THRESHOLD = args.threshold
+    rows = load_rows(args)
+    if args.live:
+        rows, latencies = asyncio.run(live_labels(rows, args.concurrency))
+        print(f"LLM labelling: p50 {statistics.median(latencies) * 1000:.0f} ms, "
+              f"max {max(latencies) * 1000:.0f} ms per message")
+    print(f"{len(rows)} labelled messages, threshold {risk_classifier.CLASSIFIER_THRESHOLD}")
+
+    if args.train_split:
+        random.Random(args.seed).shuffle(rows)
+        cut = int(len(rows) * args.train_split)
+        train, test = rows[:cut], rows[cut:]
+        model = ConcernModel().fit([r["text"] for r in train], [r["concern"] for r in train])
+        report(f"lexicon only ({len(test)} held-out)", evaluate(test, False))
+        report(f"lexicon + model (trained on {len(train)})", evaluate(test, model))
+    else:
+        # the model saved at RISK_MODEL_PATH, if one was trained
+        report("lexicon" + (" + saved model" if risk_classifier.get_model() else " only"),
+               evaluate(rows, risk_classifier.get_model()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Class roster onboarding: one /auth/register call per student against the bulk import.
+
+Generates a CSV roster of --students students and onboards it twice against in-memory
+collections that wait --rtt seconds per Mongo operation (see bench_register.py):
+"register" creates each account the way /auth/register does, --concurrency at a time,
+hashing on the login pool; "roster" streams the CSV through app.services.roster, hashing
+on the bulk process pool and writing with insert_many per chunk.
+
+Usage (from ai-learning-backend/):
+    python -m benchmarks.bench_roster --students 500 --rtt 0.02
+    python -m benchmarks.bench_roster --students 500 --rounds 12 --workers 8
+"""
+import os
+import time
+import asyncio
+import argparse
+
+
+def roster_csv(students) -> bytes:
+    lines = ["name,username,email,password,grade_level"]
+    lines += [f"Student {i},student{i},student{i}@school.example.com,pass-{i}-word,7" for i in range(students)]
+    return "\n".join(lines).encode()
+
+
+async def chunks(data, size=1 << 14):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def register_each(students, concurrency):
+    from app.authentication.accounts import create_account
+    from app.authentication.passwords import hash_pool
+    from app.model.user_model import UserCreate
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        user = UserCreate(name=f"Student {i}", username=f"student{i}",
+                          email=f"student{i}@school.example.com", password=f"pass-{i}-word", grade_level="7")
+        async with semaphore:
+            await create_account(user, await hash_pool.hash(user.password))
+
+    await asyncio.gather(*(one(i) for i in range(students)))
+    return {"created": students}
+
+
+async def run(mode, args):
+    from benchmarks.bench_register import install_collections
+    from app.services.roster import import_roster
+
+    counter = install_collections(args.rtt)
+    start = time.perf_counter()
+    if mode == "register":
+        report = await register_each(args.students, args.concurrency)
+    else:
+        report = await import_roster(chunks(roster_csv(args.students)), "csv", args.chunk_size)
+    return time.perf_counter() - start, report["created"], counter["round_trips"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=500)
+    parser.add_argument("--rtt", type=float, default=0.02, help="seconds per Mongo round trip")
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt cost")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="hashing workers of both pools")
+    parser.add_argument("--concurrency", type=int, default=8, help="registrations in flight in register mode")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--modes", default="register,roster")
+    args = parser.parse_args()
+
+    # read when the passwords module is imported, also by the process pool workers
+    os.environ.update({
+        "GROQ_API_KEY_TEST": os.environ.get("GROQ_API_KEY_TEST", "offline-benchmark"),
+        "BCRYPT_ROUNDS": str(args.rounds),
+        "PASSWORD_HASH_WORKERS": str(args.workers),
+        "PASSWORD_HASH_MAX_PENDING": str(args.students),
+        "BULK_HASH_WORKERS": str(args.workers),
+    })
+    from app.authentication.passwords import bulk_hash_pool, hash_pool
+
+    print(f"{args.students} students, bcrypt cost {args.rounds}, {args.workers} hashing workers, "
+          f"{args.rtt * 1000:.0f} ms per round trip")
+    print(f"  {'mode':<10}{'seconds':>9}{'students/s':>12}{'created':>9}{'Mongo ops':>11}")
+    for mode in args.modes.split(","):
+        elapsed, created, trips = asyncio.run(run(mode, args))
+        print(f"  {mode:<10}{elapsed:>9.2f}{created / elapsed:>12.1f}{created:>9}{trips:>11}")
+    hash_pool.shutdown()
+    bulk_hash_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
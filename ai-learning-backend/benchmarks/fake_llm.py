@@ -0,0 +1,116 @@
+"""
+Deterministic offline chat model for the benchmarks.
+
+FakeChatModel is a real LangChain chat model, so callbacks and graph events behave
+like they do with the providers, but replies are fixed functions of the prompt and
+latencies are drawn from a seeded distribution:
+
+    fixed:0.2             always 200 ms
+    uniform:0.1:0.4       uniform between 100 and 400 ms
+    lognormal:0.2:0.5     median 200 ms, sigma 0.5 (a long right tail like real APIs)
+
+plus an optional tail, e.g. tail=(0.01, 2.0) adds 2 s to 1% of the calls.
+"""
+import json
+import math
+import random
+import asyncio
+from collections import Counter
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+from app.services.chatbot.agent_chatbot import AGE_DIMENSIONS
+from app.services.chatbot.rate_limiter import current_llm_user
+
+CATEGORIES = [(9, "child"), (15, "teen"), (21, "young_adult"), (34, "adult")]
+CONCERNS = ["anxiety", "stress", "relationships", "academic", "family"]
+
+
+def parse_latency(spec: str):
+    """Turns a latency spec into a function of a random.Random that returns seconds."""
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda rng: args[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(args[0]), args[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def _pick(prompt: str, options: list):
+    # str hashes are salted per process, this isn't
+    return options[sum(prompt.encode()) % len(options)]
+
+
+def fake_reply(prompt: str) -> str:
+    """Reply in the format the node that sent the prompt expects."""
+    if "question bank" in prompt:
+        return json.dumps({"questions": [
+            {"dimension": d, "level": level, "question": f"Can you tell me about a time {d} mattered to you ({level})?"}
+            for d in AGE_DIMENSIONS
+            for level in ("basic", "advanced")
+        ]})
+    if "QUESTION:" in prompt:
+        return "QUESTION: What would you do if a friend broke a promise to you?"
+    if "estimated_age" in prompt:
+        age, category = _pick(prompt, CATEGORIES)
+        concern = _pick(prompt, CONCERNS)
+        return json.dumps({
+            "estimated_age": age, "confidence": 7, "category": category,
+            "indicators": ["reasoning", "emotional maturity", "decision patterns"],
+            "urgency_score": 4, "primary_concern": concern, "emotional_state": "worried but coping",
+            "risk_level": "low", "needs_immediate_help": False,
+        })
+    if "running summary" in prompt:
+        return "The user talked about stress at school and at home and wants to feel less alone."
+    return ("That sounds really hard, and it makes sense that you feel this way. "
+            "Can you tell me a bit more about when it started and what helps, even a little?")
+
+
+class FakeChatModel(BaseChatModel):
+    latency: str = "fixed:0.2"
+    tail: Optional[tuple] = None
+    seed: int = 0
+
+    _rng: random.Random = PrivateAttr()
+    _sample: Any = PrivateAttr()
+    _calls: Counter = PrivateAttr()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._rng = random.Random(self.seed)
+        self._sample = parse_latency(self.latency)
+        self._calls = Counter()
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    @property
+    def calls(self) -> Counter:
+        """LLM calls per user, as charged by the rate limiter."""
+        return self._calls
+
+    def next_latency(self) -> float:
+        seconds = self._sample(self._rng)
+        if self.tail and self._rng.random() < self.tail[0]:
+            seconds += self.tail[1]
+        return seconds
+
+    def _respond(self, messages: List[BaseMessage]) -> ChatResult:
+        self._calls[current_llm_user.get()] += 1
+        reply = fake_reply(messages[-1].content if messages else "")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=reply))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        raise NotImplementedError("FakeChatModel is async only, use ainvoke")
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.next_latency())
+        return self._respond(messages)
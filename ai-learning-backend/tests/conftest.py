@@ -0,0 +1,28 @@
+import os
+
+# set before the app modules read them at import time
+os.environ.setdefault("GROQ_API_KEY_TEST", "test")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("CHAT_CHECKPOINTER", "memory")
+os.environ.setdefault("LLM_CACHE_PERSIST", "0")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from app import mongo_db
+from app.authentication import accounts
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A mongomock database standing in for Atlas, wired into app.mongo_db."""
+    database = AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(mongo_db, "get_mongo_connection", lambda: database)
+    for name, collection in (("user_collection", "users"), ("user_profiles", "user_profiles"),
+                             ("user_courses", "user_courses"), ("user_progress", "user_progress")):
+        monkeypatch.setattr(mongo_db, name, database[collection], raising=False)
+    # ensure_user_indexes fills it in for the test that builds them
+    monkeypatch.setattr(accounts, "indexed_fields", set())
+    return database
@@ -0,0 +1,73 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import mongo_db
+from app.authentication import accounts
+from app.authentication.accounts import AccountExists, create_account, duplicate_field, ensure_user_indexes
+
+COMPANIONS = ("user_profiles", "user_courses", "user_progress")
+
+
+def student(email="ada@example.com", username="ada"):
+    return SimpleNamespace(email=email, username=username, name="Ada Lovelace")
+
+
+def counts(db):
+    async def scenario():
+        return {name: await db[name].count_documents({}) for name in ("users",) + COMPANIONS}
+
+    return asyncio.run(scenario())
+
+
+@pytest.fixture
+def indexed(db):
+    asyncio.run(ensure_user_indexes())
+    assert accounts.indexed_fields == {"email", "username"}
+    return db
+
+
+def test_account_comes_with_its_companions(indexed):
+    user = asyncio.run(create_account(student(), "hash"))
+    assert counts(indexed) == {"users": 1, "user_profiles": 1, "user_courses": 1, "user_progress": 1}
+    profile = asyncio.run(indexed.user_profiles.find_one())
+    assert profile["user_id"] == user["_id"]
+
+
+@pytest.mark.parametrize("second, field", [
+    (student(username="ada2"), "email"),
+    (student(email="ada2@example.com"), "username"),
+])
+def test_duplicate_key_cleans_up_the_companions(indexed, second, field):
+    asyncio.run(create_account(student(), "hash"))
+    with pytest.raises(AccountExists) as e:
+        asyncio.run(create_account(second, "hash"))
+    assert e.value.field == field
+    # the companions of the refused account went again
+    assert counts(indexed) == {"users": 1, "user_profiles": 1, "user_courses": 1, "user_progress": 1}
+
+
+def test_without_an_index_taken_values_are_looked_up(db):
+    asyncio.run(create_account(student(), "hash"))
+    with pytest.raises(AccountExists) as e:
+        asyncio.run(create_account(student(email="ada2@example.com"), "hash"))
+    assert e.value.field == "username"
+    assert counts(db)["user_profiles"] == 1
+
+
+def test_failed_companion_takes_the_user_back_out(indexed, monkeypatch):
+    async def broken(doc):
+        raise ConnectionError("mongo went away")
+
+    monkeypatch.setattr(mongo_db.user_courses, "insert_one", broken)
+    with pytest.raises(ConnectionError):
+        asyncio.run(create_account(student(), "hash"))
+    assert counts(indexed) == {"users": 0, "user_profiles": 0, "user_courses": 0, "user_progress": 0}
+
+
+def test_duplicate_field_from_error_details():
+    assert duplicate_field({"keyPattern": {"username": 1}}) == "username"
+    assert duplicate_field({"keyValue": {"email": "ada@example.com"}}) == "email"
+    # older servers only name the index
+    assert duplicate_field({}, "E11000 duplicate key error index: username_1") == "username"
@@ -0,0 +1,72 @@
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.chatbot import agent_chatbot
+from app.services.chatbot.agent_chatbot import apply_screening
+from app.services.chatbot.risk_classifier import Screening
+from app.services.chatbot.structured_output import AssessmentResult
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    """Prompts sent to the LLM, answered from calls.replies in turn."""
+    calls = SimpleNamespace(prompts=[], replies=[])
+
+    async def invoke(prompt):
+        calls.prompts.append(prompt)
+        return SimpleNamespace(content=calls.replies[len(calls.prompts) - 1])
+
+    monkeypatch.setattr(agent_chatbot, "safe_invoke", invoke)
+    return calls
+
+
+def reply(**fields):
+    return json.dumps({"estimated_age": 13, "confidence": 6, "category": "teen", "indicators": ["plans ahead"],
+                       "urgency_score": 3, "primary_concern": "academic", "risk_level": "low",
+                       "emotional_state": "tired", "needs_immediate_help": False, **fields})
+
+
+def assess(message, **values):
+    state = {"first_user_message": message, "age_answers": ["I would wait for the bigger one"],
+             "conversation_history": [], **values}
+    return asyncio.run(agent_chatbot.assessment_node(state))
+
+
+def test_age_and_mental_state_come_from_one_call(llm_calls):
+    llm_calls.replies = [reply()]
+    state = assess("I feel a bit off lately")
+    assert len(llm_calls.prompts) == 1
+    assert (state["estimated_age"], state["age_category"], state["primary_concern"]) == (13, "teen", "academic")
+    assert state["age_indicators"] == ["plans ahead"] and state["assessment_score"] == 3
+    assert state["age_assessment_complete"] and state["mental_assessment_complete"]
+    assert state["llm_primary_concern"] == "academic" and state["llm_risk_level"] == "low"
+
+
+def test_risky_wording_is_not_asked_for_and_wins(llm_calls):
+    llm_calls.replies = [reply(risk_level="low")]
+    state = assess("exams are too much, I want to die")
+    assert '"risk_level"' not in llm_calls.prompts[0]
+    assert "risk level is already known: high" in llm_calls.prompts[0]
+    assert state["risk_level"] == "high" and state["llm_risk_level"] is None
+
+
+def test_unreadable_replies_fall_back_to_defaults(llm_calls):
+    llm_calls.replies = ["I'd rather not say.", "Still no."]
+    state = assess("I feel a bit off lately")
+    # asked once more, then the defaults
+    assert len(llm_calls.prompts) == 2
+    assert (state["estimated_age"], state["age_category"]) == (15, "teen")
+    assert state["llm_primary_concern"] is None and state["mental_assessment_complete"]
+
+
+def test_screening_floors_but_never_lowers_risk():
+    medium = Screening("stress", 0.5, risk="medium")
+    assert apply_screening(AssessmentResult(risk_level="low"), medium).risk_level == "medium"
+    assert apply_screening(AssessmentResult(risk_level="high"), medium).risk_level == "high"
+    raised = apply_screening(AssessmentResult(risk_level="low"), Screening("general", 0.3), prior_risk="high")
+    assert raised.risk_level == "high" and raised.needs_immediate_help
+    clear = apply_screening(AssessmentResult(primary_concern="general"), Screening("family", 0.9, clear=True))
+    assert clear.primary_concern == "family"
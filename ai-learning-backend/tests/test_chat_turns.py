@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from app.router import chatbot
+from app.router.chatbot import ChatStage, claim_turn, run_chat_turn, save_turn_state
+
+
+@pytest.fixture
+def session(db):
+    asyncio.run(db.chat_sessions.insert_one(
+        {"user_id": "u1", "current_stage": ChatStage.ASSESSMENT_IN_PROGRESS, "version": 3}
+    ))
+    return db
+
+
+def stored(db):
+    return asyncio.run(db.chat_sessions.find_one({"user_id": "u1"}))
+
+
+def test_turn_claims_the_session_before_it_runs(session, monkeypatch):
+    seen = []
+
+    async def run_turn(user_id, text, legacy_state=None):
+        seen.append(await session.chat_sessions.find_one({"user_id": user_id}))
+        return {"current_response": "hello", "final_guidance": "take care"}
+
+    monkeypatch.setattr(chatbot, "run_turn", run_turn)
+    response = asyncio.run(run_chat_turn(session, "u1", "hi"))
+    assert response.stage == ChatStage.ASSESSMENT_COMPLETED
+    # the graph ran on a session already claimed at the next version
+    assert seen[0]["version"] == 4 and seen[0]["turn_until"] is not None
+    doc = stored(session)
+    assert doc["version"] == 4 and "turn_until" not in doc
+    assert doc["current_stage"] == ChatStage.ASSESSMENT_COMPLETED
+
+
+def test_stale_turn_is_rejected_before_the_graph_runs(session):
+    async def scenario():
+        await claim_turn(session, "u1", 3)
+        with pytest.raises(HTTPException) as e:
+            await claim_turn(session, "u1", 3)
+        return e.value
+
+    assert asyncio.run(scenario()).status_code == 409
+
+
+def test_turn_held_elsewhere_is_rejected_until_saved(session):
+    async def scenario():
+        version = await claim_turn(session, "u1", 3)
+        # another worker read the claimed version while the turn runs
+        with pytest.raises(HTTPException):
+            await claim_turn(session, "u1", version)
+        await save_turn_state(session, "u1", {}, version)
+        return await claim_turn(session, "u1", version)
+
+    assert asyncio.run(scenario()) == 5
+
+
+def test_expired_claim_can_be_taken_over(session):
+    async def scenario():
+        version = await claim_turn(session, "u1", 3)
+        past = datetime.now(timezone.utc) - timedelta(seconds=1)
+        await session.chat_sessions.update_one({"user_id": "u1"}, {"$set": {"turn_until": past}})
+        return await claim_turn(session, "u1", version)
+
+    assert asyncio.run(scenario()) == 5
+
+
+def test_failed_turn_releases_the_session(session, monkeypatch):
+    async def run_turn(user_id, text, legacy_state=None):
+        raise RuntimeError("LLM down")
+
+    monkeypatch.setattr(chatbot, "run_turn", run_turn)
+    with pytest.raises(RuntimeError):
+        asyncio.run(run_chat_turn(session, "u1", "hi"))
+    doc = stored(session)
+    assert doc["version"] == 4 and doc.get("turn_until") is None
+    assert doc["current_stage"] == ChatStage.ASSESSMENT_IN_PROGRESS
+
+
+def test_sessions_from_before_versioning_can_be_claimed(db):
+    asyncio.run(db.chat_sessions.insert_one({"user_id": "u1", "current_stage": ChatStage.ASSESSMENT_IN_PROGRESS}))
+    assert asyncio.run(claim_turn(db, "u1", 0)) == 1
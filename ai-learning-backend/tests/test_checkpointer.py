@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+from langgraph.checkpoint.base import empty_checkpoint
+
+from app.services.chatbot.checkpointer import CheckpointConflict, MongoSaver
+
+
+class Spy:
+    """Records the updates sent to the collection and passes everything through."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.updates = []
+
+    async def update_one(self, query, update, **kwargs):
+        self.updates.append((query, update))
+        return await self.collection.update_one(query, update, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+@pytest.fixture
+def spy(db):
+    return Spy(db["chat_checkpoints"])
+
+
+@pytest.fixture
+def saver(spy):
+    return MongoSaver(lambda: spy)
+
+
+CONFIG = {"configurable": {"thread_id": "t1", "checkpoint_ns": ""}}
+
+
+def message(n, text=None):
+    return {"role": "user" if n % 2 else "assistant", "content": text or f"message {n}"}
+
+
+def put(saver, history, **values):
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"conversation_history": history, **values}
+    versions = {channel: 1 for channel in checkpoint["channel_values"]}
+    return asyncio.run(saver.aput(CONFIG, checkpoint, {}, versions))
+
+
+def stored(saver):
+    return asyncio.run(saver.aget_tuple(CONFIG)).checkpoint["channel_values"]
+
+
+def last_update(spy):
+    return spy.updates[-1][1]
+
+
+def test_growing_history_pushes_only_new_messages(saver, spy):
+    history = [message(i) for i in range(4)]
+    put(saver, history, user_input="hi")
+    assert last_update(spy)["$set"]["values.conversation_history"] == history
+
+    put(saver, history + [message(4), message(5)], user_input="again")
+    update = last_update(spy)
+    assert update["$push"]["values.conversation_history"]["$each"] == [message(4), message(5)]
+    assert "values.conversation_history" not in update["$set"]
+    assert update["$set"]["values.user_input"] == "again"
+    assert stored(saver)["conversation_history"] == history + [message(4), message(5)]
+
+
+def test_compacted_history_is_rewritten(saver, spy):
+    history = [message(i) for i in range(6)]
+    put(saver, history)
+    put(saver, history[-2:] + [message(6)])
+    update = last_update(spy)
+    assert "$push" not in update
+    assert stored(saver)["conversation_history"] == history[-2:] + [message(6)]
+
+
+def test_edited_last_message_of_a_longer_list_is_rewritten(saver, spy):
+    history = [message(i) for i in range(4)]
+    put(saver, history)
+    # one longer, but the last stored message changed
+    edited = history[:-1] + [message(3, "edited"), message(4)]
+    put(saver, edited)
+    assert "$push" not in last_update(spy)
+    assert stored(saver)["conversation_history"] == edited
+
+
+def test_put_only_hashes_the_new_messages(saver, monkeypatch):
+    history = [message(i) for i in range(50)]
+    put(saver, history)
+    hashed = []
+    digest = saver._digest
+    monkeypatch.setattr(saver, "_digest", lambda item, seed=0: hashed.append(item) or digest(item, seed))
+    put(saver, history + [message(50), message(51)])
+    # the stored last message, then the two new ones (and the new last one again)
+    assert len(hashed) == 4
+
+
+def test_evicted_thread_is_written_in_full(db, spy):
+    saver = MongoSaver(lambda: spy, max_lists=1)
+    history = [message(i) for i in range(3)]
+    put(saver, history)
+    other = {"configurable": {"thread_id": "t2", "checkpoint_ns": ""}}
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"conversation_history": [message(0)]}
+    asyncio.run(saver.aput(other, checkpoint, {}, {"conversation_history": 1}))
+    assert len(saver.lengths) == 1
+
+    put(saver, history + [message(3)])
+    assert "$push" not in last_update(spy)
+    put(saver, history + [message(3), message(4)])
+    assert last_update(spy)["$push"]["values.conversation_history"]["$each"] == [message(4)]
+    assert stored(saver)["conversation_history"] == history + [message(3), message(4)]
+
+
+def test_list_saved_with_an_old_digest_is_rewritten_once(db, saver, spy):
+    history = [message(i) for i in range(3)]
+    put(saver, history)
+    asyncio.run(db["chat_checkpoints"].update_one({}, {"$set": {"digests.conversation_history": "0123abcd"}}))
+    fresh = MongoSaver(lambda: spy)
+    assert stored(fresh)["conversation_history"] == history
+    put(fresh, history + [message(3)])
+    assert "$push" not in last_update(spy)
+    put(fresh, history + [message(3), message(4)])
+    assert last_update(spy)["$push"]["values.conversation_history"]["$each"] == [message(4)]
+
+
+def test_unchanged_history_writes_nothing_for_it(saver, spy):
+    history = [message(i) for i in range(3)]
+    put(saver, history)
+    put(saver, list(history), user_input="x")
+    update = last_update(spy)
+    assert "$push" not in update and "values.conversation_history" not in update["$set"]
+    assert stored(saver)["conversation_history"] == history
+
+
+def test_concurrent_writer_is_not_overwritten(db, saver, spy):
+    history = [message(i) for i in range(3)]
+    put(saver, history)
+    # another worker appended to the same thread
+    other = MongoSaver(lambda: db["chat_checkpoints"])
+    asyncio.run(other.aget_tuple(CONFIG))
+    put(other, history + [message(10)])
+
+    with pytest.raises(CheckpointConflict):
+        put(saver, history + [message(3)])
+    assert stored(MongoSaver(lambda: db["chat_checkpoints"]))["conversation_history"] == history + [message(10)]
+    # once it read the other worker's state again, the saver appends to it
+    assert stored(saver)["conversation_history"] == history + [message(10)]
+    put(saver, history + [message(10), message(11)])
+    assert last_update(spy)["$push"]["values.conversation_history"]["$each"] == [message(11)]
+
+
+def test_restarted_saver_appends_after_loading(db, spy):
+    history = [message(i) for i in range(3)]
+    put(MongoSaver(lambda: spy), history)
+    fresh = MongoSaver(lambda: spy)
+    assert stored(fresh)["conversation_history"] == history
+    put(fresh, history + [message(3)])
+    assert last_update(spy)["$push"]["values.conversation_history"]["$each"] == [message(3)]
@@ -0,0 +1,227 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from app.services import jobs
+from app.services.jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, MemoryJobBackend, MongoJobBackend
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    registered = {}
+    monkeypatch.setattr(jobs, "HANDLERS", registered)
+    return registered
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def wait_for(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not await predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_memory_backend_runs_lower_priority_first(handlers):
+    order = []
+
+    async def record(payload):
+        order.append(payload["n"])
+        return payload["n"]
+
+    handlers["record"] = record
+
+    async def scenario():
+        queue = JobQueue(MemoryJobBackend(), workers=1)
+        ids = [await queue.submit("record", {"n": n}, priority=p) for n, p in ((1, 10), (2, 0), (3, 5))]
+        queue.start()
+        await wait_for(lambda: _all_finished(queue, ids))
+        await queue.stop()
+        return [await queue.get(i) for i in ids]
+
+    finished = run(scenario())
+    assert order == [2, 3, 1]
+    assert all(job["status"] == SUCCEEDED and "payload" not in job for job in finished)
+
+
+async def _all_finished(queue, ids):
+    for job_id in ids:
+        if (await queue.get(job_id))["status"] not in jobs.FINISHED:
+            return False
+    return True
+
+
+def test_submit_rejects_when_queue_full(handlers):
+    handlers["noop"] = lambda payload: None
+
+    async def scenario():
+        queue = JobQueue(MemoryJobBackend(), workers=1, max_queued=1)
+        await queue.submit("noop", {})
+        with pytest.raises(jobs.QueueFull):
+            await queue.submit("noop", {})
+        return queue.stats
+
+    assert run(scenario())["rejected"] == 1
+
+
+def test_failed_handler_is_recorded(handlers):
+    async def broken(payload):
+        raise ValueError("boom")
+
+    handlers["broken"] = broken
+
+    async def scenario():
+        queue = JobQueue(MemoryJobBackend(), workers=1)
+        job_id = await queue.submit("broken", {})
+        queue.start()
+        await wait_for(lambda: _all_finished(queue, [job_id]))
+        await queue.stop()
+        return await queue.get(job_id)
+
+    job = run(scenario())
+    assert job["status"] == FAILED and job["error"] == "boom"
+
+
+def test_mongo_claim_takes_priority_order_and_expired_leases(db):
+    async def scenario():
+        backend = MongoJobBackend()
+        now = jobs._now()
+        await backend.put({"id": "bulk", "status": QUEUED, "priority": 10, "created_at": now})
+        await backend.put({"id": "chat", "status": QUEUED, "priority": 0, "created_at": now})
+        first = await backend.claim("w1")
+        second = await backend.claim("w1")
+        # w1 went away, its lease ran out
+        await db["jobs"].update_one({"_id": "bulk"}, {"$set": {"lease_until": now - timedelta(seconds=1)}})
+        third = await backend.claim("w2")
+        return first, second, third
+
+    first, second, third = run(scenario())
+    assert first["id"] == "chat"
+    assert second["id"] == "bulk"
+    assert third["id"] == "bulk" and third["worker"] == "w2"
+
+
+def test_mongo_renew_and_finish_only_for_the_lease_holder(db):
+    async def scenario():
+        backend = MongoJobBackend()
+        await backend.put({"id": "j", "status": QUEUED, "priority": 5, "created_at": jobs._now()})
+        await backend.claim("w1")
+        # w2 took the job over after w1's lease expired
+        await db["jobs"].update_one({"_id": "j"}, {"$set": {"worker": "w2"}})
+        renewed = await backend.renew("j", "w1")
+        stale_finish = await backend.finish("j", SUCCEEDED, result="w1", worker_id="w1")
+        finish = await backend.finish("j", SUCCEEDED, result="w2", worker_id="w2")
+        return renewed, stale_finish, finish, await backend.get("j")
+
+    renewed, stale_finish, finish, job = run(scenario())
+    assert not renewed and not stale_finish and finish
+    assert job["result"] == "w2"
+
+
+def test_long_job_keeps_its_lease(db, handlers):
+    async def slow(payload):
+        await asyncio.sleep(0.3)
+        return "done"
+
+    handlers["slow"] = slow
+
+    async def scenario():
+        backend = MongoJobBackend()
+        queue = JobQueue(backend, workers=1, lease_seconds=0.15)
+        job_id = await queue.submit("slow", {})
+        queue.start()
+        await wait_for(lambda: _is_running(backend, job_id))
+        # past the initial lease, a second worker must not be able to claim it
+        await asyncio.sleep(0.2)
+        stolen = await db["jobs"].find_one({"_id": job_id, "lease_until": {"$lt": jobs._now()}})
+        await wait_for(lambda: _all_finished(queue, [job_id]))
+        await queue.stop()
+        return stolen, await queue.get(job_id)
+
+    stolen, job = run(scenario())
+    assert stolen is None
+    assert job["status"] == SUCCEEDED and job["result"] == "done"
+
+
+async def _is_running(backend, job_id):
+    return (await backend.get(job_id))["status"] == RUNNING
+
+
+def test_lost_lease_stops_the_handler(db, handlers):
+    async def slow(payload):
+        await asyncio.sleep(5)
+
+    handlers["slow"] = slow
+
+    async def scenario():
+        backend = MongoJobBackend()
+        queue = JobQueue(backend, workers=1, lease_seconds=0.06)
+        job_id = await queue.submit("slow", {})
+        queue.start()
+        await wait_for(lambda: _is_running(backend, job_id))
+        await db["jobs"].update_one({"_id": job_id}, {"$set": {"worker": "other"}})
+        await wait_for(lambda: _stat(queue, "leases_lost"))
+        await queue.stop()
+        return await queue.get(job_id)
+
+    job = run(scenario())
+    # left to the worker that holds it
+    assert job["status"] == RUNNING and job["worker"] == "other"
+
+
+async def _stat(queue, name):
+    return queue.stats[name] > 0
+
+
+def test_failing_finish_keeps_the_worker(handlers):
+    handlers["ok"] = lambda payload: asyncio.sleep(0, "ok")
+
+    class FlakyBackend(MemoryJobBackend):
+        calls = 0
+
+        async def finish(self, *args, **kwargs):
+            FlakyBackend.calls += 1
+            if FlakyBackend.calls == 1:
+                raise ConnectionError("mongo went away")
+            return await super().finish(*args, **kwargs)
+
+    async def scenario():
+        queue = JobQueue(FlakyBackend(), workers=1)
+        first = await queue.submit("ok", {})
+        second = await queue.submit("ok", {})
+        queue.start()
+        await wait_for(lambda: _all_finished(queue, [second]))
+        alive = not queue.tasks[0].done()
+        await queue.stop()
+        return queue.stats, alive, await queue.get(first)
+
+    stats, alive, first = run(scenario())
+    assert alive and stats["finish_errors"] == 1 and stats["succeeded"] == 1
+    assert first["status"] == RUNNING
+
+
+
+def test_unpolled_results_expire_as_jobs_come_and_go(handlers, monkeypatch):
+    async def noop(payload):
+        return None
+
+    handlers["noop"] = noop
+
+    async def scenario():
+        backend = MemoryJobBackend()
+        queue = JobQueue(backend, workers=1)
+        queue.start()
+        first = await queue.submit("noop", {})
+        await wait_for(lambda: _all_finished(queue, [first]))
+        assert first in backend.jobs
+        # nobody polls the first job, once its result is past the TTL the next submit drops it
+        later = jobs._now() + timedelta(seconds=jobs.JOB_RESULT_TTL + 1)
+        monkeypatch.setattr(jobs, "_now", lambda: later)
+        second = await queue.submit("noop", {})
+        await queue.stop()
+        return first in backend.jobs, second in backend.jobs
+
+    assert run(scenario()) == (False, True)
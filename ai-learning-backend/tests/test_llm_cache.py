@@ -0,0 +1,106 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.chatbot import agent_chatbot, llm_cache
+from app.services.chatbot.llm_cache import LLMResponseCache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    fresh = LLMResponseCache(persist=False)
+    monkeypatch.setattr(llm_cache, "response_cache", fresh)
+    return fresh
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    prompts = []
+
+    async def invoke(prompt):
+        prompts.append(prompt)
+        return SimpleNamespace(content=f"reply {len(prompts)}")
+
+    monkeypatch.setattr(agent_chatbot, "safe_invoke", invoke)
+    return prompts
+
+
+def guidance_state(**values):
+    return {"age_category": "teen", "estimated_age": 14, "assessment_score": 4, "primary_concern": "academic",
+            "risk_level": "low", "emotional_state": "worried", "conversation_history": [], **values}
+
+
+def test_guidance_is_not_shared_between_ages(cache, llm_calls):
+    async def scenario():
+        first = await agent_chatbot.guidance_node(guidance_state())
+        same = await agent_chatbot.guidance_node(guidance_state(emotional_state="tired"))
+        older = await agent_chatbot.guidance_node(guidance_state(estimated_age=17))
+        return first["final_guidance"], same["final_guidance"], older["final_guidance"]
+
+    first, same, older = asyncio.run(scenario())
+    # the emotional state stays out of shared prompts, the age is in the prompt and so in the key
+    assert first == same == "reply 1"
+    assert older == "reply 2" and "age ~17" in llm_calls[1]
+
+
+def reply_after(delay, prompts):
+    async def invoke(prompt):
+        prompts.append(prompt)
+        await asyncio.sleep(delay)
+        return SimpleNamespace(content=f"reply {len(prompts)}")
+    return invoke
+
+
+def test_repeated_prompt_is_a_hit(cache):
+    prompts = []
+
+    async def scenario():
+        first = await llm_cache.cached_call("follow_up", "Ask  about School", reply_after(0, prompts))
+        # whitespace and case don't make a new prompt
+        again = await llm_cache.cached_call("follow_up", "ask about school", reply_after(0, prompts))
+        return first.content, again.content
+
+    assert asyncio.run(scenario()) == ("reply 1", "reply 1")
+    assert len(prompts) == 1 and cache.stats["hits"] == 1
+
+
+def test_concurrent_misses_share_one_call(cache):
+    prompts = []
+
+    async def scenario():
+        calls = [llm_cache.cached_call("follow_up", "same prompt", reply_after(0.05, prompts)) for _ in range(5)]
+        return [r.content for r in await asyncio.gather(*calls)]
+
+    assert asyncio.run(scenario()) == ["reply 1"] * 5
+    assert len(prompts) == 1 and cache.stats["coalesced"] == 4 and not cache.pending
+
+
+def test_nodes_that_did_not_opt_in_always_call(cache):
+    prompts = []
+
+    async def scenario():
+        for _ in range(2):
+            await llm_cache.cached_call("assessment", "same prompt", reply_after(0, prompts))
+
+    asyncio.run(scenario())
+    assert len(prompts) == 2 and cache.stats["misses"] == 0
+
+
+def test_fields_key_ignores_field_order_but_not_values():
+    key = llm_cache.fields_key("guidance", {"age_category": "teen", "risk_level": "low"})
+    assert key == llm_cache.fields_key("guidance", {"risk_level": "low", "age_category": "teen"})
+    assert key != llm_cache.fields_key("guidance", {"age_category": "teen", "risk_level": "high"})
+    assert key != llm_cache.fields_key("follow_up", {"age_category": "teen", "risk_level": "low"})
+
+
+def test_variants_are_collected_before_serving(cache):
+    cache.variants = 2
+    prompts = []
+
+    async def scenario():
+        return [(await llm_cache.cached_call("follow_up", "p", reply_after(0, prompts))).content for _ in range(4)]
+
+    served = asyncio.run(scenario())
+    assert served[:2] == ["reply 1", "reply 2"] and set(served[2:]) <= {"reply 1", "reply 2"}
+    assert len(prompts) == 2
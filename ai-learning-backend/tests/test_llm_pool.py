@@ -0,0 +1,102 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import llm_pool
+from app.services.llm_pool import Backend, LLMPool
+
+
+class ServerError(Exception):
+    def __init__(self, status):
+        super().__init__(f"status {status}")
+        self.status_code = status
+
+
+class FakeModel:
+    """Chat model answering with its name after `delay`, or raising `error`."""
+
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+
+    def model_copy(self, update=None):
+        return self
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return SimpleNamespace(content=self.name, usage_metadata={"input_tokens": 5, "output_tokens": 1})
+
+
+@pytest.fixture(autouse=True)
+def no_usage_writes(monkeypatch):
+    monkeypatch.setattr(llm_pool.usage_recorder, "persist", False)
+
+
+def pool(*models, **kwargs):
+    return LLMPool([Backend(m.name, m) for m in models], **kwargs)
+
+
+def test_server_error_fails_over_to_the_next_backend():
+    primary, fallback = FakeModel("primary", error=ServerError(503)), FakeModel("fallback")
+    llms = pool(primary, fallback)
+    assert asyncio.run(llms.ainvoke("hi")).content == "fallback"
+    health = llms.health()
+    assert health["primary"]["failovers"] == 1 and health["primary"]["consecutive_failures"] == 1
+    assert health["fallback"]["calls"] == 1
+
+
+def test_client_error_is_not_failed_over():
+    primary, fallback = FakeModel("primary", error=ServerError(400)), FakeModel("fallback")
+    with pytest.raises(ServerError):
+        asyncio.run(pool(primary, fallback).ainvoke("hi"))
+    assert fallback.calls == 0
+
+
+def test_failing_backend_cools_down():
+    primary, fallback = FakeModel("primary", error=ServerError(500)), FakeModel("fallback")
+    llms = pool(primary, fallback)
+    for _ in range(llm_pool.FAILURE_THRESHOLD):
+        asyncio.run(llms.ainvoke("hi"))
+    # skipped while it cools down, still there as a last resort
+    assert [b.name for b in llms.candidates()] == ["fallback", "primary"]
+    asyncio.run(llms.ainvoke("hi"))
+    assert primary.calls == llm_pool.FAILURE_THRESHOLD
+
+
+def test_every_backend_failing_raises_the_last_error():
+    llms = pool(FakeModel("a", error=ServerError(500)), FakeModel("b", error=ServerError(429)))
+    with pytest.raises(ServerError) as e:
+        asyncio.run(llms.ainvoke("hi"))
+    assert e.value.status_code == 429
+
+
+def test_slow_backend_is_hedged():
+    primary, fallback = FakeModel("primary", delay=0.5), FakeModel("fallback")
+    llms = pool(primary, fallback, hedge=True, hedge_after=0.02)
+    assert asyncio.run(llms.ainvoke("hi")).content == "fallback"
+    # the slower call is cancelled once the hedge answers
+    assert primary.cancelled and llms.health()["fallback"]["hedges"] == 1
+
+
+def test_fast_backend_is_not_hedged():
+    primary, fallback = FakeModel("primary"), FakeModel("fallback")
+    llms = pool(primary, fallback, hedge=True, hedge_after=0.2)
+    assert asyncio.run(llms.ainvoke("hi")).content == "primary"
+    assert fallback.calls == 0
+
+
+def test_failed_hedge_waits_for_the_primary():
+    primary, fallback = FakeModel("primary", delay=0.05), FakeModel("fallback", error=ServerError(502))
+    llms = pool(primary, fallback, hedge=True, hedge_after=0.01)
+    assert asyncio.run(llms.ainvoke("hi")).content == "primary"
@@ -0,0 +1,31 @@
+from app.router import metrics
+from app.services.chatbot import rate_limiter
+from app.services.telemetry import render_metrics
+
+
+def samples():
+    return [line for line in render_metrics().splitlines() if not line.startswith("#")]
+
+
+def test_limiter_amounts_have_metrics_of_their_own(monkeypatch):
+    monkeypatch.setattr(rate_limiter.limiter, "stats", {**rate_limiter.limiter.stats, "calls": 3, "wait_seconds": 1.5})
+    lines = samples()
+    assert 'llm_rate_limiter_total{stat="calls"} 3' in lines
+    assert "llm_rate_limiter_wait_seconds_total 1.5" in lines
+    assert not any(line.startswith("llm_rate_limiter_total") and "seconds" in line for line in lines)
+
+
+def test_counters_only_hold_counts():
+    stats = {
+        line.split('stat="')[1].split('"')[0] for line in samples()
+        if line.startswith(("llm_rate_limiter_total", "auth_user_cache_total", "auth_password_hashing_total"))
+    }
+    for stat in ("hit_ratio", "size", "pending", "queued", "workers", "tokens_short", "wait_seconds"):
+        assert stat not in stats and f"bulk_{stat}" not in stats, stat
+
+
+def test_hash_pools_are_a_label():
+    lines = samples()
+    assert {line.split(" ")[0] for line in lines if line.startswith("auth_password_hashing_workers")} == {
+        f'auth_password_hashing_workers{{pool="{pool}"}}' for pool in metrics.HASH_POOLS
+    }
@@ -0,0 +1,91 @@
+import time
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.main import app
+from app.authentication import passwords
+from app.authentication.passwords import HashPool, HashPoolBusy, build_context
+from app.authentication.routes import run_hash
+
+
+@pytest.fixture
+def pool():
+    pool = HashPool(workers=2, max_pending=4)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.fixture
+def stronger(monkeypatch):
+    """The configured bcrypt cost raised past the one the test hashes were made with."""
+    monkeypatch.setattr(passwords, "pwd_context", build_context("bcrypt", bcrypt_rounds=5))
+
+
+def old_hash(password, scheme="bcrypt"):
+    return build_context(scheme, bcrypt_rounds=4).hash(password)
+
+
+def test_lower_bcrypt_cost_is_rehashed(pool, stronger):
+    ok, new_hash = asyncio.run(pool.verify("secret", old_hash("secret")))
+    assert ok and new_hash.startswith("$2b$05$")
+    assert pool.stats["rehashes"] == 1
+
+
+def test_current_hash_is_left_alone(pool):
+    ok, new_hash = asyncio.run(pool.verify("secret", passwords.pwd_context.hash("secret")))
+    assert ok and new_hash is None
+
+
+def test_other_scheme_is_migrated(pool):
+    ok, new_hash = asyncio.run(pool.verify("secret", old_hash("secret", scheme="argon2")))
+    assert ok and new_hash.startswith("$2b$")
+
+
+def test_wrong_password_is_not_rehashed(pool, stronger):
+    assert asyncio.run(pool.verify("wrong", old_hash("secret"))) == (False, None)
+
+
+def test_hash_many_keeps_the_order(pool):
+    hashed = asyncio.run(pool.hash_many(["a", "b", "c"]))
+    assert [passwords.pwd_context.verify(p, h) for p, h in zip("abc", hashed)] == [True] * 3
+    assert pool.stats["hashes"] == 3 and pool.pending == 0
+
+
+def test_work_past_max_pending_is_refused(pool):
+    async def scenario():
+        slow = [asyncio.create_task(pool.run("hash", time.sleep, 0.1)) for _ in range(pool.max_pending)]
+        await asyncio.sleep(0)
+        with pytest.raises(HashPoolBusy):
+            await pool.run("hash", time.sleep, 0)
+        await asyncio.gather(*slow)
+        # room again once they are done
+        await pool.run("hash", time.sleep, 0)
+
+    asyncio.run(scenario())
+    assert pool.stats["rejected"] == 1
+
+
+def test_busy_pool_is_a_503_with_retry_after():
+    async def busy():
+        raise HashPoolBusy("64 password hashes already pending")
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(run_hash(busy))
+    assert e.value.status_code == 503 and e.value.headers["Retry-After"] == "2"
+
+
+def test_login_stores_the_upgraded_hash(db, stronger):
+    stored = old_hash("correct horse")
+    asyncio.run(db.users.insert_one({"email": "ada@example.com", "username": "ada", "hashed_password": stored}))
+
+    async def login():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/auth/login", json={"email": "ada@example.com", "password": "correct horse"})
+
+    assert asyncio.run(login()).status_code == 200
+    upgraded = asyncio.run(db.users.find_one({"email": "ada@example.com"}))["hashed_password"]
+    assert upgraded != stored and upgraded.startswith("$2b$05$")
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.chatbot import rate_limiter
+from app.services.chatbot.rate_limiter import MemoryBucketBackend, RateLimiter, llm_urgent
+
+
+class ProviderError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"status {status}")
+        self.response = SimpleNamespace(status_code=status, headers=headers or {})
+
+
+def limiter(**kwargs):
+    options = dict(rate_per_min=6000, burst=5, user_rate_per_min=6000, user_burst=5, max_retries=3, urgent_reserve=0)
+    return RateLimiter(MemoryBucketBackend(), **{**options, **kwargs})
+
+
+def flaky(*errors):
+    """Coroutine function raising the given errors in turn, then answering "ok"."""
+    calls = []
+
+    async def call():
+        calls.append(time.monotonic())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "ok"
+
+    return call, calls
+
+
+def test_bucket_grants_its_burst_then_asks_to_wait():
+    async def scenario():
+        backend = MemoryBucketBackend()
+        return [await backend.take("k", rate=10, capacity=2) for _ in range(3)]
+
+    granted, again, waits = asyncio.run(scenario())
+    assert granted == again == 0
+    # one token short at 10 a second
+    assert waits == pytest.approx(0.1, abs=0.01)
+
+
+def test_bucket_refills_over_time():
+    async def scenario():
+        backend = MemoryBucketBackend()
+        await backend.take("k", rate=100, capacity=1)
+        await asyncio.sleep(0.02)
+        return await backend.take("k", rate=100, capacity=1)
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_urgent_calls_may_use_the_reserve():
+    async def scenario():
+        backend = MemoryBucketBackend()
+        first = await backend.take("global", rate=1, capacity=2, reserve=1)
+        normal = await backend.take("global", rate=1, capacity=2, reserve=1)
+        urgent = await backend.take("global", rate=1, capacity=2, reserve=0)
+        return first, normal, urgent
+
+    first, normal, urgent = asyncio.run(scenario())
+    assert first == 0 and normal > 0 and urgent == 0
+
+
+def test_urgent_calls_skip_the_users_budget():
+    async def scenario():
+        limit = limiter(user_rate_per_min=60, user_burst=1)
+        await limit.acquire("u1")
+        llm_urgent.set(True)
+        return await limit.acquire("u1"), limit.stats
+
+    waited, stats = asyncio.run(scenario())
+    assert waited == 0 and stats["urgent_calls"] == 1
+
+
+def test_retry_after_is_honoured_by_every_caller():
+    async def scenario():
+        limit = limiter()
+        call, calls = flaky(ProviderError(429, {"retry-after": "0.2"}))
+        result = await limit.call(call)
+        # a call coming in meanwhile waits out the rest of the pause too
+        started = time.monotonic()
+        limit.blocked_until = started + 0.05
+        await limit.acquire()
+        return result, calls, time.monotonic() - started, limit.stats
+
+    result, calls, paused, stats = asyncio.run(scenario())
+    assert result == "ok" and calls[1] - calls[0] >= 0.19
+    assert paused >= 0.04
+    assert stats["provider_rate_limited"] == 1 and stats["retries"] == 1
+
+
+def test_server_errors_and_timeouts_are_retried(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "BACKOFF_BASE", 0.001)
+
+    async def scenario():
+        limit = limiter()
+        call, calls = flaky(ProviderError(503), asyncio.TimeoutError())
+        return await limit.call(call), len(calls), limit.stats
+
+    result, attempts, stats = asyncio.run(scenario())
+    assert result == "ok" and attempts == 3 and stats["retries"] == 2
+
+
+def test_client_errors_are_not_retried():
+    async def scenario():
+        limit = limiter()
+        call, calls = flaky(ProviderError(400))
+        with pytest.raises(ProviderError):
+            await limit.call(call)
+        return len(calls)
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "BACKOFF_BASE", 0.001)
+
+    async def scenario():
+        limit = limiter(max_retries=2)
+        call, calls = flaky(*[ProviderError(500)] * 5)
+        with pytest.raises(Exception, match="multiple retries"):
+            await limit.call(call)
+        return len(calls), limit.stats["failures"]
+
+    assert asyncio.run(scenario()) == (2, 1)
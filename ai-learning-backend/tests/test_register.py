@@ -0,0 +1,52 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.main import app
+from app.services import jobs
+from app.services.jobs import MemoryJobBackend, QUEUED, job_queue
+
+STUDENT = {"name": "Ada Lovelace", "username": "ada", "email": "ada@example.com", "password": "correct horse"}
+
+
+@pytest.fixture
+def queue(db, monkeypatch):
+    # not started, submitted jobs stay queued
+    monkeypatch.setattr(job_queue, "backend", MemoryJobBackend())
+    return job_queue
+
+
+def call(*requests):
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await client.request(method, url, **kwargs) for method, url, kwargs in requests]
+
+    return asyncio.run(scenario())
+
+
+def test_register_without_image_keeps_an_empty_profile_image(queue):
+    [response] = call(("POST", "/auth/register", {"json": STUDENT}))
+    assert response.status_code == 201
+    body = response.json()
+    assert body["profile_image"] == ""
+    assert body["profile_image_status"] is None and body["profile_image_job_token"] is None
+
+
+def test_profile_image_job_is_polled_with_its_token(queue):
+    [response] = call(("POST", "/auth/register", {"json": {**STUDENT, "profile_image": "data:image/png;base64,AA=="}}))
+    body = response.json()
+    assert body["profile_image"] == "" and body["profile_image_status"] == "pending"
+    job_id, token = body["profile_image_job"], body["profile_image_job_token"]
+
+    anonymous, wrong, polled = call(
+        ("GET", f"/jobs/{job_id}", {}),
+        ("GET", f"/jobs/{job_id}", {"params": {"token": "guess"}}),
+        ("GET", f"/jobs/{job_id}", {"params": {"token": token}}),
+    )
+    assert anonymous.status_code == 404 and wrong.status_code == 404
+    assert polled.status_code == 200 and polled.json()["status"] == QUEUED
+    # the token itself isn't stored
+    stored = asyncio.run(queue.get(job_id))
+    assert token not in stored.values() and jobs.token_matches(stored, token)
@@ -0,0 +1,112 @@
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.chatbot import agent_chatbot, rescore
+
+
+class FakeLLM:
+    """Answers every assessment prompt with the same reply and keeps the prompts."""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.prompts = []
+
+    async def abatch(self, prompts, max_concurrency=None, return_exceptions=False):
+        self.prompts.extend(prompts)
+        return [self.reply(prompt) if callable(self.reply) else self.reply for prompt in prompts]
+
+
+def reply(**fields):
+    content = {"estimated_age": 15, "confidence": 7, "category": "teen", "indicators": [],
+               "urgency_score": 3, "primary_concern": "academic", "risk_level": "low",
+               "emotional_state": "calm", "needs_immediate_help": False, **fields}
+    return SimpleNamespace(content=json.dumps(content))
+
+
+def session(_id, message, **values):
+    return {"_id": _id, "values": {
+        "age_assessment_complete": True, "age_answers": ["I like maths"], "first_user_message": message,
+        "estimated_age": 15, "age_category": "teen", "risk_level": "low", "primary_concern": "academic",
+        **values,
+    }}
+
+
+@pytest.fixture(autouse=True)
+def bulk_write(db, monkeypatch):
+    # mongomock's bulk_write doesn't take the UpdateOne of current pymongo, apply them one by one
+    async def apply(self, requests, ordered=True):
+        for request in requests:
+            await self.update_one(request._filter, request._doc)
+
+    monkeypatch.setattr(type(db["chat_checkpoints"]), "bulk_write", apply)
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    fake = FakeLLM(reply())
+    monkeypatch.setattr(agent_chatbot, "llm", fake)
+    return fake
+
+
+def rescore_all(db, dry_run=False):
+    async def scenario():
+        run = await rescore.create_run(db, dry_run=dry_run)
+        return await rescore.rescore_assessments(run["_id"], db)
+
+    return asyncio.run(scenario())
+
+
+def stored(db, _id):
+    return asyncio.run(db["chat_checkpoints"].find_one({"_id": _id}))["values"]
+
+
+def test_risky_wording_keeps_its_floor(db, llm):
+    asyncio.run(db["chat_checkpoints"].insert_one(session("s1", "I want to kill myself")))
+    report = rescore_all(db)
+    values = stored(db, "s1")
+    # the LLM said low, the wording says high
+    assert values["risk_level"] == "high"
+    assert report["changed"] == 1
+    assert "risk level is already known: high" in llm.prompts[0]
+
+
+def test_stored_high_risk_can_be_lowered(db, llm):
+    asyncio.run(db["chat_checkpoints"].insert_one(session("s1", "school is fine", risk_level="high")))
+    report = rescore_all(db)
+    # the old assessment's own output is no floor for the new one
+    assert stored(db, "s1")["risk_level"] == "low"
+    assert report["changed"] == 1
+
+
+def test_risky_answer_keeps_its_floor(db, llm):
+    asyncio.run(db["chat_checkpoints"].insert_one(session(
+        "s1", "school is fine", risk_level="high", age_answers=["I like maths", "I don't want to live anymore"]
+    )))
+    rescore_all(db)
+    assert stored(db, "s1")["risk_level"] == "high"
+
+
+def test_risk_or_concern_change_counts_as_changed(db, llm):
+    asyncio.run(db["chat_checkpoints"].insert_many([
+        session("same", "school is fine"),
+        session("concern", "school is fine", primary_concern="stress"),
+        session("risk", "school is fine", risk_level="medium"),
+    ]))
+    llm.reply = lambda prompt: reply()
+    report = rescore_all(db)
+    assert report["processed"] == 3 and report["updated"] == 3
+    assert report["changed"] == 2
+
+
+def test_dry_run_and_unparsed_replies_write_nothing(db, llm):
+    asyncio.run(db["chat_checkpoints"].insert_one(session("s1", "school is fine", estimated_age=30)))
+    report = rescore_all(db, dry_run=True)
+    assert report["changed"] == 1 and stored(db, "s1")["estimated_age"] == 30
+
+    llm.reply = SimpleNamespace(content="not json")
+    report = rescore_all(db)
+    assert report["failed"] == 1 and report["updated"] == 0
+    assert "rescored" not in asyncio.run(db["chat_checkpoints"].find_one({"_id": "s1"}))
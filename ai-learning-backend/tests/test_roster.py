@@ -0,0 +1,143 @@
+import json
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from app import mongo_db
+from app.authentication import accounts
+from app.services import roster
+from app.services.roster import import_roster, iter_lines, iter_rows
+
+HEADER = "name,username,email,password\n"
+
+
+async def chunks(data: bytes, size=5):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def rows(text: str, fmt="csv", size=5):
+    async def collect():
+        return [row async for row in iter_rows(iter_lines(chunks(text.encode("utf-8-sig"), size)), fmt)]
+
+    return asyncio.run(collect())
+
+
+def student(n):
+    return f"Student {n},student{n},student{n}@school.example.com,correct horse\n"
+
+
+def test_csv_rows_with_header_aliases_and_bom():
+    parsed = rows("Full Name,Username,Email,Password\r\nAda Lovelace,ada,ada@example.com,pw\r\n")
+    assert parsed == [(2, {"full_name": "Ada Lovelace", "username": "ada", "email": "ada@example.com", "password": "pw"})]
+
+
+def test_quoted_fields_span_lines_and_keep_numbering():
+    text = HEADER + '"Lee,\nSam",sam,sam@example.com,"pass ""word""\nline two"\n\n' + student(3)
+    parsed = rows(text, size=3)
+    assert parsed[0] == (2, {"name": "Lee,\nSam", "username": "sam", "email": "sam@example.com",
+                             "password": 'pass "word"\nline two'})
+    # the multiline record took lines 2-4, line 5 is empty
+    assert parsed[1][0] == 6 and parsed[1][1]["username"] == "student3"
+
+
+def test_quote_inside_unquoted_field_is_literal():
+    parsed = rows(HEADER + 'Pat O"Neil,pat,pat@example.com,pw\n' + student(3))
+    assert parsed[0][1]["name"] == 'Pat O"Neil'
+    assert parsed[1][1]["username"] == "student3"
+
+
+def test_too_many_values_is_a_row_error():
+    assert rows(HEADER + "a,b,c,d,e\n") == [(2, "5 values for 4 columns")]
+
+
+def test_ndjson_rows():
+    text = json.dumps({"name": "A", "username": "a"}) + "\n{broken\n[1, 2]\n"
+    parsed = rows(text, "ndjson")
+    assert parsed[0] == (1, {"name": "A", "username": "a"})
+    assert parsed[1][0] == 2 and parsed[1][1].startswith("Invalid JSON")
+    assert parsed[2] == (3, "Expected a JSON object")
+
+
+@pytest.fixture(autouse=True)
+def fast_hashes(monkeypatch):
+    class Pool:
+        async def hash_many(self, passwords):
+            return [f"hashed:{p}" for p in passwords]
+
+    monkeypatch.setattr(roster, "bulk_hash_pool", Pool())
+
+
+def run_import(text, chunk_size=2):
+    return asyncio.run(import_roster(chunks(text.encode()), "csv", chunk_size))
+
+
+async def counts(db):
+    return [await db[name].count_documents({}) for name in ("users", "user_profiles", "user_courses", "user_progress")]
+
+
+def test_import_reports_duplicates_and_invalid_rows(db):
+    async def existing():
+        await accounts.ensure_user_indexes()
+        await db["users"].insert_one({"email": "student1@school.example.com", "username": "someone"})
+
+    asyncio.run(existing())
+    text = HEADER + student(1) + student(2) + student(2).replace("student2@", "other@") + "X,x,not-an-email,pw\n" + student(3)
+    report = run_import(text)
+    assert report["received"] == 5 and report["created"] == 2 and report["failed"] == 3
+    assert [(e["row"], e["error"]) for e in report["errors"]][:2] == [
+        (2, "Email already registered"), (4, "Username already taken earlier in the roster"),
+    ]
+    assert asyncio.run(counts(db)) == [3, 2, 2, 2]
+
+
+def test_missing_index_falls_back_to_lookup(db):
+    asyncio.run(db["users"].insert_one({"email": "student1@school.example.com", "username": "someone"}))
+    report = run_import(HEADER + student(1) + student(2))
+    assert report["created"] == 1 and report["errors"][0]["error"] == "Email already registered"
+
+
+def test_failed_companion_write_removes_the_students(db, monkeypatch):
+    courses = db["user_courses"]
+
+    class Broken:
+        def __getattr__(self, name):
+            return getattr(courses, name)
+
+        async def insert_many(self, docs, ordered=True):
+            # the second student's document is refused
+            await courses.insert_many(docs[:1])
+            raise BulkWriteError({"writeErrors": [{"index": 1, "code": 2, "errmsg": "refused"}]})
+
+    monkeypatch.setattr(mongo_db, "user_courses", Broken())
+    report = run_import(HEADER + student(1) + student(2), chunk_size=10)
+    assert report["created"] == 1
+    assert report["errors"] == [{"row": 3, "email": "student2@school.example.com", "error": roster.WRITE_FAILED}]
+    # no half-created account left behind
+    assert asyncio.run(counts(db)) == [1, 1, 1, 1]
+    assert asyncio.run(db["users"].find_one({"username": "student2"})) is None
+
+
+def test_failed_chunk_does_not_stop_the_roster(db, monkeypatch):
+    users = db["users"]
+    calls = []
+
+    class Flaky:
+        def __getattr__(self, name):
+            return getattr(users, name)
+
+        async def insert_many(self, docs, ordered=True):
+            calls.append(len(docs))
+            if len(calls) == 1:
+                # part of the chunk went in before the connection dropped
+                await users.insert_many(docs[:1])
+                raise ConnectionError("connection reset")
+            return await users.insert_many(docs, ordered=ordered)
+
+    monkeypatch.setattr(mongo_db, "user_collection", Flaky())
+    report = run_import(HEADER + "".join(student(n) for n in range(1, 6)), chunk_size=2)
+    assert calls == [2, 2, 1]
+    assert report["created"] == 3 and report["failed"] == 2
+    assert [e["row"] for e in report["errors"]] == [2, 3]
+    assert asyncio.run(counts(db)) == [3, 3, 3, 3]
@@ -0,0 +1,75 @@
+import json
+import asyncio
+from types import SimpleNamespace
+
+from app.services.chatbot.structured_output import (
+    AgeQuestion, AssessmentResult, QuestionBank, ainvoke_structured, close_json, extract_json, parse_structured,
+)
+
+
+def test_defaults_agree_with_each_other():
+    result = AssessmentResult()
+    assert (result.estimated_age, result.category) == (15, "teen")
+    assert result.risk_level == "medium"
+
+
+def test_plain_json_is_ok():
+    result, ok = parse_structured(json.dumps({"estimated_age": 12, "category": "child", "risk_level": "low"}),
+                                  AssessmentResult)
+    assert ok and result.estimated_age == 12 and result.category == "child" and result.risk_level == "low"
+
+
+def test_broken_json_is_repaired():
+    text = "Sure! ```json\n{'estimated_age': '14 years', 'category': 'Young Adult', 'needs_immediate_help': True,}\n```"
+    result, ok = parse_structured(text, AssessmentResult)
+    assert ok and result.estimated_age == 14 and result.category == "young_adult" and result.needs_immediate_help
+
+
+def test_reply_cut_off_mid_object():
+    text = '{"estimated_age": 16, "indicators": ["reasoning", "plan'
+    assert json.loads(close_json(text)) == {"estimated_age": 16, "indicators": ["reasoning", "plan"]}
+    assert extract_json('{"estimated_age": 16, "risk_level":') == {"estimated_age": 16}
+
+
+def test_unfixable_field_falls_back_to_its_default():
+    result, ok = parse_structured(json.dumps({"estimated_age": 30, "risk_level": "unclear"}), AssessmentResult)
+    assert ok and result.estimated_age == 30 and result.risk_level == "medium"
+
+
+def test_key_value_lines_with_old_labels():
+    result, ok = parse_structured("Age: 13\nAge Category: teen\nRisk: HIGH\nConcern: family issues", AssessmentResult)
+    assert ok
+    assert (result.estimated_age, result.risk_level, result.primary_concern) == (13, "high", "family")
+
+
+def test_labelled_prose_falls_back_to_from_text():
+    # "Note:" is no field, the question after it is still the answer
+    result, ok = parse_structured("Note: keep it simple.\nWhat would you do if a friend lied to you?", AgeQuestion)
+    assert ok and result.question == "What would you do if a friend lied to you?"
+
+
+def test_nothing_readable_fails_with_defaults():
+    result, ok = parse_structured("Note: I can't help with that.", AssessmentResult)
+    assert not ok and result == AssessmentResult()
+
+
+def test_question_bank_drops_broken_items():
+    bank, ok = parse_structured(json.dumps({"questions": [
+        {"dimension": "impulse control", "level": "ADV", "question": "Question 1: Would you wait?"},
+        {"dimension": "empathy"},
+    ]}), QuestionBank)
+    assert ok and len(bank.questions) == 1
+    assert bank.questions[0].level == "advanced" and bank.questions[0].question == "Would you wait?"
+
+
+def test_unreadable_reply_is_asked_for_once_more():
+    replies = iter(["I think they are about 14.", '{"estimated_age": 14, "category": "teen"}'])
+    prompts = []
+
+    async def invoke(prompt):
+        prompts.append(prompt)
+        return SimpleNamespace(content=next(replies))
+
+    result, ok = asyncio.run(ainvoke_structured(invoke, "Assess the user.", AssessmentResult))
+    assert ok and result.estimated_age == 14
+    assert len(prompts) == 2 and "I think they are about 14." in prompts[1]
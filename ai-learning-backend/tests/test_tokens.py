@@ -0,0 +1,156 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+from app.authentication import auth, tokens
+from app.authentication.tokens import RefreshTokens, RevocationList
+
+
+def payload(jti, family, sub="ada@example.com"):
+    return {"jti": jti, "fam": family, "sub": sub}
+
+
+@pytest.fixture
+def refresh(db):
+    return RefreshTokens()
+
+
+def test_rotation_uses_each_token_once(refresh):
+    async def scenario():
+        jti, family, _ = await refresh.issue("ada@example.com")
+        assert await refresh.rotate(payload(jti, family))
+        following, same_family, _ = await refresh.issue("ada@example.com", family)
+        assert same_family == family
+        assert await refresh.rotate(payload(following, family))
+
+    asyncio.run(scenario())
+
+
+def test_reuse_within_grace_is_a_second_tab(refresh):
+    async def scenario():
+        jti, family, _ = await refresh.issue("ada@example.com")
+        following, _, _ = await refresh.issue("ada@example.com", family)
+        assert await refresh.rotate(payload(jti, family))
+        assert await refresh.rotate(payload(jti, family))
+        # the family is still good
+        assert await refresh.rotate(payload(following, family))
+
+    asyncio.run(scenario())
+
+
+def test_replay_after_grace_revokes_the_family(db, refresh):
+    async def scenario():
+        jti, family, _ = await refresh.issue("ada@example.com")
+        assert await refresh.rotate(payload(jti, family))
+        following, _, _ = await refresh.issue("ada@example.com", family)
+        other, other_family, _ = await refresh.issue("ada@example.com")
+        used_at = tokens._now() - timedelta(seconds=tokens.REFRESH_REUSE_GRACE_SECONDS + 1)
+        await db[tokens.REFRESH_COLLECTION].update_one({"_id": jti}, {"$set": {"used_at": used_at}})
+
+        assert not await refresh.rotate(payload(jti, family))
+        # the token issued to whoever rotated first is gone too, other logins are not
+        assert not await refresh.rotate(payload(following, family))
+        assert await refresh.rotate(payload(other, other_family))
+
+    asyncio.run(scenario())
+
+
+def test_unknown_or_mismatched_token_is_refused(refresh):
+    async def scenario():
+        jti, family, _ = await refresh.issue("ada@example.com")
+        assert not await refresh.rotate(payload("made-up", family))
+        # a token presented with another family counts as a replay
+        assert not await refresh.rotate(payload(jti, "other"))
+
+    asyncio.run(scenario())
+
+
+def test_revoke_user_ends_every_family(refresh):
+    async def scenario():
+        first = await refresh.issue("ada@example.com")
+        second = await refresh.issue("ada@example.com")
+        bob = await refresh.issue("bob@example.com")
+        await refresh.revoke_user("ada@example.com")
+        assert not await refresh.rotate(payload(first[0], first[1]))
+        assert not await refresh.rotate(payload(second[0], second[1]))
+        assert await refresh.rotate(payload(bob[0], bob[1], "bob@example.com"))
+
+    asyncio.run(scenario())
+
+
+def test_revocations_reach_other_workers(db):
+    expires = tokens._now() + timedelta(minutes=30)
+    worker, other = RevocationList(), RevocationList()
+
+    async def scenario():
+        await worker.revoke_token("jti-1", expires)
+        await worker.revoke_user("ada@example.com", 3, expires)
+        # the revoking worker knows straight away
+        assert worker.is_revoked({"jti": "jti-1", "sub": "bob@example.com"})
+        assert not other.is_revoked({"jti": "jti-1", "sub": "bob@example.com"})
+        await other.sync()
+
+    asyncio.run(scenario())
+    for revocations in (worker, other):
+        assert revocations.is_revoked({"jti": "jti-1", "sub": "bob@example.com"})
+        assert revocations.is_revoked({"jti": "jti-2", "sub": "ada@example.com", "ver": 2})
+        assert not revocations.is_revoked({"jti": "jti-3", "sub": "ada@example.com", "ver": 3})
+        assert not revocations.is_revoked({"jti": "jti-4", "sub": "bob@example.com"})
+
+
+def test_user_version_never_goes_down(db):
+    expires = tokens._now() + timedelta(minutes=30)
+    revocations = RevocationList()
+
+    async def scenario():
+        await revocations.revoke_user("ada@example.com", 5, expires)
+        await revocations.revoke_user("ada@example.com", 2, expires)
+        fresh = RevocationList()
+        await fresh.sync()
+        return fresh
+
+    fresh = asyncio.run(scenario())
+    for worker in (revocations, fresh):
+        assert worker.is_revoked({"jti": "x", "sub": "ada@example.com", "ver": 4})
+
+
+def test_sync_drops_expired_entries(db):
+    revocations = RevocationList()
+
+    async def scenario():
+        await revocations.revoke_token("old", tokens._now() - timedelta(seconds=1))
+        await revocations.revoke_token("live", tokens._now() + timedelta(minutes=5))
+        await revocations.sync()
+
+    asyncio.run(scenario())
+    assert set(revocations.tokens) == {"live"}
+
+
+def kidless_token():
+    claims = {"sub": "ada@example.com", "typ": "access", "exp": tokens._now() + timedelta(minutes=5)}
+    return jwt.encode(claims, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+
+
+def use_keys(monkeypatch, spec):
+    kid, keys = auth.parse_keys(spec)
+    monkeypatch.setattr(auth, "SIGNING_KID", kid)
+    monkeypatch.setattr(auth, "SIGNING_KEYS", keys)
+    monkeypatch.setattr(auth, "LEGACY_KEY", auth.legacy_key(keys))
+
+
+@pytest.mark.parametrize("spec", ["", "new:fresh-secret,old:{secret}"])
+def test_kidless_tokens_verify_while_secret_key_is_listed(monkeypatch, spec):
+    use_keys(monkeypatch, spec.format(secret=auth.SECRET_KEY))
+    assert auth.decode_token(kidless_token())["sub"] == "ada@example.com"
+
+
+def test_kidless_tokens_retire_with_secret_key(monkeypatch):
+    use_keys(monkeypatch, "new:fresh-secret")
+    with pytest.raises(HTTPException) as e:
+        auth.decode_token(kidless_token())
+    assert e.value.status_code == 401
+    # tokens of the current key still work
+    assert auth.decode_token(auth.create_access_token({"sub": "ada@example.com"}))["sub"] == "ada@example.com"
@@ -0,0 +1,75 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from app.authentication import auth
+from app.authentication.auth import UserCache, resolve_user
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    fresh = UserCache(size=10, ttl=60)
+    monkeypatch.setattr(auth, "user_cache", fresh)
+    return fresh
+
+
+@pytest.fixture
+def users(db):
+    asyncio.run(db.users.insert_many([
+        {"email": "ada@example.com", "username": "ada", "hashed_password": "x", "profile": {"grade_level": 9}},
+        {"email": "bob@example.com", "username": "bob", "hashed_password": "y", "profile": {}},
+    ]))
+    return db.users
+
+
+def token(email, iat=1):
+    return {"sub": email, "iat": iat}
+
+
+def test_same_token_is_loaded_once(cache, users):
+    first = asyncio.run(resolve_user(token("ada@example.com")))
+    asyncio.run(users.delete_many({}))
+    again = asyncio.run(resolve_user(token("ada@example.com")))
+    assert again == first and "hashed_password" not in first
+    assert cache.stats == {"hits": 1, "misses": 1, "invalidations": 0}
+
+
+def test_a_new_token_is_a_miss(cache, users):
+    asyncio.run(resolve_user(token("ada@example.com", iat=1)))
+    asyncio.run(users.update_one({"email": "ada@example.com"}, {"$set": {"username": "ada2"}}))
+    # a fresh login reads the user again
+    assert asyncio.run(resolve_user(token("ada@example.com", iat=2)))["username"] == "ada2"
+
+
+def test_callers_get_their_own_copy(cache, users):
+    user = asyncio.run(resolve_user(token("ada@example.com")))
+    user["profile"]["grade_level"] = 12
+    assert asyncio.run(resolve_user(token("ada@example.com")))["profile"]["grade_level"] == 9
+
+
+def test_invalidate_drops_every_token_of_the_user(cache, users):
+    for payload in (token("ada@example.com", 1), token("ada@example.com", 2), token("bob@example.com")):
+        asyncio.run(resolve_user(payload))
+    cache.invalidate("ada@example.com")
+    assert cache.stats["invalidations"] == 2
+    assert cache.get(token("ada@example.com", 1)) is None
+    assert cache.get(token("bob@example.com")) is not None
+
+
+def test_unknown_user_is_401_and_not_cached(cache, users):
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(resolve_user(token("eve@example.com")))
+    assert e.value.status_code == 401 and len(cache.memory) == 0
+
+
+def test_stateless_tokens_need_no_lookup(cache, monkeypatch):
+    monkeypatch.setattr(auth, "AUTH_MODE", "stateless")
+    user = {"id": "u1", "email": "ada@example.com", "username": "ada", "full_name": "Ada",
+            "profile": {"grade_level": 9, "profile_image": ""}, "token_version": 2,
+            "created_at": datetime(2026, 1, 2, tzinfo=timezone.utc)}
+    # no database behind it
+    resolved = asyncio.run(resolve_user(auth.user_claims(user)))
+    assert resolved == user
+    assert cache.stats["misses"] == 0